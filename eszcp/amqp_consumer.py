@@ -0,0 +1,236 @@
+"""
+Class for consuming OpenStack notifications from RabbitMQ
+
+Wraps a pika BlockingConnection, reconnecting with backoff and
+
+acknowledging the processed messages in batches
+"""
+
+from eszcp import log
+import pika
+import time
+
+LOG = log.logger(__name__)
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+
+class Consumer(object):
+    """
+    Consume queues bound to exchanges, every queue over its own channel of
+    one shared connection
+
+    In durable mode the queues survive restarts of the proxy, messages are
+    acknowledged manually once processed, so the ones not acknowledged yet
+    are redelivered after a crash or a reconnection. Otherwise the queues
+    are exclusive and messages are consumed without acknowledgement.
+    """
+
+    def __init__(self, rabbit_host, rabbit_user, rabbit_pass, rabbit_port,
+                 durable=False, prefetch_count=100, ack_batch_size=50,
+                 ack_interval=1, reconnect_delay=1, reconnect_max_delay=60):
+        """
+        :param rabbit_host: rabbit host
+        :param rabbit_user: rabbit user
+        :param rabbit_pass: rabbit user password
+        :param rabbit_port: rabbit port
+        :param durable: consume durable queues with manual acknowledgements
+        :param prefetch_count: max unacknowledged messages delivered per queue
+        :param ack_batch_size: processed messages acknowledged at once
+        :param ack_interval: max seconds a processed message waits for
+                             its acknowledgement
+        :param reconnect_delay: seconds to wait before the first reconnection
+        :param reconnect_max_delay: max seconds to wait between reconnections
+        """
+        self.rabbit_host = rabbit_host
+        self.rabbit_user = rabbit_user
+        self.rabbit_pass = rabbit_pass
+        self.rabbit_port = rabbit_port
+        self.durable = str(durable).lower() in ('1', 'true', 'yes', 'on')
+        self.prefetch_count = int(prefetch_count)
+        self.ack_batch_size = int(ack_batch_size)
+        self.ack_interval = float(ack_interval)
+        self.reconnect_delay = float(reconnect_delay)
+        self.reconnect_max_delay = float(reconnect_max_delay)
+        self.connection = None
+        self.subscriptions = {}
+
+    def subscribe(self, exchange, queue, routing_keys, callback,
+                  holding=None, on_connect=None):
+        """
+        :param exchange: topic exchange to bind the queue to
+        :param queue: queue name
+        :param routing_keys: list of routing keys to bind
+        :param callback: function accepting (ch, method, properties, body)
+        :param holding: function returning True while the side effects of
+                        the processed messages are still pending, their
+                        acknowledgement is delayed meanwhile
+        :param on_connect: hook called after every (re)connection
+        """
+        self.subscriptions[queue] = {"exchange": exchange,
+                                     "queue": queue,
+                                     "routing_keys": routing_keys,
+                                     "callback": callback,
+                                     "holding": holding,
+                                     "on_connect": on_connect,
+                                     "channel": None,
+                                     "ack_timer": None,
+                                     # delivery tag of the last processed
+                                     # message not acknowledged yet
+                                     "last_tag": None,
+                                     "unacked": 0}
+
+    def run(self):
+        """
+        Consume messages forever, reconnecting with exponential backoff
+        """
+        delay = self.reconnect_delay
+        while True:
+            try:
+                self.connect()
+                delay = self.reconnect_delay
+                while self.connection is not None:
+                    self.connection.process_data_events()
+            except KeyboardInterrupt:
+                self.close()
+                raise
+            except Exception, ex:
+                LOG.error("Lost the connection to RabbitMQ(%s): %s, "
+                          "reconnecting in %s seconds"
+                          % (self.rabbit_host, ex, delay))
+            self.close()
+            time.sleep(delay)
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+    def connect(self):
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(
+                                    host=self.rabbit_host,
+                                    port=int(self.rabbit_port),
+                                    credentials=pika.PlainCredentials(
+                                        self.rabbit_user,
+                                        self.rabbit_pass)))
+        for subscription in self.subscriptions.values():
+            self.consume(subscription)
+        for subscription in self.subscriptions.values():
+            if subscription["on_connect"]:
+                subscription["on_connect"]()
+
+    def consume(self, subscription):
+        """
+        Open a channel of the connection for a subscription
+        """
+        channel = self.connection.channel()
+        subscription.update({"channel": channel,
+                             "ack_timer": None,
+                             "last_tag": None,
+                             "unacked": 0})
+        queue = subscription["queue"]
+        channel.exchange_declare(exchange=subscription["exchange"],
+                                 type='topic')
+        if self.durable:
+            channel.queue_declare(queue=queue, durable=True,
+                                  exclusive=False, auto_delete=False)
+            channel.basic_qos(prefetch_count=self.prefetch_count)
+        else:
+            channel.queue_declare(queue=queue, exclusive=True)
+        for routing_key in subscription["routing_keys"]:
+            channel.queue_bind(exchange=subscription["exchange"],
+                               queue=queue,
+                               routing_key=routing_key)
+
+        def on_message(ch, method, properties, body):
+            self.on_message(subscription, ch, method, properties, body)
+
+        channel.basic_consume(on_message,
+                              queue=queue,
+                              no_ack=not self.durable)
+        LOG.info("Consuming %s from RabbitMQ(%s), durable: %s"
+                 % (queue, self.rabbit_host, self.durable))
+
+    def close(self):
+        connection, self.connection = self.connection, None
+        for subscription in self.subscriptions.values():
+            subscription.update({"channel": None, "ack_timer": None})
+        if connection is None:
+            return
+        try:
+            connection.close()
+        except Exception, ex:
+            LOG.debug("Failed to close the connection to RabbitMQ: %s" % ex)
+
+    def add_timeout(self, deadline, callback):
+        """
+        :param deadline: seconds to wait before calling callback
+        :param callback: function called on the consuming loop
+        :return: the timer id, None if not connected
+        """
+        if self.connection is None:
+            return None
+        return self.connection.add_timeout(deadline, callback)
+
+    def remove_timeout(self, timer):
+        if self.connection is not None and timer is not None:
+            self.connection.remove_timeout(timer)
+
+    def on_message(self, subscription, ch, method, properties, body):
+        try:
+            subscription["callback"](ch, method, properties, body)
+        except Exception, ex:
+            if not self.durable:
+                raise
+            if not method.redelivered:
+                # Reconnect, the messages not acknowledged are redelivered
+                raise
+            # Failed again on redelivery, drop it rather than looping on it
+            LOG.error("Drop a message failed twice: %s" % ex)
+            ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+            return
+        if not self.durable:
+            return
+        subscription["last_tag"] = method.delivery_tag
+        subscription["unacked"] += 1
+        if subscription["unacked"] >= self.ack_batch_size:
+            self.ack_subscription(subscription)
+        self.schedule_ack(subscription)
+
+    def schedule_ack(self, subscription):
+        if subscription["last_tag"] is None or \
+                subscription["ack_timer"] is not None:
+            return
+
+        def on_ack_timer():
+            subscription["ack_timer"] = None
+            self.ack_subscription(subscription)
+            self.schedule_ack(subscription)
+
+        subscription["ack_timer"] = self.add_timeout(self.ack_interval,
+                                                     on_ack_timer)
+
+    def ack(self, queue):
+        """
+        Acknowledge all the processed messages of a queue at once, unless
+        the side effects of some of them are still pending
+
+        :param queue: queue name
+        """
+        self.ack_subscription(self.subscriptions[queue])
+
+    def ack_subscription(self, subscription):
+        if subscription["last_tag"] is None or \
+                subscription["channel"] is None:
+            return
+        holding = subscription["holding"]
+        if holding and holding():
+            return
+        subscription["channel"].basic_ack(
+            delivery_tag=subscription["last_tag"], multiple=True)
+        LOG.debug("Acknowledge %d messages of %s"
+                  % (subscription["unacked"], subscription["queue"]))
+        subscription["last_tag"] = None
+        subscription["unacked"] = 0
@@ -0,0 +1,383 @@
+"""
+Class for backfilling the history of Zabbix from Ceilometer
+
+Pulls the raw samples of a time range from Ceilometer in pages, averages
+
+them per polling interval locally, and sends them to Zabbix as history
+"""
+
+from eszcp import ceilometer_handler
+from eszcp import inventory
+from eszcp import log
+from eszcp import utils
+import argparse
+import heapq
+import itertools
+from multiprocessing.pool import ThreadPool
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LOG = log.logger(__name__)
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+
+def rollup(timestamps, volumes, start, interval):
+    """
+    Average samples per interval, vectorized with numpy when it is
+    installed
+
+    :param timestamps: timestamps(seconds since the epoch) of the samples
+    :param volumes: volumes of the samples
+    :param start: start of the first interval
+    :param interval: seconds of an interval
+    :return: list of (interval start, average) of the intervals having
+             samples, in time order
+    """
+    if not timestamps:
+        return []
+    if numpy is None:
+        sums = {}
+        for timestamp, volume in itertools.izip(timestamps, volumes):
+            index = int((timestamp - start) // interval)
+            if index < 0:
+                continue
+            total, count = sums.get(index, (0.0, 0))
+            sums[index] = (total + volume, count + 1)
+        return [(start + index * interval, total / count)
+                for index, (total, count) in sorted(sums.items())]
+    timestamps = numpy.asarray(timestamps, dtype=numpy.float64)
+    volumes = numpy.asarray(volumes, dtype=numpy.float64)
+    indexes = numpy.floor_divide(timestamps - start,
+                                 interval).astype(numpy.int64)
+    valid = indexes >= 0
+    indexes, volumes = indexes[valid], volumes[valid]
+    counts = numpy.bincount(indexes)
+    sums = numpy.bincount(indexes, weights=volumes)
+    filled = numpy.flatnonzero(counts)
+    return zip((start + filled * interval).tolist(),
+               (sums[filled] / counts[filled]).tolist())
+
+
+def parse_time(value):
+    """
+    :param value: a unix timestamp, or a UTC ISO 8601 time
+    :return: seconds since the epoch
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return utils.parse_isotime(value)
+
+
+class Backfill(object):
+    """
+    Backfill the metrics of the active instances in zabbix over a time
+    range, window after window
+
+    Every (instance, metric) has its own checkpoint, the end of the last
+    window sent to zabbix, saved in the inventory file. A backfill of the
+    same range interrupted resumes from the checkpoints.
+    """
+
+    def __init__(self, ceilometer, start, end, workers=4, page_size=10000,
+                 window=3600, batch_size=1000, metrics=None,
+                 instance_ids=None, checkpoint_interval=10, restart=False):
+        """
+        :param ceilometer: the ceilometer_handler.CeilometerHandler, whose
+                           limiters and circuit breakers cap the requests
+        :param start: start(seconds since the epoch) of the range
+        :param end: end(seconds since the epoch) of the range
+        :param workers: max windows queried concurrently
+        :param page_size: max raw samples fetched in one request
+        :param window: seconds of samples queried in one task
+        :param batch_size: max values in one "history data" request
+        :param metrics: the metrics to backfill, None means all
+        :param instance_ids: the instances to backfill, None means all
+        :param checkpoint_interval: seconds between two checkpoints
+        :param restart: ignore the checkpoints saved
+        """
+        self.ceilometer = ceilometer
+        self.start = float(start)
+        self.end = float(end)
+        self.workers = max(int(workers), 1)
+        self.page_size = int(page_size)
+        self.window = float(window)
+        self.metrics = metrics or (ceilometer_handler.NETWORK_METRICS +
+                                   ceilometer_handler.INSTANCE_METRICS)
+        self.instance_ids = set(instance_ids) if instance_ids else None
+        self.checkpoint_interval = float(checkpoint_interval)
+        self.restart = restart
+        self.sender = ceilometer.zabbix_sender
+        self.sender.batch_size = int(batch_size)
+        self.name = 'backfill:%d:%d' % (self.start, self.end)
+        # {(instance_id, metric): end of the last window sent}
+        self.done = {}
+        # (instance_id, metric) failed in this run, not checkpointed anymore
+        self.failed = set()
+        self.sent = 0
+        # Values the sender dropped when the last checkpoint was saved, the
+        # sender flushes by itself whenever its buffer is full
+        self.checkpoint_dropped = self.sender.dropped
+
+    def run(self):
+        """
+        :return: the number of values sent to zabbix
+        """
+        ceilometer = self.ceilometer
+        ceilometer.sync_inventory()
+        instances = [instance for instance in
+                     ceilometer.active_instances(
+                         ceilometer.host_list,
+                         ceilometer.all_instance_details())
+                     if self.instance_ids is None or
+                     instance['id'] in self.instance_ids]
+        if not self.restart:
+            self.load_checkpoint()
+        LOG.info("Backfill %d instances from %s to %s, numpy: %s"
+                 % (len(instances), utils.isotime(self.start),
+                    utils.isotime(self.end), numpy is not None))
+        pool = ThreadPool(self.workers)
+        checkpoint_at = time.time()
+        try:
+            for task, values in pool.imap(self.rollup_task,
+                                          self.tasks(instances)):
+                instance_id, metric, _, window_end, _ = task
+                key = (instance_id, metric)
+                if key in self.failed:
+                    continue
+                if values is None:
+                    # Resumed from its checkpoint by the next run
+                    self.failed.add(key)
+                    continue
+                for clock, counter_volume in values:
+                    ceilometer.send_data_zabbix(counter_volume, instance_id,
+                                                metric, clock)
+                self.sent += len(values)
+                self.done[key] = window_end
+                if time.time() - checkpoint_at >= self.checkpoint_interval:
+                    self.save_checkpoint()
+                    checkpoint_at = time.time()
+            self.save_checkpoint()
+        finally:
+            pool.terminate()
+        LOG.info("Backfill sent %d values, %d (instance, metric) failed"
+                 % (self.sent, len(self.failed)))
+        return self.sent
+
+    def tasks(self, instances):
+        """
+        The windows to query, in time order, so the checkpoints of all the
+        (instance, metric) move forward together
+
+        :param instances: the active nova instances
+        :return: an iterator of (instance_id, metric, window start,
+                 window end, interval)
+        """
+        ceilometer = self.ceilometer
+        per_key = []
+        for instance in instances:
+            tenant_id = instance.get('tenant_id')
+            for metric in self.metrics:
+                rule = ceilometer.policies.lookup(
+                    metric, tenant_id, ceilometer.tenant_names.get(tenant_id))
+                if rule.enabled:
+                    per_key.append(self.key_windows(instance['id'], metric,
+                                                    rule.interval))
+        return (task for _, task in heapq.merge(*per_key))
+
+    def key_windows(self, instance_id, metric, interval):
+        """
+        :return: an iterator of (window start, task) of an (instance,
+                 metric), the windows are aligned to its interval and
+                 start from its checkpoint
+        """
+        interval = float(interval)
+        window = max(self.window // interval, 1) * interval
+        start = max(self.start, self.done.get((instance_id, metric), 0))
+        start -= start % interval
+        end = self.end - self.end % interval
+        while start < end:
+            window_end = min(start + window, end)
+            yield start, (instance_id, metric, start, window_end, interval)
+            start = window_end
+
+    def rollup_task(self, task):
+        """
+        :param task: (instance_id, metric, window start, window end,
+                     interval)
+        :return: a tuple of (task, [(clock, counter_volume), ...]), the
+                 values are None if the task failed
+        """
+        instance_id, metric, start, end, interval = task
+        if (instance_id, metric) in self.failed:
+            return task, None
+        ceilometer = self.ceilometer
+        try:
+            if ceilometer_handler.METRIC_CACEHES.expired(
+                    instance_id, ceilometer.resource_discovery_ttl):
+                ceilometer.discover_resources(instance_id)
+            if metric in ceilometer_handler.NETWORK_METRICS:
+                resource_ids = [rsc_id for rsc_id in
+                                ceilometer_handler.METRIC_CACEHES[
+                                    instance_id].keys()
+                                if rsc_id.startswith('instance')]
+            else:
+                resource_ids = [instance_id]
+            # The values of all the nics of an instance are summed
+            totals = {}
+            for rsc_id in resource_ids:
+                timestamps, volumes = self.samples(rsc_id, metric, start,
+                                                   end)
+                for bucket, average in rollup(timestamps, volumes, start,
+                                              interval):
+                    totals[bucket] = totals.get(bucket, 0.0) + average
+        except Exception, ex:
+            LOG.error("Failed to backfill %s of %s from %s: %s"
+                      % (metric, instance_id, utils.isotime(start), ex))
+            return task, None
+        # A value is clocked at the end of its interval, as polled
+        return task, [(bucket + interval, totals[bucket])
+                      for bucket in sorted(totals)]
+
+    def samples(self, resource_id, metric, start, end):
+        """
+        Fetch the raw samples of a resource in pages of page_size, newest
+        first, every page ends where the previous one stopped
+
+        :return: a tuple of (timestamps, volumes)
+        """
+        timestamps = []
+        volumes = []
+        page_end = ('lt', utils.isotime(end))
+        # Samples of the page end already fetched, the next page includes
+        # the page end in case several samples share it
+        seen = set()
+        while True:
+            page = self.ceilometer.ceilometer_get(
+                self.ceilometer.samples_path(
+                    metric,
+                    [('resource_id', 'eq', resource_id),
+                     ('timestamp', 'ge', utils.isotime(start)),
+                     ('timestamp',) + page_end],
+                    limit=self.page_size))
+            new = [sample for sample in page
+                   if sample.get('message_id') not in seen]
+            for sample in new:
+                if sample.get('counter_volume') is None:
+                    continue
+                timestamps.append(utils.parse_isotime(sample['timestamp']))
+                volumes.append(sample['counter_volume'])
+            if len(page) < self.page_size:
+                break
+            if not new:
+                # A page full of the samples of the page end, skip the
+                # ones not fetched rather than fetching the same page again
+                LOG.warning("More than %d samples of %s share timestamp "
+                            "%s, skip some of them"
+                            % (self.page_size, resource_id, page_end[1]))
+                page_end = ('lt', page_end[1])
+                seen = set()
+                continue
+            oldest = min(new, key=lambda sample:
+                         utils.parse_isotime(sample['timestamp']))
+            shared = set(sample.get('message_id') for sample in new
+                         if sample['timestamp'] == oldest['timestamp'])
+            if page_end == ('le', oldest['timestamp']):
+                # The page end didn't move, keep the samples seen before
+                seen |= shared
+            else:
+                seen = shared
+            page_end = ('le', oldest['timestamp'])
+        return timestamps, volumes
+
+    def load_checkpoint(self):
+        checkpoint = self.ceilometer.inventory.load_snapshot(self.name)
+        if not checkpoint:
+            return
+        for instance_id, metric, done in checkpoint["done"]:
+            self.done[(instance_id, metric)] = done
+        LOG.info("Resume the backfill of %d (instance, metric) from their "
+                 "checkpoints" % len(self.done))
+
+    def save_checkpoint(self):
+        """
+        Flush the values to zabbix and save the checkpoints, unless zabbix
+        failed to receive some of the values sent since the last checkpoint
+        """
+        self.sender.flush()
+        if self.sender.dropped > self.checkpoint_dropped:
+            raise RuntimeError("Zabbix failed to receive %d values, resume "
+                               "the backfill once it is back"
+                               % (self.sender.dropped -
+                                  self.checkpoint_dropped))
+        self.ceilometer.inventory.save_snapshot(self.name, {
+            "start": self.start,
+            "end": self.end,
+            "done": [[instance_id, metric, done] for
+                     (instance_id, metric), done in self.done.items()]})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Backfill the history of Zabbix from the raw samples "
+                    "of Ceilometer")
+    parser.add_argument('--start', required=True, type=parse_time,
+                        help="start of the range, a unix timestamp or a "
+                             "UTC ISO 8601 time")
+    parser.add_argument('--end', type=parse_time, default=None,
+                        help="end of the range, default is now")
+    parser.add_argument('--instances', default='',
+                        help="comma separated instance uuids, default is "
+                             "all the active instances in zabbix")
+    parser.add_argument('--metrics', default='',
+                        help="comma separated meter names, default is all")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="max windows queried concurrently")
+    parser.add_argument('--page-size', type=int, default=10000,
+                        help="max raw samples fetched in one request")
+    parser.add_argument('--window', type=int, default=3600,
+                        help="seconds of samples queried in one task")
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="max values in one zabbix history request")
+    parser.add_argument('--restart', action='store_true',
+                        help="ignore the checkpoints of the same range")
+    args = parser.parse_args(argv)
+
+    # Imported here, importing proxy sets up its logging and configuration
+    from eszcp import proxy
+    http = proxy.http_client_from_conf()
+    shared_inventory = inventory.Inventory(proxy.conf_file.read_option(
+                                    'zcp_configs',
+                                    'inventory_path',
+                                    default=inventory.DEFAULT_PATH))
+    keystone_auth = proxy.keystone_auth_from_conf(http)
+    # The spool belongs to the poller, the backfill stops instead when
+    # zabbix is unreachable
+    ceilometer_hdl = proxy.ceilometer_handler_from_conf(http, keystone_auth,
+                                                        shared_inventory,
+                                                        spooled=False)
+    backfill = Backfill(ceilometer_hdl,
+                        args.start,
+                        args.end or time.time(),
+                        workers=args.workers,
+                        page_size=args.page_size,
+                        window=args.window,
+                        batch_size=args.batch_size,
+                        metrics=[metric.strip() for metric in
+                                 args.metrics.split(',') if metric.strip()],
+                        instance_ids=[instance_id.strip() for instance_id in
+                                      args.instances.split(',')
+                                      if instance_id.strip()],
+                        restart=args.restart)
+    backfill.run()
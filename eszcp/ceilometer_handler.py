@@ -5,12 +5,22 @@ This class provides means to requests for authentication
 tokens to be used with OpenStack's Ceilometer, Nova and RabbitMQ
 """
 
+from eszcp import circuit
+from eszcp import http_client
+from eszcp import inventory as inventory_store
+from eszcp import limiter
 from eszcp import log
+from eszcp import policy
+from eszcp import resource_cache
+from eszcp import scheduler
 from eszcp import utils
+from eszcp import zabbix_sender
+import hashlib
+import itertools
 import json
-import socket
-import struct
+from multiprocessing.pool import ThreadPool
 import time
+import urllib
 import urllib2
 
 LOG = log.logger(__name__)
@@ -58,8 +68,13 @@ NETWORK_METRICS = [
     },
   ...
  }
+ Deleted instances and resources gone are evicted, see ResourceCache
 """
-METRIC_CACEHES = {}
+METRIC_CACEHES = resource_cache.ResourceCache()
+
+# resource: one statistics query per resource and metric
+# groupby: one statistics query per metric, grouped by resource_id
+POLLING_MODES = ['resource', 'groupby']
 
 
 class CeilometerHandler:
@@ -67,7 +82,19 @@ class CeilometerHandler:
     def __init__(self, ceilometer_api_port, polling_interval,
                  template_name, ceilometer_api_host, zabbix_host,
                  zabbix_port, zabbix_proxy_name, nova_host,
-                 nova_port, admin_tenant_id, keystone_auth):
+                 nova_port, admin_tenant_id, keystone_auth,
+                 sender_batch_size=250, sender_flush_interval=5000,
+                 sender_max_retries=3, polling_workers=1,
+                 backend_max_requests=8, polling_mode='resource',
+                 groupby_per_tenant=False, http=None,
+                 inventory_refresh_interval=3600,
+                 resource_cache_size=20000, resource_miss_threshold=3,
+                 resource_discovery_ttl=3600, inventory=None,
+                 snapshot_interval=300, snapshot_max_age=86400,
+                 scheduler_tick=1, polling_batch_size=500, policies=None,
+                 first_poll_delay=60, limiters=None, sender_timeout=10,
+                 cycle_budget=60, breakers=None, spool=None,
+                 replay_batch_size=1000, replay_rate=2000, ingest_lag=60):
         """
         TODO
         :param ceilometer_api_port: ceilometer api port
@@ -81,7 +108,58 @@ class CeilometerHandler:
         :param nova_port: Openstack compute service, nova-api port
         :param admin_tenant_id: The admin_tenant of of keystone Default domain
         :param keystone_auth: keystone token_id
-        :no
+        :param sender_batch_size: max values in one zabbix history request
+        :param sender_flush_interval: max age(ms) of a buffered value
+        :param sender_max_retries: times to resend values failed in zabbix
+        :param polling_workers: size of the pool polling instances, 1 means
+                                polling them one after another
+        :param backend_max_requests: max in-flight requests per backend
+        :param polling_mode: 'resource' queries statistics per resource and
+                             metric, 'groupby' queries statistics per metric
+                             grouped by resource_id
+        :param groupby_per_tenant: in 'groupby' mode, query per metric and
+                                   per tenant instead of per metric
+        :param http: the shared http_client.HTTPClient
+        :param inventory_refresh_interval: max age(seconds) of the inventory
+                                           before it is re-pulled from zabbix
+        :param resource_cache_size: max instances in METRIC_CACEHES
+        :param resource_miss_threshold: consecutive /v2/resources responses
+                                        a resource may be missing from
+                                        before it is evicted
+        :param resource_discovery_ttl: seconds the discovered resources of
+                                       an instance are trusted for
+        :param inventory: the inventory.Inventory shared by the processes,
+                          default is an in-memory one of this process
+        :param snapshot_interval: seconds between two snapshots of the
+                                  poller state saved for warm restarts
+        :param snapshot_max_age: max age(seconds) of a snapshot loaded on
+                                 a warm restart
+        :param scheduler_tick: min seconds between two ticks of the
+                               scheduler, the keys due meanwhile are
+                               polled together
+        :param polling_batch_size: max instances(or metrics in 'groupby'
+                                   mode) polled in a tick
+        :param policies: the policy.PolicySet deciding the interval, enabled
+                         state and priority of every metric and tenant
+        :param first_poll_delay: seconds a new instance is first polled
+                                 after, so ceilometer has samples of it
+        :param limiters: {"ceilometer": limiter.AdaptiveLimiter,
+                          "nova": limiter.AdaptiveLimiter}, default ones
+                         allow backend_max_requests in flight
+        :param sender_timeout: max seconds to connect to the zabbix trapper
+                               and to read a response of it
+        :param cycle_budget: max seconds a tick polls for, the keys due not
+                             polled by then are deferred to the next tick,
+                             0 means unlimited
+        :param breakers: the circuit.CircuitBreakers of the backends and
+                         of the ceilometer meters
+        :param spool: the spool.Spool keeping the values zabbix failed to
+                      receive until it is back, None means they are dropped
+        :param replay_batch_size: max spooled values replayed at once
+        :param replay_rate: max spooled values replayed per second
+        :param ingest_lag: seconds a polling window closes before now, so
+                           the samples ceilometer stores late are still
+                           polled
         """
         self.ceilometer_api_port = ceilometer_api_port
         self.polling_interval = int(polling_interval)
@@ -94,63 +172,555 @@ class CeilometerHandler:
         self.zabbix_proxy_name = zabbix_proxy_name
         self.admin_tenant_id = admin_tenant_id
         self.keystone_auth = keystone_auth
+        self.http = http or http_client.HTTPClient()
+        # Fail fast the requests of a backend(or a meter) which failed
+        # repeatedly, until a probe tells it recovered
+        self.breakers = breakers or circuit.CircuitBreakers()
+        self.zabbix_sender = zabbix_sender.ZabbixSender(
+            zabbix_host,
+            zabbix_port,
+            zabbix_proxy_name,
+            batch_size=sender_batch_size,
+            flush_interval=sender_flush_interval,
+            max_retries=sender_max_retries,
+            timeout=sender_timeout,
+            breaker=self.breakers.get('zabbix-trapper',
+                                      circuit.is_connection_error),
+            spool=spool,
+            replay_batch_size=replay_batch_size,
+            replay_rate=replay_rate)
+        if polling_mode not in POLLING_MODES:
+            raise ValueError("Invalid polling_mode: %s" % polling_mode)
+        self.polling_mode = polling_mode
+        self.groupby_per_tenant = str(groupby_per_tenant).lower() in \
+            ('true', '1', 'yes')
+        self.polling_workers = int(polling_workers)
+        # The inventory of zabbix hosts, see get_hosts_ID, loaded from the
+        # shared inventory at inventory_version
+        self.inventory = inventory or inventory_store.Inventory(
+            inventory_store.MEMORY)
+        self.inventory_version = None
+        self.host_list = None
+        self.inventory_digest = None
+        self.inventory_refreshed_at = 0
+        self.inventory_refresh_interval = int(inventory_refresh_interval)
+        # Active instances known to be missing in zabbix at the last refresh
+        self.inventory_absent = set()
+        METRIC_CACEHES.configure(resource_cache_size, resource_miss_threshold)
+        METRIC_CACEHES.add_listener(self.resources_evicted)
+        self.resource_discovery_ttl = int(resource_discovery_ttl)
+        # High-water marks, the end of the last window with samples of
+        # (resource_id, metric)
+        self.high_water = {}
+        self.pool = None
+        self.snapshot_interval = int(snapshot_interval)
+        self.snapshot_max_age = int(snapshot_max_age)
+        self.snapshot_saved_at = time.time()
+        # Every instance(or metric in groupby mode) is polled on its own
+        # due time, spread across the polling interval
+        self.scheduler = scheduler.DeadlineScheduler(self.polling_interval)
+        self.scheduler_tick = float(scheduler_tick)
+        self.polling_batch_size = int(polling_batch_size)
+        # The active nova instances in zabbix, keyed by instance uuid,
+        # re-fetched from nova every polling interval
+        self.instances = {}
+        self.instances_refreshed_at = 0
+        self.policies = policies or policy.PolicySet(
+            default_interval=self.polling_interval)
+        # The tenant names, keyed by tenant id, loaded from the inventory
+        self.tenant_names = {}
+        self.first_poll_delay = float(first_poll_delay)
+        # Hosts created since the last tick, polled without waiting for
+        # the next refresh of instances
+        self.created_hosts = set()
+        # Limit the rate and in-flight requests of each backend, shared by
+        # all workers
+        self.limiters = limiters or dict(
+            (name, limiter.AdaptiveLimiter(name,
+                                           max_limit=backend_max_requests))
+            for name in ['ceilometer', 'nova'])
+        self.cycle_budget = float(cycle_budget)
+        self.ingest_lag = max(float(ingest_lag), 0)
+        # Timestamp the current tick must stop polling at, None if unbounded
+        self.cycle_deadline = None
 
     def interval_run(self, func=None):
         """
         :param func: loop execute function
         """
         LOG.info("********** Polling Ceilometer Metric Into Zabbix **********")
+        self.load_snapshot()
         while True:
-            self.run()
-            time.sleep(self.polling_interval)
+            try:
+                self.run()
+            except Exception, ex:
+                # A failing backend must not kill the polling process
+                LOG.error("Failed to poll Ceilometer: %s" % ex)
+            self.wait()
+
+    def wait(self):
+        """
+        Sleep until the next key is due, at least scheduler_tick seconds
+        so the keys due close together are polled in one batch
+
+        The sleep is checked every scheduler_tick(or first_poll_delay if
+        shorter) seconds, and cut short once the inventory changed, so the
+        hosts created meanwhile are scheduled without waiting for the keys
+        due, or a whole polling interval with nothing scheduled
+        """
+        now = time.time()
+        next_due = self.scheduler.next_due()
+        if next_due is None:
+            next_due = now + self.polling_interval
+        wake_at = min(max(next_due, now + self.scheduler_tick),
+                      now + self.polling_interval)
+        step = min(self.scheduler_tick, self.first_poll_delay) or \
+            self.scheduler_tick
+        while True:
+            delay = wake_at - time.time()
+            if delay <= 0:
+                return
+            if step > 0:
+                delay = min(delay, step)
+            time.sleep(delay)
+            if self.inventory.version() != self.inventory_version:
+                return
 
     def run(self):
+        """
+        A tick of the scheduler, poll the instances(or metrics in groupby
+        mode) due, most overdue first, within cycle_budget seconds
+        """
+        if self.cycle_budget > 0:
+            self.cycle_deadline = time.time() + self.cycle_budget
+        # The token is cached by keystone_auth, refreshed before it expires
         self.token = self.keystone_auth.getToken()
-        # Timer(self.polling_interval, self.run, ()).start()
-        host_list = self.get_hosts_ID()
-        self.update_zabbix_values(host_list)
+        self.sync_inventory()
+        # Before a refresh of instances, which keeps the first polls
+        # scheduled for the hosts created
+        if self.created_hosts:
+            self.schedule_created_hosts()
+        if time.time() - self.instances_refreshed_at >= \
+                self.polling_interval:
+            self.refresh_instances()
+        popped_at = time.time()
+        due = self.scheduler.pop_due(popped_at,
+                                     limit=self.polling_batch_size or None)
+        deadline = self.cycle_deadline
+        try:
+            if due:
+                deferred = set(self.poll_due([key for key, _ in due]))
+                self.defer([(key, lag) for key, lag in due
+                            if key in deferred], popped_at)
+        finally:
+            self.cycle_deadline = None
+            # ship the values collected in this tick
+            self.zabbix_sender.flush()
+        # replay the values spooled while zabbix was unreachable, within
+        # what is left of the tick
+        self.zabbix_sender.replay(deadline)
+        self.report_lag(due)
+        if time.time() - self.snapshot_saved_at >= self.snapshot_interval:
+            self.save_snapshot()
+
+    def refresh_instances(self):
+        """
+        Re-fetch the nova instances, and schedule the ones to poll
+        """
+        instances = self.all_instance_details()
+        if self.inventory_drifted(instances):
+            self.refresh_inventory(instances)
+        # Evict the instances gone from nova
+        METRIC_CACEHES.retain(instance['id'] for instance in instances)
+        self.instances = dict((instance['id'], instance) for instance in
+                              self.active_instances(self.host_list,
+                                                    instances))
+        self.scheduler.sync(self.polling_keys(self.instances.values()))
+        self.instances_refreshed_at = time.time()
+        LOG.info("Metric caches: %(size)d instances, %(hits)d hits, "
+                 "%(misses)d misses, %(evictions)d evictions"
+                 % METRIC_CACEHES.stats())
+        self.report_limits()
+
+    def report_limits(self):
+        """
+        Report the current limits of the backends
+        """
+        for name in sorted(self.limiters):
+            LOG.info("Backend %(name)s: concurrency limit %(limit)d of "
+                     "%(max_limit)d, rate limit %(rate)s/s, %(requests)d "
+                     "requests, %(overloads)d overloads, throttled "
+                     "%(throttled).1f seconds"
+                     % self.limiters[name].stats())
+        for stats in self.breakers.stats():
+            LOG.warning("Circuit %(name)s is %(state)s: %(failures)d "
+                        "failures, opened %(opened)d times, rejected "
+                        "%(rejected)d requests" % stats)
+
+    def schedule_created_hosts(self):
+        """
+        Fast path of the hosts created by nova events: fetch their instances
+        and schedule their first poll first_poll_delay seconds later,
+        instead of waiting for the next refresh of instances
+        """
+        created, self.created_hosts = self.created_hosts, set()
+        instances = []
+        for instance_id in created - set(self.instances):
+            instance = self.instance_detail(instance_id)
+            if instance is not None and utils.is_active(instance):
+                instances.append(instance)
+        if not instances:
+            return
+        for instance in instances:
+            self.instances[instance['id']] = instance
+        self.scheduler.add(self.polling_keys(instances),
+                           time.time() + self.first_poll_delay)
+        LOG.info("Schedule the first poll of new instances: %s"
+                 % ", ".join(instance['id'] for instance in instances))
+
+    def polling_keys(self, instances):
+        """
+        The keys scheduled, with the interval and priority of the policy
+        applying to them. The metrics disabled by the policies are never
+        scheduled.
+
+        :param instances: the active nova instances
+        :return: {key: (interval, priority)}, key is (instance_id, policy
+                 name), or (metric, tenant_id) in groupby mode
+        """
+        keys = {}
+        if self.polling_mode == 'groupby':
+            for metric, tenant_id in self.grouped_tasks(instances):
+                rule = self.policies.lookup(metric, tenant_id,
+                                            self.tenant_names.get(tenant_id))
+                if rule.enabled:
+                    keys[(metric, tenant_id)] = (rule.interval,
+                                                 rule.priority)
+            return keys
+        for instance in instances:
+            for rule in self.instance_policies(instance):
+                keys[(instance['id'], rule.name)] = (rule.interval,
+                                                     rule.priority)
+        return keys
+
+    def instance_policies(self, instance):
+        """
+        :param instance: a nova instance, normally is a dict
+        :return: {policy: [metric, ...]} of the metrics enabled
+        """
+        tenant_id = instance.get('tenant_id')
+        return self.policies.metric_groups(NETWORK_METRICS + INSTANCE_METRICS,
+                                           tenant_id,
+                                           self.tenant_names.get(tenant_id))
+
+    def poll_due(self, keys):
+        """
+        :param keys: (instance_id, policy name), or (metric, tenant_id) in
+                     groupby mode
+        :return: the keys not polled before the deadline of the tick
+        """
+        deferred = []
+        if self.polling_mode == 'groupby':
+            values = self.polling_grouped_metrics(self.instances.values(),
+                                                  tasks=keys,
+                                                  deferred=deferred)
+            for instance_id, metric, counter_volume in values:
+                self.send_data_zabbix(counter_volume, instance_id, metric)
+            return deferred
+        tasks = []
+        for key in keys:
+            instance = self.instances.get(key[0])
+            if instance is None:
+                continue
+            for rule, metrics in self.instance_policies(instance).items():
+                if rule.name == key[1]:
+                    tasks.append((key, instance, metrics, rule.interval))
+
+        def _poll(task):
+            key, instance, metrics, interval = task
+            # The workers skip the tasks left once the tick ran out of time
+            if self.deadline_passed():
+                return key, None
+            try:
+                return key, self.poll_instance(instance, metrics, interval)
+            except circuit.CircuitOpen, ex:
+                LOG.debug("Skip polling %s: %s" % (instance['id'], ex))
+            except Exception, ex:
+                LOG.error("Failed to poll %s: %s" % (instance['id'], ex))
+            # Polled again at its next slot
+            return key, []
+        # Instances are polled by the workers concurrently, but their
+        # values are sent to zabbix in the order they were due
+        for key, values in self.map(_poll, tasks):
+            if values is None:
+                deferred.append(key)
+                continue
+            for instance_id, metric, counter_volume in values:
+                self.send_data_zabbix(counter_volume, instance_id, metric)
+        return deferred
+
+    def deadline_passed(self):
+        """
+        :return: whether the current tick ran out of its cycle_budget
+        """
+        return self.cycle_deadline is not None and \
+            time.time() >= self.cycle_deadline
+
+    def defer(self, keys, popped_at):
+        """
+        Defer the keys not polled in time to the next tick, recorded as
+        skipped, instead of blocking the tick until they are polled
+
+        :param keys: list of (key, lag) not polled
+        :param popped_at: the timestamp the keys were popped at
+        """
+        if not keys:
+            return
+        self.scheduler.defer(keys, popped_at)
+        LOG.warning("Cycle budget of %.1f seconds ran out, deferred %d keys "
+                    "to the next tick: %s"
+                    % (self.cycle_budget, len(keys),
+                       ", ".join(str(key) for key, _ in keys[:10])))
+
+    def report_lag(self, due):
+        """
+        Report how far polling lags behind the schedule
+
+        :param due: list of (key, lag) polled in this tick
+        """
+        if due:
+            LOG.debug("Polled %d keys, max lag %.1f seconds"
+                      % (len(due), max(lag for _, lag in due)))
+        overdue, max_lag = self.scheduler.overdue()
+        # Keys getting due while polling are not late yet
+        if overdue and max_lag > self.scheduler_tick:
+            LOG.warning("Polling lags behind: %d keys overdue, max lag "
+                        "%.1f seconds, %d slots skipped and %d polls "
+                        "deferred so far"
+                        % (overdue, max_lag, self.scheduler.skipped,
+                           self.scheduler.deferred))
+
+    def save_snapshot(self):
+        """
+        Save METRIC_CACEHES and the high-water marks, so a restart doesn't
+        re-discover the resources of all instances
+        """
+        self.inventory.save_snapshot('poller', {
+            "resources": METRIC_CACEHES.snapshot(),
+            "high_water": [[resource_id, metric, end] for
+                           (resource_id, metric), end in
+                           self.high_water.items()],
+            "inventory_digest": self.inventory_digest,
+            "inventory_refreshed_at": self.inventory_refreshed_at})
+        self.snapshot_saved_at = time.time()
+
+    def load_snapshot(self):
+        """
+        Load the snapshot saved by the last run, the inventory is loaded
+        from the shared inventory
+        """
+        snapshot = self.inventory.load_snapshot('poller',
+                                                self.snapshot_max_age)
+        if not snapshot:
+            return
+        self.sync_inventory()
+        METRIC_CACEHES.restore(snapshot["resources"], self.host_list)
+        for resource_id, metric, end in snapshot["high_water"]:
+            self.high_water[(resource_id, metric)] = end
+        self.inventory_digest = snapshot["inventory_digest"]
+        self.inventory_refreshed_at = snapshot["inventory_refreshed_at"]
+        LOG.info("Warm start, loaded %d hosts and %d instances cached"
+                 % (len(self.host_list), len(METRIC_CACEHES)))
+
+    def resources_evicted(self, instance_id, resource_ids):
+        """
+        Eviction hook of METRIC_CACEHES, forget the high-water marks of the
+        resources evicted, and of the instance itself once it is evicted as
+        a whole(deleted, gone from nova or least recently used)
+
+        :param instance_id: nova instance uuid
+        :param resource_ids: the resources evicted
+        """
+        resource_ids = list(resource_ids)
+        if instance_id not in METRIC_CACEHES:
+            resource_ids.append(instance_id)
+        for resource_id in resource_ids:
+            for metric in NETWORK_METRICS + INSTANCE_METRICS:
+                self.high_water.pop((resource_id, metric), None)
+
+    def host_created(self, instance_id, instance_name, host_id=None):
+        """
+        Record a host created in zabbix, may be called by other processes
+
+        :param instance_id: nova instance uuid
+        :param instance_name: zabbix visible name
+        :param host_id: zabbix hostid
+        """
+        self.hosts_changed(created=[(instance_id, instance_name, host_id)])
+
+    def host_deleted(self, instance_id):
+        """
+        Record a host deleted in zabbix, may be called by other processes
+
+        :param instance_id: nova instance uuid
+        """
+        self.hosts_changed(deleted=[instance_id])
+
+    def hosts_changed(self, created=None, deleted=None):
+        """
+        Record a batch of hosts created and deleted in zabbix as a single
+        inventory update, may be called by other processes
+
+        :param created: list of (instance_id, instance_name, host_id)
+        :param deleted: list of instance_id
+        """
+        self.inventory.update_hosts(created, deleted)
+
+    def topology_changed(self, instance_id):
+        """
+        Record a nic or volume attached to/detached from an instance, may be
+        called by other processes
+
+        :param instance_id: nova instance uuid
+        """
+        self.inventory.invalidate([instance_id])
+
+    def sync_inventory(self):
+        """
+        Reload the hosts from the shared inventory if it changed since they
+        were loaded, applying the deltas to METRIC_CACEHES
+        """
+        if self.inventory.version() == self.inventory_version:
+            return
+        version, hosts = self.inventory.hosts()
+        last_version = self.inventory_version or 0
+        for instance_id, host in hosts.items():
+            if host["invalidated"] > last_version:
+                METRIC_CACEHES.invalidate(instance_id)
+        if self.host_list is not None:
+            for instance_id in set(self.host_list) - set(hosts):
+                METRIC_CACEHES.evict(instance_id)
+                self.instances.pop(instance_id, None)
+            self.created_hosts |= set(hosts) - set(self.host_list)
+        self.inventory_absent -= set(hosts)
+        self.host_list = hosts
+        _, self.tenant_names = self.inventory.tenants()
+        self.inventory_version = version
+
+    def inventory_drifted(self, instances):
+        """
+        Cheap check whether the inventory should be re-pulled from zabbix:
+        it is older than inventory_refresh_interval, or an active nova
+        instance is missing in it
+
+        :param instances: nova instances
+        """
+        if self.host_list is None or \
+                time.time() - self.inventory_refreshed_at >= \
+                self.inventory_refresh_interval:
+            return True
+        missing = set(instance['id'] for instance in instances
+                      if utils.is_active(instance) and
+                      instance['id'] not in self.host_list)
+        return bool(missing - self.inventory_absent)
+
+    def refresh_inventory(self, instances):
+        """
+        Re-pull the inventory from the zabbix proxy config
+
+        :param instances: nova instances
+        """
+        hosts = self.get_hosts_ID()
+        if hosts is not self.host_list:
+            self.inventory.replace_hosts(hosts)
+            self.sync_inventory()
+        self.inventory_refreshed_at = time.time()
+        self.inventory_absent = set(instance['id'] for instance in instances
+                                    if utils.is_active(instance) and
+                                    instance['id'] not in self.host_list)
+        if self.inventory_absent:
+            LOG.debug("Active instances not in zabbix: %s"
+                      % ", ".join(self.inventory_absent))
 
     def get_hosts_ID(self):
         """
-        Method used do query Zabbix API in order to fill an Array of hosts
-        :return: returns a array of servers and items to monitor by server
+        Method used do query Zabbix API in order to fill the inventory of
+        hosts, the data structure is the following:
+         {"instance_id": {
+             "hostid": zabbix hostid,
+             "host": instance_id,
+             "name": zabbix visible name,
+             "items": [item_key, ...]
+             },
+          ...
+         }
+        :return: returns a dict of servers and items to monitor by server
         """
         data = {"request": "proxy config", "host": self.zabbix_proxy_name}
         payload = self.set_proxy_header(data)
-        response = self.connect_zabbix(payload)
-        hosts_id = []
-        items = []
-        for line in response['hosts']['data']:
-            for line2 in response['items']['data']:
-                if line2[4] == line[0]:
-                    items.append(line2[5])
-            hosts_id.append([line[0], line[1], items, line[7]])
-            items = []
+        response_raw = self.zabbix_sender.connect_raw(payload)
+        # Skip parsing the payload if nothing changed since the last pull
+        digest = hashlib.md5(response_raw).hexdigest()
+        if digest == self.inventory_digest and self.host_list is not None:
+            LOG.debug("The proxy config of zabbix is unchanged")
+            return self.host_list
+        response = json.loads(response_raw)
+        hosts = response['hosts']
+        items = response['items']
+        host_fields = self._field_index(hosts, hostid=0, host=1, name=7)
+        item_fields = self._field_index(items, hostid=4, key_=5)
+
+        # Group the items by hostid in a single pass
+        host_items = {}
+        for line in items['data']:
+            host_items.setdefault(line[item_fields['hostid']], []).append(
+                line[item_fields['key_']])
+
+        hosts_id = {}
+        for line in hosts['data']:
+            hostid = line[host_fields['hostid']]
+            hosts_id[line[host_fields['host']]] = {
+                "hostid": hostid,
+                "host": line[host_fields['host']],
+                "name": line[host_fields['name']],
+                "items": host_items.get(hostid, [])}
+        self.inventory_digest = digest
         return hosts_id
 
+    def _field_index(self, table, **defaults):
+        """
+        Get the column index of fields in a table of proxy config
+
+        :param table: a table of proxy config, {"fields": [], "data": [[]]}
+        :param defaults: field name and its default column index
+        :return: a dict of field name and column index
+        """
+        fields = table.get('fields') or []
+        return dict((name, fields.index(name) if name in fields else index)
+                    for name, index in defaults.items())
+
     def update_values(self, hosts_id):
         """
-        :param hosts_id: nova instance uuid
+        :param hosts_id: the inventory of hosts, keyed by nova instance uuid
         For Upstream OpenStack community, use this function
 
-        For EasyStack Ceilometer, this function is deprecated
-        Use the function of update_zabbix_values
+        For EasyStack Ceilometer, this function is deprecated, the
+        instances are polled on their own due times by run
         """
-        for host in hosts_id:
+        for host in hosts_id.values():
             links = []
-            if not host[1] == self.template_name:
+            if not host['host'] == self.template_name:
 
-                LOG.debug("Checking host:" + host[3])
+                LOG.debug("Checking host:" + host['name'])
                 # Get links for instance compute metrics
-                request = urllib2.urlopen(urllib2.Request(
+                resources = self.http.get_json(
                     "http://" + self.ceilometer_api_host + ":" +
                     self.ceilometer_api_port +
-                    "/v2/resources?q.field=resource_id&q.value=" + host[1],
-                    headers={"Accept": "application/json",
-                             "Content-Type": "application/json",
-                             "X-Auth-Token": self.token})).read()
+                    "/v2/resources?q.field=resource_id&q.value=" +
+                    host['host'],
+                    token=self.token)
                 # Filter the links to an array
-                for line in json.loads(request):
+                for line in resources:
                     for line2 in line['links']:
                         if line2['rel'] in ('cpu_util',
                                             'memory.usage',
@@ -168,17 +738,15 @@ class CeilometerHandler:
                             links.append(line2)
 
                 # Get the links regarding network metrics
-                request = urllib2.urlopen(urllib2.Request(
+                resources = self.http.get_json(
                     "http://" + self.ceilometer_api_host +
                     ":" + self.ceilometer_api_port +
                     "/v2/resources?q.field=metadata.instance_id&q.value=" +
-                    host[1],
-                    headers={"Accept": "application/json",
-                             "Content-Type": "application/json",
-                             "X-Auth-Token": self.token})).read()
+                    host['host'],
+                    token=self.token)
 
                 # Add more links to the array
-                for line in json.loads(request):
+                for line in resources:
                     for line2 in line['links']:
                         if line2['rel'] in ('network.incoming.bytes',
                                             'network.incoming.packets',
@@ -188,7 +756,8 @@ class CeilometerHandler:
 
                 # Query ceilometer API using the array of links
                 for line in links:
-                    self.query_ceilometer(host[1], line['rel'], line['href'])
+                    self.query_ceilometer(host['host'], line['rel'],
+                                          line['href'])
                     LOG.info("  - Item " + line['rel'])
 
     def query_ceilometer(self, resource_id, item_key, link):
@@ -199,12 +768,8 @@ class CeilometerHandler:
         """
         try:
             # global contents
-            contents = urllib2.urlopen(urllib2.Request(
-                    link + str("&limit=1"),
-                    headers={"Accept": "application/json",
-                             "Content-Type": "application/json",
-                             "X-Auth-Token": self.token})).read()
-            response = json.loads(contents)
+            response = self.http.get_json(link + str("&limit=1"),
+                                          token=self.token)
 
             counter_volume = response[0]['counter_volume']
             LOG.debug("Start sending resource_id: %s, metric: %s"
@@ -238,123 +803,18 @@ class CeilometerHandler:
         :param payload: refers to the json message prepared to send to Zabbix
         :rtype : returns the response received by the Zabbix API
         """
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((self.zabbix_host, int(self.zabbix_port)))
-        s.send(payload)
-        # read its response, the first five bytes are the header again
-        response_header = s.recv(5, socket.MSG_WAITALL)
-        if not response_header == 'ZBXD\1':
-            raise ValueError('Got invalid response')
-
-        # read the data header to get the length of the response
-        response_data_header = s.recv(8, socket.MSG_WAITALL)
-        response_data_header = response_data_header[:4]
-        response_len = struct.unpack('i', response_data_header)[0]
-
-        # read the whole rest of the response now that we know the length
-        response_raw = s.recv(response_len, socket.MSG_WAITALL)
-        s.close()
-        LOG.info(response_raw)
-        response = json.loads(response_raw)
-
-        return response
+        return self.zabbix_sender.connect(payload)
 
-    def update_zabbix_values(self, hosts_id):
+    def active_instances(self, hosts_id, instances):
         """
-        For ES metric collecor,
-        We don't storage sample in a same collection meter(
-        OpenStack community do it like this).
-
-        Accroding to the sample period,slice the meter collection
-        and collector metric
-        :param hosts_id: hosts in zabbix ,host_id is nova instance uuid
+        :param hosts_id: hosts in zabbix, keyed by nova instance uuid
+        :param instances: nova instances
+        :return: the active instances in zabbix
         """
-        def _all_instance_details():
-            try:
-                request = urllib2.urlopen(urllib2.Request(
-                    "http://" + self.nova_host + ":" + self.nova_port +
-                    "/v2/" + self.admin_tenant_id +
-                    "/servers/detail?all_tenants=1",
-                    headers={"Accept": "application/json",
-                             "Content-Type": "application/json",
-                             "X-Auth-Token": self.token}
-                )).read()
-                return json.loads(request).get("servers")
-            except urllib2.HTTPError, e:
-                if e.code == 401:
-                    msg = "Error... \nToken refused! " \
-                          "The request you have made requires authentication."
-                    LOG.error(msg)
-                    raise
-                elif e.code == 404:
-                    msg = "Can't found for instances for tenant: %s " \
-                           % self.admin_tenant_id
-                    LOG.error(msg)
-                    raise
-                elif e.code == 503:
-                    msg = "HTTP Error 503,The service of " \
-                          "ceilometer is unavailable"
-                    LOG.error(msg)
-                    raise
-                else:
-                    LOG.error("Unknown Error")
-                    raise
-            except Exception, ex:
-                LOG.error(ex.message)
-                raise
-        All_INSTANCES = _all_instance_details() or []
-        # Get all instance in zabbix recored
-        ZBX_HOSTS = [host[1] for host in hosts_id]
-        for instance in All_INSTANCES:
-            if instance['id'] in ZBX_HOSTS and utils.is_active(instance):
-                LOG.debug("Start Checking host : " + host[3])
-                # Get links for instance compute metrics
-                request = urllib2.urlopen(urllib2.Request(
-                    "http://" + self.ceilometer_api_host +
-                    ":" + self.ceilometer_api_port +
-                    "/v2/resources?q.field=metadata.instance_id&q.value=" +
-                    host[1],
-                    headers={"Accept": "application/json",
-                             "Content-Type": "application/json",
-                             "X-Auth-Token": self.token})).read()
-                resources = json.loads(request)
-
-                # Add a new instance and its metrics
-                if instance['id'] not in METRIC_CACEHES.keys():
-                    rs_items = {}
-                    for rs in resources:
-                        if rs['resource_id'].startswith('instance'):
-                            rs_items[rs['resource_id']] = NETWORK_METRICS
-                        # NOTE:remove disk metrics
-                        elif utils.endswith_words(rs['resource_id']):
-                            pass
-                        else:
-                            rs_items[rs['resource_id']] = INSTANCE_METRICS
-                    METRIC_CACEHES[instance['id']] = rs_items
-                # Update metric_caches where instance_in exists.For the case:
-                # instance add/remove a nic
-                # instance add/remove a volume
-                else:
-                    rs_items = METRIC_CACEHES[instance['id']]
-                    rs_item_keys = rs_items.keys()
-                    for rs in resources:
-                        if rs['resource_id'] not in rs_item_keys and \
-                           rs['resource_id'].startswith('instance'):
-                            rs_items[rs['resource_id']] = NETWORK_METRICS
-                            METRIC_CACEHES[instance['id']] = rs_items
-                        # NOTE:remove disk metrics
-                        elif rs['resource_id'] not in rs_item_keys and \
-                                utils.endswith_words(rs['resource_id']):
-                            pass
-                        else:
-                            continue
-                LOG.debug("Starting to polling %s(%s) metric into zabbix"
-                          % (instance.get('name'), instance.get('id')))
-                # Polling Ceilometer the latest samplei into zabbix
-                # CLI:ceilometer statistics -m {...} -q resource_id={...} -p ..
-                self.polling_metrics(instance['id'])
-                LOG.debug("Finshed to polling %s(%s) metric into zabbix"
-                          % (instance.get('name'), instance.get('id')))
+        active = []
+        for instance in instances:
+            if instance['id'] in hosts_id and utils.is_active(instance):
+                active.append(instance)
             else:
                 LOG.debug("Can't find the instance : %s(%s), "
                           "or the status of %s is not active"
@@ -362,32 +822,202 @@ class CeilometerHandler:
                              instance.get('id'),
                              instance.get('name'))
                           )
+        return active
+
+    def all_instance_details(self):
+        """
+        :return: all the nova instances of all tenants
+        """
+        try:
+            def _servers_detail(token):
+                with self.breakers.get('nova').guard(), \
+                        self.limiters['nova'].slot():
+                    return self.http.get_json(
+                        "http://" + self.nova_host + ":" +
+                        self.nova_port + "/v2/" + self.admin_tenant_id +
+                        "/servers/detail?all_tenants=1",
+                        token=token)
+            return self.keystone_auth.with_token(
+                _servers_detail).get("servers") or []
+        except urllib2.HTTPError, e:
+            if e.code == 401:
+                msg = "Error... \nToken refused! " \
+                      "The request you have made requires authentication."
+                LOG.error(msg)
+                raise
+            elif e.code == 404:
+                msg = "Can't found for instances for tenant: %s " \
+                       % self.admin_tenant_id
+                LOG.error(msg)
+                raise
+            elif e.code == 503:
+                msg = "HTTP Error 503,The service of " \
+                      "nova is unavailable"
+                LOG.error(msg)
+                raise
+            else:
+                LOG.error("Unknown Error")
+                raise
+        except Exception, ex:
+            LOG.error(ex.message)
+            raise
+
+    def instance_detail(self, instance_id):
+        """
+        :param instance_id: nova instance uuid
+        :return: the nova instance, None if it is gone
+        """
+        def _server_detail(token):
+            with self.breakers.get('nova').guard(), \
+                    self.limiters['nova'].slot():
+                return self.http.get_json(
+                    "http://" + self.nova_host + ":" +
+                    self.nova_port + "/v2/" + self.admin_tenant_id +
+                    "/servers/" + instance_id,
+                    token=token)
+        try:
+            return self.keystone_auth.with_token(_server_detail).get("server")
+        except urllib2.HTTPError, e:
+            if e.code == 404:
+                LOG.debug("Instance %s is gone" % instance_id)
+                return None
+            LOG.error("Failed to get instance %s: %s" % (instance_id, e))
+            return None
+
+    def map(self, func, iterable):
+        """
+        Apply func to every item of iterable with the polling workers
+
+        :param func: the function to apply
+        :param iterable: items to apply the function to
+        :return: an iterator of results, in the order of iterable
+        """
+        if self.polling_workers <= 1:
+            return itertools.imap(func, iterable)
+        # The pool is created lazily, in the polling process
+        if self.pool is None:
+            self.pool = ThreadPool(self.polling_workers)
+        return self.pool.imap(func, iterable)
+
+    def close(self):
+        """
+        Unregister the eviction hook from METRIC_CACEHES and stop the
+        polling workers
+        """
+        METRIC_CACEHES.remove_listener(self.resources_evicted)
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.terminate()
+
+    def poll_instance(self, instance, metrics=None, interval=None):
+        """
+        Discover the resources of an instance and poll its metrics
+
+        :param instance: a nova instance, normally is a dict
+        :param metrics: the metrics to poll, None means all
+        :param interval: the polling interval of the metrics
+        :return: list of (instance_id, metric, counter_volume)
+        """
+        LOG.debug("Start Checking host : " + instance['id'])
+        # The resources of an instance seldom change, re-discover them only
+        # when the TTL expires or an attach/detach event invalidates them
+        if METRIC_CACEHES.expired(instance['id'],
+                                  self.resource_discovery_ttl):
+            self.discover_resources(instance['id'])
+        LOG.debug("Starting to polling %s(%s) metric into zabbix"
+                  % (instance.get('name'), instance.get('id')))
+        # Polling Ceilometer the latest samplei into zabbix
+        # CLI:ceilometer statistics -m {...} -q resource_id={...} -p ..
+        values = self.polling_metrics(instance['id'], metrics, interval)
+        LOG.debug("Finshed to polling %s(%s) metric into zabbix"
+                  % (instance.get('name'), instance.get('id')))
+        return values
+
+    def discover_resources(self, instance_id):
+        """
+        Record the resources(nics, volumes) of an instance in METRIC_CACEHES
+
+        :param instance_id: nova instance uuid
+        """
+        # Get links for instance compute metrics
+        resources = self.ceilometer_get(
+            "/v2/resources?q.field=metadata.instance_id&q.value=" +
+            instance_id)
+
+        rs_items = {}
+        for rs in resources:
+            if rs['resource_id'].startswith('instance'):
+                rs_items[rs['resource_id']] = NETWORK_METRICS
+            # NOTE:remove disk metrics
+            elif utils.endswith_words(rs['resource_id']):
+                pass
+            else:
+                rs_items[rs['resource_id']] = INSTANCE_METRICS
+        # Add a new instance and its metrics, or update it for the case:
+        # instance add/remove a nic
+        # instance add/remove a volume
+        METRIC_CACEHES.update_resources(instance_id, rs_items)
 
-    def polling_metrics(self, instance_id):
+    def ceilometer_get(self, path):
+        """
+        Send a GET request to Ceilometer API, within the rate and
+        concurrency limits of the ceilometer backend
+
+        :param path: the request path, e.g. /v2/resources
+        :return: the json response of Ceilometer API
+        :raise circuit.CircuitOpen: when ceilometer failed repeatedly
+        """
+        def _get(token):
+            with self.breakers.get('ceilometer').guard(), \
+                    self.limiters['ceilometer'].slot():
+                return self.http.get_json(
+                    "http://" + self.ceilometer_api_host +
+                    ":" + self.ceilometer_api_port + path,
+                    token=token)
+        return self.keystone_auth.with_token(_get)
+
+    def polling_metrics(self, instance_id, metrics=None, interval=None):
         """
         :param instance_id: nova instance uuid
+        :param metrics: the metrics to poll, None means all
+        :param interval: the polling interval of the metrics
+        :return: list of (instance_id, metric, counter_volume)
         """
+        values = []
+
         def _polling(ids, METRICS):
             for metric in METRICS:
-                counter_volume = 0.0
+                if metrics is not None and metric not in metrics:
+                    continue
+                counter_volume = None
                 try:
                     for rsc_id in ids:
-                        contents = urllib2.urlopen(urllib2.Request(
-                            "http://" + self.ceilometer_api_host +
-                            ":" + self.ceilometer_api_port + "/v2/meters/" +
-                            metric + "/statistics?q.field=resource_id&" +
-                            "q.op=eq&q.type=&q.value=" + rsc_id + "&limit=1",
-                            headers={
-                                "Accept": "application/json",
-                                "Content-Type": "application/json",
-                                "X-Auth-Token": self.token})).read()
-                        response = json.loads(contents)
-                        if len(response) > 0:
-                            counter_volume += response[0]['avg']
+                        end = self.window_end()
+                        with self.meter_breaker(metric).guard():
+                            response = self.ceilometer_get(
+                                self.statistics_path(
+                                    metric,
+                                    [('resource_id', 'eq', rsc_id)] +
+                                    self.polling_window(rsc_id, metric, end,
+                                                        interval),
+                                    limit=1))
+                        if len(response) > 0 and \
+                                response[0].get('avg') is not None:
+                            counter_volume = (counter_volume or 0.0) + \
+                                response[0]['avg']
+                            self.high_water[(rsc_id, metric)] = end
+                    if counter_volume is None:
+                        LOG.debug("No new samples of metric: %s, "
+                                  "resource_id: %s" % (metric, ", ".join(ids)))
+                        continue
                     LOG.info("Polling Ceilometer metric, resource_id: %s, "
                              "metric: %s, counter_name: %s"
-                             % (rsc_id, metric, counter_volume))
-                    self.send_data_zabbix(counter_volume, instance_id, metric)
+                             % (", ".join(ids), metric, counter_volume))
+                    values.append((instance_id, metric, counter_volume))
+                except circuit.CircuitOpen, ex:
+                    if ex.name != self.meter_breaker(metric).name:
+                        raise
+                    LOG.debug("Skip metric: %s, %s" % (metric, ex))
                 except urllib2.HTTPError, e:
                     if e.code == 401:
                         msg = "Error... \nToken refused! " \
@@ -395,10 +1025,10 @@ class CeilometerHandler:
                         LOG.error(msg)
                         raise
                     elif e.code == 404:
-                        msg = "Can't found for instances for tenant: %s" \
-                              % self.instance_id
+                        # The other metrics of the instance are still polled
+                        msg = "Can't found for resource_id: %s, metric: %s" \
+                              % (instance_id, metric)
                         LOG.error(msg)
-                        raise
                     elif e.code == 503:
                         msg = "HTTP Error 503,The service of " \
                               "ceilometer is unavailable"
@@ -422,6 +1052,198 @@ class CeilometerHandler:
 
         # instance metrics
         _polling([instance_id], INSTANCE_METRICS)
+        return values
+
+    def grouped_tasks(self, instances):
+        """
+        :param instances: list of nova instances, normally are dicts
+        :return: list of (metric, tenant_id) queried in 'groupby' mode,
+                 tenant_id is None when querying all the tenants
+        """
+        if self.groupby_per_tenant:
+            scopes = sorted(set(instance.get('tenant_id')
+                                for instance in instances))
+        else:
+            scopes = [None]
+        return [(metric, scope)
+                for metric in NETWORK_METRICS + INSTANCE_METRICS
+                for scope in scopes]
+
+    def polling_grouped_metrics(self, instances, tasks=None, deferred=None):
+        """
+        Fan-in collection, poll the metrics of all the instances with one
+        statistics query per metric(or per metric and tenant), grouped by
+        resource_id, then split the groups back into per-instance values.
+        The values of all the nics of an instance are summed.
+
+        :param instances: list of nova instances, normally are dicts
+        :param tasks: list of (metric, tenant_id) to query, all of them
+                      if None
+        :param deferred: list the tasks not queried before the deadline of
+                         the tick are appended to
+        :return: list of (instance_id, metric, counter_volume)
+        """
+        instance_ids = set(instance['id'] for instance in instances)
+        # Map the known nics to their instances
+        nic_owners = {}
+        for instance_id in instance_ids:
+            for rsc_id in METRIC_CACEHES.get(instance_id, {}).keys():
+                if rsc_id.startswith('instance'):
+                    nic_owners[rsc_id] = instance_id
+        if tasks is None:
+            tasks = self.grouped_tasks(instances)
+
+        totals = {}
+        for task, (metric, groups) in itertools.izip(
+                tasks, self.map(self._grouped_statistics, tasks)):
+            if groups is None:
+                if deferred is not None:
+                    deferred.append(task)
+                continue
+            for group in groups:
+                rsc_id = group['groupby']['resource_id']
+                if metric in NETWORK_METRICS:
+                    owner = nic_owners.get(rsc_id) or \
+                        utils.nic_instance_id(rsc_id)
+                else:
+                    owner = rsc_id
+                if owner not in instance_ids or group.get('avg') is None:
+                    continue
+                totals[(owner, metric)] = \
+                    totals.get((owner, metric), 0.0) + group['avg']
+
+        values = []
+        for instance in instances:
+            for metric in NETWORK_METRICS + INSTANCE_METRICS:
+                counter_volume = totals.get((instance['id'], metric))
+                if counter_volume is None:
+                    continue
+                LOG.info("Polling Ceilometer metric, resource_id: %s, "
+                         "metric: %s, counter_name: %s"
+                         % (instance['id'], metric, counter_volume))
+                values.append((instance['id'], metric, counter_volume))
+        return values
+
+    def _grouped_statistics(self, task):
+        """
+        :param task: a tuple of (metric, tenant_id), tenant_id is None when
+                     querying all the tenants
+        :return: a tuple of (metric, statistics grouped by resource_id),
+                 the statistics are None once the tick ran out of time
+        """
+        metric, tenant_id = task
+        if self.deadline_passed():
+            return metric, None
+        queries = [('project_id', 'eq', tenant_id)] if tenant_id else []
+        end = self.window_end()
+        try:
+            with self.meter_breaker(metric).guard():
+                groups = self.ceilometer_get(
+                    self.statistics_path(
+                        metric,
+                        queries + self.polling_window(
+                            tenant_id, metric, end,
+                            self.scheduler.interval_of(task)),
+                        groupby='resource_id'))
+            if groups:
+                self.high_water[(tenant_id, metric)] = end
+            return metric, groups
+        except circuit.CircuitOpen, ex:
+            LOG.debug("Skip metric: %s, %s" % (metric, ex))
+            return metric, []
+        except urllib2.HTTPError, e:
+            if e.code == 404:
+                LOG.error("Can't found statistics for metric: %s" % metric)
+                return metric, []
+            LOG.error("Failed to query statistics for metric: %s, %s"
+                      % (metric, e))
+        except Exception, ex:
+            LOG.error("Failed to query statistics for metric: %s, %s"
+                      % (metric, ex))
+        # The other metrics are still polled, this one at its next slot
+        return metric, []
+
+    def meter_breaker(self, metric):
+        """
+        :param metric: ceilometer meter name
+        :return: the circuit.CircuitBreaker of the meter, opened by the
+                 meters ceilometer repeatedly doesn't find
+        """
+        return self.breakers.get('ceilometer:' + metric,
+                                 circuit.is_not_found)
+
+    def window_end(self):
+        """
+        :return: end of the polling window, ingest_lag seconds before now.
+                 A sample is stored some time after its timestamp, a window
+                 closing at now would miss the samples not stored yet, and
+                 the next window starts after them.
+        """
+        return time.time() - self.ingest_lag
+
+    def polling_window(self, resource_id, metric, end, interval=None):
+        """
+        Bound a statistics query to the samples since the last successful
+        poll, the window is never longer than the polling interval. So the
+        cost of a query doesn't grow with the age of the resource.
+
+        :param resource_id: the resource(or tenant, in groupby mode) polled
+        :param metric: ceilometer meter name
+        :param end: end of the window, normally is window_end()
+        :param interval: the polling interval of the metric, default is
+                         polling_interval
+        :return: list of (field, op, value) filters on timestamp
+        """
+        start = max(self.high_water.get((resource_id, metric), 0),
+                    end - (interval or self.polling_interval))
+        return [('timestamp', 'ge', utils.isotime(start)),
+                ('timestamp', 'lt', utils.isotime(end))]
+
+    def statistics_path(self, metric, queries, groupby=None, limit=None):
+        """
+        Build the path of a Ceilometer statistics query
+
+        :param metric: ceilometer meter name
+        :param queries: list of (field, op, value) filters
+        :param groupby: field to group the statistics by
+        :param limit: max statistics to return
+        :return: the path of /v2/meters/<metric>/statistics
+        """
+        params = self.query_params(queries)
+        if groupby:
+            params.append(('groupby', groupby))
+        if limit:
+            params.append(('limit', limit))
+        return "/v2/meters/" + metric + "/statistics?" + \
+            urllib.urlencode(params)
+
+    def samples_path(self, metric, queries, limit=None):
+        """
+        Build the path of a Ceilometer query of raw samples, which are
+        returned newest first
+
+        :param metric: ceilometer meter name
+        :param queries: list of (field, op, value) filters
+        :param limit: max samples to return
+        :return: the path of /v2/meters/<metric>
+        """
+        params = self.query_params(queries)
+        if limit:
+            params.append(('limit', limit))
+        return "/v2/meters/" + metric + "?" + urllib.urlencode(params)
+
+    def query_params(self, queries):
+        """
+        :param queries: list of (field, op, value) filters
+        :return: list of the q.* request parameters
+        """
+        params = []
+        for field, op, value in queries:
+            params.extend([('q.field', field),
+                           ('q.op', op),
+                           ('q.type', ''),
+                           ('q.value', value)])
+        return params
 
     def set_proxy_header(self, data):
         """
@@ -431,27 +1253,18 @@ class CeilometerHandler:
         :rtype : returns the message ready to send to Zabbix server
         with the right header
         """
-        data_length = len(data)
-        data_header = struct.pack('i', data_length) + '\0\0\0\0'
-        HEADER = '''ZBXD\1%s%s'''
-        data_to_send = HEADER % (data_header, data)
-        payload = json.dumps(data)
-        return payload
+        return zabbix_sender.set_proxy_header(data)
 
-    def send_data_zabbix(self, counter_volume, resource_id, item_key):
+    def send_data_zabbix(self, counter_volume, resource_id, item_key,
+                         clock=None):
         """
-        Method used to prepare the body with data from Ceilometer and send
-        it to Zabbix using connect_zabbix method
+        Method used to prepare the body with data from Ceilometer and
+        buffer it, the buffer is shipped to Zabbix in batches
 
         :param counter_volume: the actual measurement
         :param resource_id:  refers to the resource ID
         :param item_key:    refers to the item key
+        :param clock:    timestamp of the measurement, default is now
         """
         tmp = json.dumps(counter_volume)
-        data = {"request": "history data", "host": self.zabbix_proxy_name,
-                "data": [{"host": resource_id,
-                          "key": item_key,
-                          "value": tmp}]}
-
-        payload = self.set_proxy_header(data)
-        self.connect_zabbix(payload)
+        self.zabbix_sender.add(resource_id, item_key, tmp, clock)
@@ -0,0 +1,224 @@
+"""
+Class for breaking the circuit of a failing backend
+
+Fails the requests of an endpoint(or a meter) fast once it failed repeatedly,
+
+and probes it with a single request from time to time until it recovers
+"""
+
+from eszcp import limiter
+from eszcp import log
+import contextlib
+import socket
+import threading
+import time
+import urllib2
+
+LOG = log.logger(__name__)
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def is_not_found(ex):
+    """
+    :param ex: the exception a request raised
+    :return: whether the resource requested doesn't exist, e.g. a meter
+             never sampled
+    """
+    return isinstance(ex, urllib2.HTTPError) and ex.code == 404
+
+
+def is_connection_error(ex):
+    """
+    :param ex: the exception a request of a raw socket raised
+    :return: whether the peer is unreachable or answered garbage
+    """
+    return isinstance(ex, (socket.error, ValueError))
+
+
+class CircuitOpen(Exception):
+
+    def __init__(self, name, retry_at):
+        """
+        :param name: the circuit name
+        :param retry_at: timestamp of the next probe
+        """
+        Exception.__init__(self, "Circuit %s is open, next probe in %.1f "
+                                 "seconds"
+                           % (name, max(retry_at - time.time(), 0)))
+        self.name = name
+        self.retry_at = retry_at
+
+
+class CircuitBreaker(object):
+    """
+    closed: requests pass, failure_threshold consecutive failures open it
+    open: requests fail fast with CircuitOpen for reset_timeout seconds
+    half-open: a single probe request passes, its success closes the
+               circuit, its failure opens it again for twice as long, up to
+               max_reset_timeout
+
+    Exceptions is_failure doesn't tell as failures, e.g. a 401 response,
+    neither open nor close the circuit.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30,
+                 max_reset_timeout=300, is_failure=None):
+        """
+        :param name: circuit name, e.g. ceilometer
+        :param failure_threshold: consecutive failures opening the circuit
+        :param reset_timeout: seconds before the first probe
+        :param max_reset_timeout: max seconds between two probes
+        :param is_failure: function telling whether an exception is a
+                           failure of the backend, default is
+                           limiter.is_overload
+        """
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.max_reset_timeout = float(max_reset_timeout)
+        self.is_failure = is_failure or limiter.is_overload
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.timeout = self.reset_timeout
+        self.retry_at = 0
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    @contextlib.contextmanager
+    def guard(self):
+        """
+        Run a request of the backend unless the circuit is open:
+
+            with breaker.guard():
+                send the request
+
+        :raise CircuitOpen: when the circuit is open
+        """
+        self.acquire()
+        try:
+            yield
+        except Exception, ex:
+            if self.is_failure(ex):
+                self.failure()
+            else:
+                self.release()
+            raise
+        self.success()
+
+    def acquire(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.time() >= self.retry_at:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return
+            self.rejected += 1
+            raise CircuitOpen(self.name, self.retry_at)
+
+    def success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                LOG.info("Circuit %s is closed, the backend recovered"
+                         % self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self.timeout = self.reset_timeout
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                # The probe failed, wait longer before the next one
+                self.timeout = min(self.timeout * 2, self.max_reset_timeout)
+                self.trip()
+            elif self.state == CLOSED and \
+                    self.failures >= self.failure_threshold:
+                self.trip()
+
+    def release(self):
+        """
+        Neither a success nor a failure, let another probe pass
+        """
+        with self.lock:
+            self.probing = False
+
+    def trip(self):
+        self.state = OPEN
+        self.probing = False
+        self.retry_at = time.time() + self.timeout
+        self.opened += 1
+        LOG.warning("Circuit %s is open after %d failures, next probe in "
+                    "%.1f seconds" % (self.name, self.failures, self.timeout))
+
+    def stats(self):
+        """
+        :return: the current state and counters
+        """
+        with self.lock:
+            return {"name": self.name,
+                    "state": self.state,
+                    "failures": self.failures,
+                    "opened": self.opened,
+                    "rejected": self.rejected}
+
+
+class CircuitBreakers(object):
+    """
+    The circuit breakers of all the endpoints and meters, created on first
+    use with the same thresholds
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30,
+                 max_reset_timeout=300):
+        """
+        :param failure_threshold: consecutive failures opening a circuit
+        :param reset_timeout: seconds before the first probe
+        :param max_reset_timeout: max seconds between two probes
+        """
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)
+        self.max_reset_timeout = float(max_reset_timeout)
+        self.lock = threading.Lock()
+        self.breakers = {}
+
+    def get(self, name, is_failure=None):
+        """
+        :param name: circuit name, e.g. ceilometer or ceilometer:cpu_util
+        :param is_failure: function telling whether an exception is a
+                           failure, used when the circuit is created
+        :return: the CircuitBreaker
+        """
+        with self.lock:
+            breaker = self.breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, self.failure_threshold,
+                                         self.reset_timeout,
+                                         self.max_reset_timeout, is_failure)
+                self.breakers[name] = breaker
+            return breaker
+
+    def stats(self):
+        """
+        :return: the stats of the circuits not closed
+        """
+        with self.lock:
+            breakers = self.breakers.values()
+        return [stats for stats in
+                (breaker.stats() for breaker in breakers)
+                if stats["state"] != CLOSED]
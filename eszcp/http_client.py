@@ -0,0 +1,217 @@
+"""
+Class for sending REST requests to OpenStack and Zabbix APIs
+
+Keeps a pool of keep-alive connections per endpoint, so the requests
+
+of Nova, Keystone, Ceilometer and Zabbix don't set up a TCP connection each
+"""
+
+from eszcp import log
+import gzip
+import httplib
+import json
+import os
+import select
+import socket
+from StringIO import StringIO
+import threading
+import urllib2
+import urlparse
+
+LOG = log.logger(__name__)
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+# The methods a server may safely receive twice
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+
+class HTTPConnection(httplib.HTTPConnection):
+    """
+    HTTPConnection with separated connect and read timeouts
+    """
+    def __init__(self, host, port=None, connect_timeout=None,
+                 read_timeout=None):
+        httplib.HTTPConnection.__init__(self, host, port,
+                                        timeout=connect_timeout)
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        self.sock.settimeout(self.read_timeout)
+
+
+class HTTPSConnection(httplib.HTTPSConnection):
+    """
+    HTTPSConnection with separated connect and read timeouts
+    """
+    def __init__(self, host, port=None, connect_timeout=None,
+                 read_timeout=None):
+        httplib.HTTPSConnection.__init__(self, host, port,
+                                         timeout=connect_timeout)
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        httplib.HTTPSConnection.connect(self)
+        self.sock.settimeout(self.read_timeout)
+
+
+class HTTPClient(object):
+
+    def __init__(self, connect_timeout=10, read_timeout=60, pool_size=8):
+        """
+        :param connect_timeout: seconds to wait for a connection
+        :param read_timeout: seconds to wait for data of a response
+        :param pool_size: max idle connections kept per endpoint
+        """
+        self.connect_timeout = float(connect_timeout)
+        self.read_timeout = float(read_timeout)
+        self.pool_size = int(pool_size)
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.pid = os.getpid()
+
+    def get_json(self, url, token=None, headers=None):
+        """
+        :param url: the request url
+        :param token: keystone token, sent as X-Auth-Token
+        :param headers: extra request headers
+        :return: the json response
+        """
+        return json.loads(self.request('GET', url,
+                                       headers=self._headers(token, headers)))
+
+    def post_json(self, url, data, token=None, headers=None):
+        """
+        :param url: the request url
+        :param data: the json message, normally is a dict
+        :param token: keystone token, sent as X-Auth-Token
+        :param headers: extra request headers
+        :return: the json response
+        """
+        return json.loads(self.request('POST', url, json.dumps(data),
+                                       headers=self._headers(token, headers)))
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Send a request over a pooled keep-alive connection
+
+        HTTP errors are raised as urllib2.HTTPError and connection errors as
+        urllib2.URLError, the same as urllib2.urlopen does.
+
+        :param method: HTTP method
+        :param url: the request url
+        :param body: the request body
+        :param headers: the request headers
+        :return: the response body, gzip content is decoded
+        """
+        parsed = urlparse.urlsplit(url)
+        endpoint = (parsed.scheme, parsed.hostname, parsed.port)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', 'gzip')
+
+        conn, reused = self._acquire(endpoint)
+        written = False
+        try:
+            try:
+                conn.request(method, path, body, headers)
+                written = True
+                response, data = self._read(conn)
+            except (httplib.HTTPException, socket.error):
+                # The server may have closed an idle keep-alive connection,
+                # retry once over a new connection. A request written
+                # already is retried only if it is idempotent, the server
+                # may have processed it, e.g. a zabbix host.create
+                if not reused or \
+                        (written and method not in IDEMPOTENT_METHODS):
+                    raise
+                conn.close()
+                conn = self._connect(endpoint)
+                response, data = self._send(conn, method, path, body,
+                                            headers)
+        except (httplib.HTTPException, socket.error), ex:
+            conn.close()
+            raise urllib2.URLError(ex)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(endpoint, conn)
+
+        if response.getheader('content-encoding', '') == 'gzip':
+            data = gzip.GzipFile(fileobj=StringIO(data)).read()
+        if response.status >= 400:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, StringIO(data))
+        return data
+
+    def _headers(self, token, headers):
+        request_headers = {"Accept": "application/json",
+                           "Content-Type": "application/json"}
+        if token:
+            request_headers["X-Auth-Token"] = token
+        request_headers.update(headers or {})
+        return request_headers
+
+    def _send(self, conn, method, path, body, headers):
+        conn.request(method, path, body, headers)
+        return self._read(conn)
+
+    def _read(self, conn):
+        response = conn.getresponse()
+        return response, response.read()
+
+    def _connect(self, endpoint):
+        scheme, host, port = endpoint
+        cls = HTTPSConnection if scheme == 'https' else HTTPConnection
+        return cls(host, port,
+                   connect_timeout=self.connect_timeout,
+                   read_timeout=self.read_timeout)
+
+    def _acquire(self, endpoint):
+        """
+        :return: a tuple of (connection, whether it is an idle one)
+        """
+        with self.lock:
+            # Connections inherited from the parent process are shared with
+            # it, never reuse them in a forked process
+            if self.pid != os.getpid():
+                self.pools = {}
+                self.pid = os.getpid()
+            idle = self.pools.get(endpoint)
+            while idle:
+                conn = idle.pop()
+                if not self._dropped(conn):
+                    return conn, True
+                conn.close()
+        return self._connect(endpoint), False
+
+    def _dropped(self, conn):
+        """
+        :return: whether the server closed an idle connection, which is
+                 readable then. Checked before a request is written, so a
+                 request not idempotent isn't lost on a closed connection.
+        """
+        if conn.sock is None:
+            return True
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def _release(self, endpoint, conn):
+        with self.lock:
+            idle = self.pools.setdefault(endpoint, [])
+            if self.pid == os.getpid() and len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
@@ -0,0 +1,103 @@
+"""
+Class for indexing Zabbix object IDs
+
+Keeps a bidirectional index of names(host names, i.e. nova instance uuids,
+
+or host group names, i.e. tenant names) and Zabbix IDs
+"""
+
+import threading
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+
+class IdDirectory(object):
+
+    def __init__(self, items=None):
+        """
+        :param items: a dict of name and id to fill the directory with
+        """
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.names = {}
+        self.update(items or {})
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_id(self, name):
+        """
+        :param name: host name or host group name
+        :return: the zabbix id, None if not found
+        """
+        return self.ids.get(name)
+
+    def get_name(self, object_id):
+        """
+        :param object_id: zabbix hostid or groupid
+        :return: the name, None if not found
+        """
+        return self.names.get(object_id)
+
+    def add(self, name, object_id):
+        """
+        :param name: host name or host group name
+        :param object_id: zabbix hostid or groupid
+        """
+        if name is None or object_id is None:
+            return
+        with self.lock:
+            old_id = self.ids.pop(name, None)
+            self.names.pop(old_id, None)
+            old_name = self.names.pop(object_id, None)
+            self.ids.pop(old_name, None)
+            self.ids[name] = object_id
+            self.names[object_id] = name
+
+    def update(self, items):
+        """
+        :param items: a dict of name and id
+        """
+        for name, object_id in items.items():
+            self.add(name, object_id)
+
+    def remove_name(self, name):
+        """
+        :param name: host name or host group name
+        :return: the zabbix id removed
+        """
+        with self.lock:
+            object_id = self.ids.pop(name, None)
+            self.names.pop(object_id, None)
+            return object_id
+
+    def remove_id(self, object_id):
+        """
+        :param object_id: zabbix hostid or groupid
+        :return: the name removed
+        """
+        with self.lock:
+            name = self.names.pop(object_id, None)
+            self.ids.pop(name, None)
+            return name
+
+    def clear(self):
+        with self.lock:
+            self.ids = {}
+            self.names = {}
+
+    def items(self):
+        """
+        :return: list of (name, id)
+        """
+        with self.lock:
+            return self.ids.items()
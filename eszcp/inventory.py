@@ -0,0 +1,323 @@
+"""
+Class for sharing the inventory between the proxy processes
+
+Keeps the Zabbix hosts(nova instances) and host groups(tenants) in a local
+
+SQLite file, so the listener and poller processes update it incrementally
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+DEFAULT_PATH = '/var/lib/eszcp/inventory.db'
+# A private inventory of a single process, kept in memory
+MEMORY = ':memory:'
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta ("
+    " key TEXT PRIMARY KEY, value TEXT)",
+    # invalidated is the version a nic or volume of the instance was
+    # attached or detached at
+    "CREATE TABLE IF NOT EXISTS hosts ("
+    " instance_id TEXT PRIMARY KEY, hostid TEXT, name TEXT,"
+    " items TEXT, invalidated INTEGER DEFAULT 0)",
+    # invalidations of instances not created in zabbix yet, moved to
+    # their hosts once they are
+    "CREATE TABLE IF NOT EXISTS invalidations ("
+    " instance_id TEXT PRIMARY KEY, version INTEGER)",
+    "CREATE TABLE IF NOT EXISTS groups ("
+    " name TEXT PRIMARY KEY, groupid TEXT)",
+    "CREATE TABLE IF NOT EXISTS tenants ("
+    " tenant_id TEXT PRIMARY KEY, name TEXT)",
+    # zlib compressed json snapshots of the process state, for warm
+    # restarts
+    "CREATE TABLE IF NOT EXISTS snapshots ("
+    " name TEXT PRIMARY KEY, saved_at REAL, data BLOB)",
+    "INSERT OR IGNORE INTO meta(key, value) VALUES ('version', '0')"
+    ]
+
+
+class Inventory(object):
+    """
+    A versioned store of {"instance_id": host} and {"tenant_name": groupid}
+
+    Every update bumps the version in the same transaction, readers compare
+    it with the version they loaded to tell cheaply whether anything changed.
+    """
+
+    def __init__(self, path=MEMORY, timeout=30):
+        """
+        :param path: the SQLite file shared by the processes, default is
+                     an in-memory inventory private to the process
+        :param timeout: seconds to wait for the lock of a writer
+        """
+        self.path = path
+        self.timeout = float(timeout)
+        self.lock = threading.RLock()
+        self.conn = None
+        self.pid = None
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection()
+
+    def version(self):
+        """
+        :return: the version of the inventory
+        """
+        row = self.query("SELECT value FROM meta WHERE key = 'version'")
+        return int(row[0][0]) if row else 0
+
+    def hosts(self):
+        """
+        :return: (version, {"instance_id": {"hostid", "host", "name",
+                  "items", "invalidated"}})
+        """
+        with self.lock:
+            version = self.version()
+            rows = self.query("SELECT instance_id, hostid, name, items,"
+                              " invalidated FROM hosts")
+        return version, dict((row[0], {"hostid": row[1],
+                                       "host": row[0],
+                                       "name": row[2],
+                                       "items": json.loads(row[3] or '[]'),
+                                       "invalidated": row[4]})
+                             for row in rows)
+
+    def host_ids(self):
+        """
+        :return: (version, {"instance_id": hostid})
+        """
+        with self.lock:
+            version = self.version()
+            rows = self.query("SELECT instance_id, hostid FROM hosts")
+        return version, dict(rows)
+
+    def groups(self):
+        """
+        :return: (version, {"tenant_name": groupid})
+        """
+        with self.lock:
+            version = self.version()
+            rows = self.query("SELECT name, groupid FROM groups")
+        return version, dict(rows)
+
+    def tenants(self):
+        """
+        :return: (version, {"tenant_id": tenant_name})
+        """
+        with self.lock:
+            version = self.version()
+            rows = self.query("SELECT tenant_id, name FROM tenants")
+        return version, dict(rows)
+
+    def replace_tenants(self, tenants):
+        """
+        :param tenants: {"tenant_id": tenant_name}
+        """
+        def _replace(cursor):
+            cursor.execute("DELETE FROM tenants")
+            cursor.executemany("INSERT INTO tenants(tenant_id, name)"
+                               " VALUES (?, ?)", tenants.items())
+        return self.write(_replace)
+
+    def replace_hosts(self, hosts):
+        """
+        Replace all the hosts, e.g. re-pulled from the zabbix proxy config
+
+        :param hosts: {"instance_id": {"hostid", "name", "items"}}
+        """
+        def _replace(cursor):
+            cursor.execute("SELECT instance_id FROM hosts")
+            gone = set(row[0] for row in cursor.fetchall()) - set(hosts)
+            cursor.executemany("DELETE FROM hosts WHERE instance_id = ?",
+                               [(instance_id,) for instance_id in gone])
+            self._upsert_hosts(cursor, [
+                (instance_id, host["hostid"], host["name"],
+                 json.dumps(host.get("items", [])))
+                for instance_id, host in hosts.items()])
+        return self.write(_replace)
+
+    def update_hosts(self, created=None, deleted=None):
+        """
+        Apply a batch of hosts created and deleted in zabbix
+
+        :param created: list of (instance_id, instance_name, host_id)
+        :param deleted: list of instance_id
+        """
+        def _update(cursor):
+            cursor.executemany("DELETE FROM hosts WHERE instance_id = ?",
+                               [(instance_id,)
+                                for instance_id in deleted or []])
+            cursor.executemany("DELETE FROM invalidations"
+                               " WHERE instance_id = ?",
+                               [(instance_id,)
+                                for instance_id in deleted or []])
+            self._upsert_hosts(cursor, [
+                (instance_id, host_id, instance_name, None)
+                for instance_id, instance_name, host_id in created or []])
+        return self.write(_update)
+
+    def invalidate(self, instance_ids):
+        """
+        Mark the resources(nics, volumes) of instances as changed, the
+        instances not created in zabbix yet are marked once they are
+
+        :param instance_ids: nova instance uuids
+        """
+        def _invalidate(cursor, version):
+            for instance_id in instance_ids:
+                cursor.execute("UPDATE hosts SET invalidated = ?"
+                               " WHERE instance_id = ?",
+                               (version, instance_id))
+                if not cursor.rowcount:
+                    cursor.execute("INSERT OR REPLACE INTO invalidations"
+                                   "(instance_id, version) VALUES (?, ?)",
+                                   (instance_id, version))
+        return self.write(_invalidate, with_version=True)
+
+    def update_groups(self, groups):
+        """
+        :param groups: {"tenant_name": groupid}
+        """
+        def _update(cursor):
+            cursor.executemany("INSERT OR REPLACE INTO groups(name, groupid)"
+                               " VALUES (?, ?)", groups.items())
+        return self.write(_update)
+
+    def replace_groups(self, groups):
+        """
+        :param groups: {"tenant_name": groupid}
+        """
+        def _replace(cursor):
+            cursor.execute("DELETE FROM groups")
+            cursor.executemany("INSERT INTO groups(name, groupid)"
+                               " VALUES (?, ?)", groups.items())
+        return self.write(_replace)
+
+    def remove_groups(self, names):
+        """
+        :param names: tenant names
+        """
+        def _remove(cursor):
+            cursor.executemany("DELETE FROM groups WHERE name = ?",
+                               [(name,) for name in names])
+        return self.write(_remove)
+
+    def save_snapshot(self, name, data):
+        """
+        Save a snapshot, which doesn't bump the version
+
+        :param name: snapshot name
+        :param data: json serializable state
+        """
+        blob = sqlite3.Binary(zlib.compress(json.dumps(data)))
+        with self.lock:
+            self.connection().execute(
+                "INSERT OR REPLACE INTO snapshots(name, saved_at, data)"
+                " VALUES (?, ?, ?)", (name, time.time(), blob))
+
+    def load_snapshot(self, name, max_age=None):
+        """
+        :param name: snapshot name
+        :param max_age: seconds a snapshot is valid for, None means forever
+        :return: the state saved, None if missing or too old
+        """
+        rows = self.query("SELECT saved_at, data FROM snapshots"
+                          " WHERE name = ?", (name,))
+        if not rows:
+            return None
+        saved_at, blob = rows[0]
+        if max_age is not None and time.time() - saved_at > max_age:
+            return None
+        return json.loads(zlib.decompress(str(blob)))
+
+    def _upsert_hosts(self, cursor, rows):
+        """
+        :param rows: list of (instance_id, hostid, name, items), items None
+                     keeps the items known
+        """
+        for instance_id, hostid, name, items in rows:
+            cursor.execute("UPDATE hosts SET hostid = ?, name = ?,"
+                           " items = COALESCE(?, items)"
+                           " WHERE instance_id = ?",
+                           (hostid, name, items, instance_id))
+            if cursor.rowcount:
+                continue
+            # An instance invalidated before its host was created is
+            # invalidated at the version it is inserted at
+            cursor.execute("DELETE FROM invalidations WHERE instance_id = ?",
+                           (instance_id,))
+            invalidated = 0
+            if cursor.rowcount:
+                cursor.execute("SELECT value FROM meta"
+                               " WHERE key = 'version'")
+                invalidated = int(cursor.fetchone()[0])
+            cursor.execute("INSERT INTO hosts(instance_id, hostid, name,"
+                           " items, invalidated) VALUES (?, ?, ?, ?, ?)",
+                           (instance_id, hostid, name, items or '[]',
+                            invalidated))
+
+    def write(self, func, with_version=False):
+        """
+        Run func in a write transaction, bumping the version
+
+        :param func: function accepting (cursor) or (cursor, new_version)
+        :return: the new version
+        """
+        with self.lock:
+            conn = self.connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("UPDATE meta SET value = value + 1"
+                               " WHERE key = 'version'")
+                cursor.execute("SELECT value FROM meta"
+                               " WHERE key = 'version'")
+                version = int(cursor.fetchone()[0])
+                if with_version:
+                    func(cursor, version)
+                else:
+                    func(cursor)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            finally:
+                cursor.close()
+            return version
+
+    def query(self, sql, params=()):
+        with self.lock:
+            cursor = self.connection().cursor()
+            try:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def connection(self):
+        # A SQLite connection must not be shared with a forked process
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                        isolation_level=None,
+                                        check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.pid = os.getpid()
+            # A new in-memory database is empty, create the schema on
+            # every connection
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+        return self.conn
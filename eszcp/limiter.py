@@ -0,0 +1,168 @@
+"""
+Class for limiting the requests sent to a backend
+
+Combines a token bucket capping the request rate with an AIMD concurrency
+
+limit, which backs off when the backend slows down or fails with 5xx
+"""
+
+import contextlib
+import socket
+import threading
+import time
+import urllib2
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+# HTTP status codes meaning the backend is overloaded
+OVERLOAD_CODES = [429, 500, 502, 503, 504]
+
+
+def is_overload(ex):
+    """
+    :param ex: the exception a request raised
+    :return: whether it tells the backend is overloaded
+    """
+    if isinstance(ex, urllib2.HTTPError):
+        return ex.code in OVERLOAD_CODES
+    return isinstance(ex, (urllib2.URLError, socket.timeout, socket.error))
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: requests per second, 0 means unlimited
+        :param burst: max requests sent at once, default is rate
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(self.rate, 1))
+        self.tokens = self.burst
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for it if the bucket is empty
+
+        :return: seconds waited
+        """
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AdaptiveLimiter(object):
+    """
+    Limit the rate and the concurrency of the requests of a backend
+
+    The concurrency limit grows by one every limit requests completing
+    in time(additive increase), and is multiplied by backoff when a
+    request is slower than latency_target or the backend is overloaded
+    (multiplicative decrease), at most once per latency_target.
+    """
+
+    def __init__(self, name, max_limit=8, min_limit=1, rate=0, burst=None,
+                 latency_target=2.0, backoff=0.5):
+        """
+        :param name: backend name, e.g. ceilometer
+        :param max_limit: max requests in flight
+        :param min_limit: min requests in flight
+        :param rate: max requests per second, 0 means unlimited
+        :param burst: max requests sent at once by the token bucket
+        :param latency_target: seconds a request is expected to take
+        :param backoff: factor applied to the limit when backing off
+        """
+        self.name = name
+        self.max_limit = int(max_limit)
+        self.min_limit = max(1, int(min_limit))
+        self.limit = float(self.max_limit)
+        self.latency_target = float(latency_target)
+        self.backoff = float(backoff)
+        self.bucket = TokenBucket(rate, burst)
+        self.cond = threading.Condition()
+        self.inflight = 0
+        self.decreased_at = 0
+        self.requests = 0
+        self.overloads = 0
+        self.throttled = 0.0
+
+    @contextlib.contextmanager
+    def slot(self):
+        """
+        Run a request of the backend within the limits:
+
+            with limiter.slot():
+                send the request
+        """
+        self.acquire()
+        start = time.time()
+        overloaded = False
+        try:
+            yield
+        except Exception, ex:
+            overloaded = is_overload(ex)
+            raise
+        finally:
+            self.release(time.time() - start, overloaded)
+
+    def acquire(self):
+        waited = self.bucket.acquire()
+        start = time.time()
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.cond.wait(self.latency_target)
+            self.inflight += 1
+            self.throttled += waited + time.time() - start
+
+    def release(self, latency, overloaded=False):
+        """
+        :param latency: seconds the request took
+        :param overloaded: whether the backend told it is overloaded
+        """
+        with self.cond:
+            self.inflight -= 1
+            self.requests += 1
+            now = time.time()
+            if overloaded or latency > self.latency_target:
+                self.overloads += overloaded
+                if now - self.decreased_at >= self.latency_target:
+                    self.limit = max(self.min_limit,
+                                     self.limit * self.backoff)
+                    self.decreased_at = now
+            else:
+                self.limit = min(self.max_limit,
+                                 self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+
+    def stats(self):
+        """
+        :return: the current limits and counters
+        """
+        with self.cond:
+            return {"name": self.name,
+                    "limit": int(self.limit),
+                    "max_limit": self.max_limit,
+                    "rate": self.bucket.rate,
+                    "inflight": self.inflight,
+                    "requests": self.requests,
+                    "overloads": self.overloads,
+                    "throttled": self.throttled}
@@ -61,7 +61,7 @@ class ContextAdapt(object):
 
     def warning(self, msg=None):
         if msg:
-            self.logge.warning(msg)
+            self.logger.warning(msg)
 
     def WARING(self, msg=None):
         self.warning(msg)
@@ -75,7 +75,7 @@ class ContextAdapt(object):
 
     def critical(self, msg=None):
         if msg:
-            self.msg.critical(msg)
+            self.logger.critical(msg)
 
     def CRITICAL(self, msg=None):
         self.critical(msg)
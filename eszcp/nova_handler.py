@@ -6,9 +6,9 @@ Uses the pika library for handling the AMQP protocol, implementing the
 necessary callbacks for Nova events
 """
 
+from eszcp import amqp_consumer
 from eszcp import log
 import json
-import pika
 
 LOG = log.logger(__name__)
 
@@ -20,12 +20,22 @@ __date__ = "03/01/2016"
 __email__ = "jun.wang@easystack.cn"
 __version__ = "1.0.0"
 
+# Events changing the nics or volumes of an instance
+TOPOLOGY_EVENTS = [
+    'compute.instance.volume.attach',
+    'compute.instance.volume.detach',
+    'compute.instance.interface_attach.end',
+    'compute.instance.interface_detach.end'
+    ]
+
 
 class NovaEvents:
 
     def __init__(self, rabbit_host, rabbit_user, rabbit_pass, rabbit_port,
                  zabbix_handler,
-                 ceilometer_handler):
+                 ceilometer_handler,
+                 batch_window=2, batch_size=100, consumer=None,
+                 max_retries=3):
 
         """
         :param rabbit_host: rabbit host
@@ -33,6 +43,12 @@ class NovaEvents:
         :param rabbit_pass: rabbit user password
         :param zabbix_handler: zabbix api handler
         :param ceilometer_handler: ceilometer api handler
+        :param batch_window: seconds create/delete events are collected
+                             before they are applied to zabbix in bulk
+        :param batch_size: max create/delete events applied in a batch
+        :param consumer: amqp_consumer.Consumer used to listen to nova events
+        :param max_retries: times a create/delete event zabbix failed to
+                            apply is retried before it is dropped
         """
         self.rabbit_host = rabbit_host
         self.rabbit_user = rabbit_user
@@ -40,31 +56,39 @@ class NovaEvents:
         self.rabbit_port = rabbit_port
         self.zabbix_handler = zabbix_handler
         self.ceilometer_handler = ceilometer_handler
+        self.batch_window = float(batch_window)
+        self.batch_size = int(batch_size)
+        self.consumer = consumer or amqp_consumer.Consumer(rabbit_host,
+                                                           rabbit_user,
+                                                           rabbit_pass,
+                                                           rabbit_port)
+        self.flush_timer = None
+        # Instances to create, [(instance_name, instance_id, tenant_name)]
+        self.pending_creates = []
+        # Instances to delete, [instance_id]
+        self.pending_deletes = []
+        self.max_retries = int(max_retries)
+        # Times the events failed so far, {("create"|"delete", instance_id)}
+        self.retries = {}
 
     def nova_amq(self):
         """
         Method used to listen to nova events
 
         """
+        self.subscribe()
+        self.consumer.run()
 
-        connection = pika.BlockingConnection(pika.ConnectionParameters(
-                                    host=self.rabbit_host,
-                                    port=int(self.rabbit_port),
-                                    credentials=pika.PlainCredentials(
-                                            self.rabbit_user,
-                                            self.rabbit_pass)
-                                    ))
-        channel = connection.channel()
-        channel.exchange_declare(exchange='nova', type='topic')
-        channel.queue_declare(queue="zcp-nova", exclusive=True)
-        channel.queue_bind(exchange='nova', queue="zcp-nova",
-                           routing_key='notifications.#')
-        channel.queue_bind(exchange='nova', queue="zcp-nova",
-                           routing_key='compute.#')
-        channel.basic_consume(self.nova_callback,
-                              queue="zcp-nova",
-                              no_ack=True)
-        channel.start_consuming()
+    def subscribe(self):
+        """
+        Subscribe nova events on the consumer, which may be shared with
+        other listeners
+        """
+        self.consumer.subscribe('nova', "zcp-nova",
+                                ['notifications.#', 'compute.#'],
+                                self.nova_callback,
+                                holding=self.has_pending_events,
+                                on_connect=self.reset_events)
 
     def nova_callback(self, ch, method, properties, body):
         """
@@ -87,21 +111,19 @@ class NovaEvents:
             if type_of_message == 'compute.instance.create.end':
                 instance_id = payload['payload']['instance_id']
                 instance_name = payload['payload']['hostname']
-                self.zabbix_handler.create_host(instance_name,
-                                                instance_id,
-                                                tenant_name)
-                LOG.info("Creating a host: %s(%s) in Zabbix Server"
-                         % (instance_id, instance_name))
-                self.ceilometer_handler.host_list = \
-                    self.ceilometer_handler.get_hosts_ID()
+                self.pending_creates.append((instance_name,
+                                             instance_id,
+                                             tenant_name))
+                self.schedule_flush()
             elif type_of_message == 'compute.instance.delete.end':
                 host = payload['payload']['instance_id']
-                host_id = self.zabbix_handler.find_host_id(host)
-                self.zabbix_handler.delete_host(host_id)
-                LOG.info("Deleting a host: %s in Zabbix Server"
-                         % host_id)
-                self.ceilometer_handler.host_list = \
-                    self.ceilometer_handler.get_hosts_ID()
+                self.pending_deletes.append(host)
+                self.schedule_flush()
+            elif type_of_message in TOPOLOGY_EVENTS:
+                instance_id = payload['payload']['instance_id']
+                LOG.debug("Resources of instance %s changed by %s"
+                          % (instance_id, type_of_message))
+                self.ceilometer_handler.topology_changed(instance_id)
             else:
                 # TO DO
                 # Maybe more event types will be supported
@@ -109,3 +131,128 @@ class NovaEvents:
         except Exception, ex:
             LOG.error(ex.message)
             raise ex
+
+    def has_pending_events(self):
+        return bool(self.pending_creates or self.pending_deletes)
+
+    def reset_events(self):
+        """
+        Called on (re)connection to RabbitMQ, the timers of the previous
+        connection are gone
+        """
+        self.flush_timer = None
+        if self.consumer.durable:
+            # Not acknowledged, so they are redelivered
+            self.pending_creates = []
+            self.pending_deletes = []
+        elif self.has_pending_events():
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        """
+        Flush the pending events when the batch is full, otherwise make
+        sure they are flushed once the batch window elapses
+
+        Flushing runs on a timer rather than in the message callback, so
+        a Zabbix failure is never blamed on the message being consumed
+        """
+        if len(self.pending_creates) + len(self.pending_deletes) >= \
+                self.batch_size:
+            self.consumer.remove_timeout(self.flush_timer)
+            self.flush_timer = self.consumer.add_timeout(0,
+                                                         self.flush_events)
+        elif self.flush_timer is None:
+            self.flush_timer = self.consumer.add_timeout(self.batch_window,
+                                                         self.flush_events)
+
+    def flush_events(self):
+        """
+        Apply the pending create/delete events to Zabbix with one bulk
+        host.create and one bulk host.delete, then update the inventory
+        of the poller once. The events zabbix failed to apply stay pending,
+        so their messages are not acknowledged until they are retried.
+        """
+        # Called by the timer, which is gone now
+        self.flush_timer = None
+        creates, self.pending_creates = self.pending_creates, []
+        deletes, self.pending_deletes = self.pending_deletes, []
+        # An instance created and deleted in the same batch cancels out
+        cancelled = set(create[1] for create in creates) & set(deletes)
+        creates = [create for create in creates
+                   if create[1] not in cancelled]
+        deletes = [host for host in deletes if host not in cancelled]
+
+        created = []
+        failed_creates = []
+        if creates:
+            LOG.info("Creating hosts: %s in Zabbix Server"
+                     % ", ".join("%s(%s)" % (create[1], create[0])
+                                 for create in creates))
+            try:
+                host_ids = self.zabbix_handler.create_hosts(creates)
+            except Exception, ex:
+                LOG.error("Failed to create hosts: %s" % ex)
+                host_ids = {}
+            created = [(instance_id, instance_name, host_ids[instance_id])
+                       for instance_name, instance_id, _ in creates
+                       if instance_id in host_ids]
+            failed_creates = [create for create in creates
+                              if create[1] not in host_ids]
+        deleted = []
+        failed_deletes = []
+        if deletes:
+            host_ids = {}
+            not_found = set()
+            deleted_ids = set()
+            try:
+                for host in deletes:
+                    host_id = self.zabbix_handler.find_host_id(host)
+                    if host_id:
+                        host_ids[host] = host_id
+                    else:
+                        LOG.warning("Can't found host %s in Zabbix Server, "
+                                    "nothing to delete" % host)
+                        not_found.add(host)
+                LOG.info("Deleting hosts: %s in Zabbix Server"
+                         % ", ".join(host_ids.values()))
+                deleted_ids.update(
+                    self.zabbix_handler.delete_hosts(host_ids.values()))
+            except Exception, ex:
+                LOG.error("Failed to delete hosts: %s" % ex)
+            deleted = [host for host in deletes
+                       if host_ids.get(host) in deleted_ids]
+            failed_deletes = [host for host in deletes
+                              if host not in deleted and
+                              host not in not_found]
+        if created or deleted:
+            self.ceilometer_handler.hosts_changed(created, deleted)
+        self.retry_events(failed_creates, failed_deletes)
+        self.consumer.ack("zcp-nova")
+
+    def retry_events(self, creates, deletes):
+        """
+        Put the events zabbix failed to apply back to the pending ones, to
+        be retried after the batch window. Pending events hold back the
+        acknowledgement of the messages, so an event failed more than
+        max_retries times is dropped rather than blocking the queue.
+
+        :param creates: list of (instance_name, instance_id, tenant_name)
+        :param deletes: list of instance_id
+        """
+        retries = {}
+        for kind, events, pending in (
+                ('create', creates, self.pending_creates),
+                ('delete', deletes, self.pending_deletes)):
+            for event in events:
+                instance_id = event[1] if kind == 'create' else event
+                key = (kind, instance_id)
+                retries[key] = self.retries.get(key, 0) + 1
+                if retries[key] > self.max_retries:
+                    LOG.error("Drop the %s event of instance %s, failed %d "
+                              "times" % (kind, instance_id, retries[key]))
+                    del retries[key]
+                    continue
+                pending.append(event)
+        self.retries = retries
+        if self.has_pending_events():
+            self.schedule_flush()
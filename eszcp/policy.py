@@ -0,0 +1,137 @@
+"""
+Class for the polling policies of metrics
+
+Decides the interval, enabled state and priority a metric of a tenant
+
+is polled at, configured by the [policy:<name>] sections of proxy.conf
+"""
+
+import fnmatch
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+SECTION_PREFIX = 'policy:'
+DEFAULT_POLICY = 'default'
+# Smaller is more important, the metrics of the largest priority are shed
+# first under overload
+DEFAULT_PRIORITY = 5
+
+
+def split_list(value):
+    return [item.strip() for item in (value or '').split(',')
+            if item.strip()]
+
+
+class Policy(object):
+
+    def __init__(self, name, interval, metrics=None, tenants=None,
+                 enabled=True, priority=DEFAULT_PRIORITY):
+        """
+        :param name: policy name
+        :param interval: seconds between two polls of a metric
+        :param metrics: glob patterns of the metric names, None means all
+        :param tenants: glob patterns of the tenant names or ids(i.e. host
+                        group names), None means all
+        :param enabled: whether the metrics are polled at all
+        :param priority: smaller is more important
+        """
+        self.name = name
+        self.interval = int(interval)
+        self.metrics = metrics or ['*']
+        self.tenants = tenants or []
+        self.enabled = str(enabled).lower() in ('1', 'true', 'yes', 'on')
+        self.priority = int(priority)
+
+    def matches(self, metric, tenants=None):
+        """
+        :param metric: ceilometer meter name
+        :param tenants: the tenant name and id, None when the metric is
+                        polled for all the tenants at once
+        """
+        if not any(fnmatch.fnmatchcase(metric, pattern)
+                   for pattern in self.metrics):
+            return False
+        if not self.tenants:
+            return True
+        return any(fnmatch.fnmatchcase(tenant, pattern)
+                   for tenant in tenants or [] if tenant
+                   for pattern in self.tenants)
+
+
+class PolicySet(object):
+    """
+    The policies in the order of proxy.conf, the first one matching a
+    metric and tenant applies, otherwise the default one
+    """
+
+    def __init__(self, policies=None, default_interval=300):
+        """
+        :param policies: list of Policy
+        :param default_interval: interval of the metrics no policy matches
+        """
+        self.policies = list(policies or [])
+        self.default = Policy(DEFAULT_POLICY, default_interval)
+        self.cache = {}
+
+    @classmethod
+    def from_sections(cls, sections, default_interval=300):
+        """
+        :param sections: list of (section name, {option: value}), the
+                         sections not named policy:<name> are skipped
+        :param default_interval: interval of the metrics no policy matches
+        """
+        policies = []
+        for section, options in sections:
+            if not section.startswith(SECTION_PREFIX):
+                continue
+            policies.append(Policy(
+                section[len(SECTION_PREFIX):],
+                options.get('interval', default_interval),
+                metrics=split_list(options.get('metrics')),
+                tenants=split_list(options.get('tenants')),
+                enabled=options.get('enabled', True),
+                priority=options.get('priority', DEFAULT_PRIORITY)))
+        return cls(policies, default_interval)
+
+    def lookup(self, metric, tenant_id=None, tenant_name=None):
+        """
+        :param metric: ceilometer meter name
+        :param tenant_id: keystone tenant id
+        :param tenant_name: keystone tenant name, i.e. host group name
+        :return: the Policy applying
+        """
+        key = (metric, tenant_id, tenant_name)
+        policy = self.cache.get(key)
+        if policy is None:
+            tenants = None
+            if tenant_id or tenant_name:
+                tenants = [tenant_id, tenant_name]
+            policy = self.default
+            for candidate in self.policies:
+                if candidate.matches(metric, tenants):
+                    policy = candidate
+                    break
+            self.cache[key] = policy
+        return policy
+
+    def metric_groups(self, metrics, tenant_id=None, tenant_name=None):
+        """
+        Group the enabled metrics by the policy applying to them
+
+        :param metrics: ceilometer meter names
+        :param tenant_id: keystone tenant id
+        :param tenant_name: keystone tenant name
+        :return: {policy: [metric, ...]}
+        """
+        groups = {}
+        for metric in metrics:
+            policy = self.lookup(metric, tenant_id, tenant_name)
+            if policy.enabled:
+                groups.setdefault(policy, []).append(metric)
+        return groups
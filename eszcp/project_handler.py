@@ -6,9 +6,9 @@ Uses the pika library for handling the AMQP protocol,
 implementing the necessary callbacks for Keystone events
 """
 
+from eszcp import amqp_consumer
 from eszcp import log
 import json
-import pika
 
 LOG = log.logger(__name__)
 
@@ -24,41 +24,40 @@ __version__ = "1.0.0"
 class ProjectEvents:
 
     def __init__(self, rabbit_host, rabbit_user, rabbit_pass, rabbit_port,
-                 zabbix_handler):
+                 zabbix_handler, consumer=None):
         """
         :param rabbit_host: rabbit host
         :param rabbit_user: rabbit user
         :param rabbit_pass: rabbit user password
         :param zabbix_handler: zabbix api handler
+        :param consumer: amqp_consumer.Consumer used to listen to keystone
+                         events
         """
         self.rabbit_host = rabbit_host
         self.rabbit_user = rabbit_user
         self.rabbit_pass = rabbit_pass
         self.rabbit_port = rabbit_port
         self.zabbix_handler = zabbix_handler
+        self.consumer = consumer or amqp_consumer.Consumer(rabbit_host,
+                                                           rabbit_user,
+                                                           rabbit_pass,
+                                                           rabbit_port)
 
     def keystone_amq(self):
         """
         Method used to listen to keystone events
         """
+        self.subscribe()
+        self.consumer.run()
 
-        connection = pika.BlockingConnection(pika.ConnectionParameters(
-                                    host=self.rabbit_host,
-                                    port=int(self.rabbit_port),
-                                    credentials=pika.PlainCredentials(
-                                        self.rabbit_user,
-                                        self.rabbit_pass))
-                     )
-        channel = connection.channel()
-        channel.exchange_declare(exchange='keystone', type='topic')
-        channel.queue_declare(queue="zcp-keystone", exclusive=True)
-        channel.queue_bind(exchange='keystone',
-                           queue="zcp-keystone",
-                           routing_key='notifications.#')
-        channel.basic_consume(self.keystone_callback,
-                              queue="zcp-keystone",
-                              no_ack=True)
-        channel.start_consuming()
+    def subscribe(self):
+        """
+        Subscribe keystone events on the consumer, which may be shared with
+        other listeners
+        """
+        self.consumer.subscribe('keystone', "zcp-keystone",
+                                ['notifications.#'],
+                                self.keystone_callback)
 
     def keystone_callback(self, ch, method, properties, body):
         """
@@ -80,6 +79,7 @@ class ProjectEvents:
                 LOG.info("Creating a hostgroup: %s(%s) in Zabbix Server"
                          % (tenant_id, tenant_name))
                 self.zabbix_handler.group_list.append([tenant_name, tenant_id])
+                self.zabbix_handler.save_tenants()
                 self.zabbix_handler.create_host_group(tenant_name)
             elif payload['event_type'] == 'identity.project.deleted':
                 tenant_id = payload['payload']['resource_info']
@@ -9,11 +9,18 @@ OpenStack's Nova and RabbitMQ for reflecting changes in
 Projects/Tenants and Instances
 """
 
+from eszcp import amqp_consumer
 from eszcp import ceilometer_handler
+from eszcp import circuit
+from eszcp import http_client
+from eszcp import inventory
+from eszcp import limiter
 from eszcp import log
 from eszcp import nova_handler
+from eszcp import policy
 from eszcp import project_handler
 from eszcp import readFile
+from eszcp import spool
 from eszcp import token_handler
 from eszcp import zabbix_handler
 import multiprocessing
@@ -31,28 +38,290 @@ LOG = log.logger(__name__)
 conf_file = readFile.ReadConfFile()
 
 
+def amqp_consumer_from_conf():
+    """
+    :return: an amqp_consumer.Consumer configured by [os_rabbitmq]
+    """
+    return amqp_consumer.Consumer(
+                conf_file.read_option('os_rabbitmq', 'rabbit_host'),
+                conf_file.read_option('os_rabbitmq', 'rabbit_user'),
+                conf_file.read_option('os_rabbitmq', 'rabbit_pass'),
+                conf_file.read_option('os_rabbitmq', 'rabbit_port'),
+                durable=conf_file.read_option('os_rabbitmq',
+                                              'durable_queues',
+                                              default=False),
+                prefetch_count=conf_file.read_option('os_rabbitmq',
+                                                     'prefetch_count',
+                                                     default=100),
+                ack_batch_size=conf_file.read_option('os_rabbitmq',
+                                                     'ack_batch_size',
+                                                     default=50),
+                ack_interval=conf_file.read_option('os_rabbitmq',
+                                                   'ack_interval',
+                                                   default=1),
+                reconnect_delay=conf_file.read_option('os_rabbitmq',
+                                                      'reconnect_delay',
+                                                      default=1),
+                reconnect_max_delay=conf_file.read_option(
+                                                      'os_rabbitmq',
+                                                      'reconnect_max_delay',
+                                                      default=60))
+
+
+def backend_limiter(name):
+    """
+    :param name: backend name, i.e. ceilometer, nova or zabbix
+    :return: a limiter.AdaptiveLimiter configured by [zcp_configs]
+    """
+    return limiter.AdaptiveLimiter(
+                name,
+                max_limit=conf_file.read_option('zcp_configs',
+                                                'backend_max_requests',
+                                                default=8),
+                rate=conf_file.read_option('zcp_configs',
+                                           name + '_rate_limit',
+                                           default=0),
+                latency_target=conf_file.read_option(
+                                                'zcp_configs',
+                                                'backend_latency_target',
+                                                default=2))
+
+
+def circuit_breakers():
+    """
+    :return: a circuit.CircuitBreakers configured by [zcp_configs]
+    """
+    return circuit.CircuitBreakers(
+                failure_threshold=conf_file.read_option(
+                                                'zcp_configs',
+                                                'circuit_failure_threshold',
+                                                default=5),
+                reset_timeout=conf_file.read_option(
+                                                'zcp_configs',
+                                                'circuit_reset_timeout',
+                                                default=30),
+                max_reset_timeout=conf_file.read_option(
+                                                'zcp_configs',
+                                                'circuit_max_reset_timeout',
+                                                default=300))
+
+
+def spool_from_conf():
+    """
+    :return: a spool.Spool configured by [zabbix_configs], None if
+             spool_path is empty
+    """
+    spool_path = conf_file.read_option('zabbix_configs', 'spool_path',
+                                       default=spool.DEFAULT_PATH)
+    if not spool_path:
+        return None
+    return spool.Spool(spool_path,
+                       segment_size=conf_file.read_option(
+                                        'zabbix_configs',
+                                        'spool_segment_size',
+                                        default=4194304),
+                       max_size=conf_file.read_option('zabbix_configs',
+                                                      'spool_max_size',
+                                                      default=268435456),
+                       fsync=conf_file.read_option('zabbix_configs',
+                                                   'spool_fsync',
+                                                   default=False))
+
+
+def http_client_from_conf():
+    """
+    :return: the http_client.HTTPClient shared by all the handlers
+    """
+    return http_client.HTTPClient(conf_file.read_option(
+                                      'zcp_configs',
+                                      'http_connect_timeout',
+                                      default=10),
+                                    conf_file.read_option(
+                                      'zcp_configs',
+                                      'http_read_timeout',
+                                      default=60),
+                                    conf_file.read_option(
+                                      'zcp_configs',
+                                      'http_pool_size',
+                                      default=8))
+
+
+def keystone_auth_from_conf(http):
+    """
+    :param http: the shared http_client.HTTPClient
+    :return: a token_handler.Auth configured by [keystone_authtoken]
+    """
+    return token_handler.Auth(conf_file.read_option(
+                               'keystone_authtoken',
+                               'keystone_host'),
+                              conf_file.read_option(
+                               'keystone_authtoken',
+                               'keystone_public_port'),
+                              conf_file.read_option(
+                               'keystone_authtoken',
+                               'admin_tenant'),
+                              conf_file.read_option(
+                               'keystone_authtoken',
+                               'admin_user'),
+                              conf_file.read_option(
+                               'keystone_authtoken',
+                               'admin_password'),
+                              refresh_margin=conf_file.read_option(
+                               'keystone_authtoken',
+                               'token_refresh_margin',
+                               default=300),
+                              http=http)
+
+
+def ceilometer_handler_from_conf(http, keystone_auth, shared_inventory,
+                                 spooled=True):
+    """
+    :param http: the shared http_client.HTTPClient
+    :param keystone_auth: the shared token_handler.Auth
+    :param shared_inventory: the inventory.Inventory shared by the processes
+    :param spooled: whether to spool the values zabbix failed to receive
+    :return: a ceilometer_handler.CeilometerHandler configured by proxy.conf
+    """
+    return ceilometer_handler.CeilometerHandler(
+                        conf_file.read_option('ceilometer_configs',
+                                              'ceilometer_api_port'),
+                        conf_file.read_option('zcp_configs',
+                                              'polling_interval'),
+                        conf_file.read_option('zcp_configs',
+                                              'template_name'),
+                        conf_file.read_option('ceilometer_configs',
+                                              'ceilometer_api_host'),
+                        conf_file.read_option('zabbix_configs',
+                                              'zabbix_host'),
+                        conf_file.read_option('zabbix_configs',
+                                              'zabbix_port'),
+                        conf_file.read_option('zcp_configs',
+                                              'zabbix_proxy_name'),
+                        conf_file.read_option('nova_configs',
+                                              'nova_host'),
+                        conf_file.read_option('nova_configs',
+                                              'nova_port'),
+                        conf_file.read_option('keystone_authtoken',
+                                              'admin_tenant_id'),
+                        keystone_auth,
+                        sender_batch_size=conf_file.read_option(
+                                              'zabbix_configs',
+                                              'sender_batch_size',
+                                              default=250),
+                        sender_flush_interval=conf_file.read_option(
+                                              'zabbix_configs',
+                                              'sender_flush_interval',
+                                              default=5000),
+                        sender_max_retries=conf_file.read_option(
+                                              'zabbix_configs',
+                                              'sender_max_retries',
+                                              default=3),
+                        polling_workers=conf_file.read_option(
+                                              'zcp_configs',
+                                              'polling_workers',
+                                              default=1),
+                        backend_max_requests=conf_file.read_option(
+                                              'zcp_configs',
+                                              'backend_max_requests',
+                                              default=8),
+                        polling_mode=conf_file.read_option(
+                                              'zcp_configs',
+                                              'polling_mode',
+                                              default='resource'),
+                        groupby_per_tenant=conf_file.read_option(
+                                              'zcp_configs',
+                                              'groupby_per_tenant',
+                                              default=False),
+                        http=http,
+                        inventory_refresh_interval=conf_file.read_option(
+                                              'zcp_configs',
+                                              'inventory_refresh_interval',
+                                              default=3600),
+                        resource_cache_size=conf_file.read_option(
+                                              'zcp_configs',
+                                              'resource_cache_size',
+                                              default=20000),
+                        resource_miss_threshold=conf_file.read_option(
+                                              'zcp_configs',
+                                              'resource_miss_threshold',
+                                              default=3),
+                        resource_discovery_ttl=conf_file.read_option(
+                                              'zcp_configs',
+                                              'resource_discovery_ttl',
+                                              default=3600),
+                        inventory=shared_inventory,
+                        snapshot_interval=conf_file.read_option(
+                                              'zcp_configs',
+                                              'snapshot_interval',
+                                              default=300),
+                        snapshot_max_age=conf_file.read_option(
+                                              'zcp_configs',
+                                              'snapshot_max_age',
+                                              default=86400),
+                        scheduler_tick=conf_file.read_option(
+                                              'zcp_configs',
+                                              'scheduler_tick',
+                                              default=1),
+                        polling_batch_size=conf_file.read_option(
+                                              'zcp_configs',
+                                              'polling_batch_size',
+                                              default=500),
+                        policies=policy.PolicySet.from_sections(
+                                conf_file.read_sections(
+                                    policy.SECTION_PREFIX),
+                                default_interval=conf_file.read_option(
+                                              'zcp_configs',
+                                              'polling_interval')),
+                        first_poll_delay=conf_file.read_option(
+                                              'zcp_configs',
+                                              'first_poll_delay',
+                                              default=60),
+                        limiters={'ceilometer': backend_limiter('ceilometer'),
+                                  'nova': backend_limiter('nova')},
+                        sender_timeout=conf_file.read_option(
+                                              'zabbix_configs',
+                                              'sender_timeout',
+                                              default=10),
+                        cycle_budget=conf_file.read_option(
+                                              'zcp_configs',
+                                              'cycle_budget',
+                                              default=60),
+                        breakers=circuit_breakers(),
+                        spool=spool_from_conf() if spooled else None,
+                        replay_batch_size=conf_file.read_option(
+                                              'zabbix_configs',
+                                              'spool_replay_batch_size',
+                                              default=1000),
+                        replay_rate=conf_file.read_option(
+                                              'zabbix_configs',
+                                              'spool_replay_rate',
+                                              default=2000),
+                        ingest_lag=conf_file.read_option(
+                                              'zcp_configs',
+                                              'ingest_lag',
+                                              default=60))
+
+
 def init_zcp(processes):
     """
         Method used to initialize the Zabbix-Ceilometer Proxy
     """
 
+    # Creation of the HTTP client shared by all the handlers
+    # Responsible for pooling keep-alive connections of REST requests
+    http = http_client_from_conf()
+
+    # Creation of the inventory shared by all the processes
+    # Responsible for keeping zabbix hosts and host groups, versioned
+    shared_inventory = inventory.Inventory(conf_file.read_option(
+                                    'zcp_configs',
+                                    'inventory_path',
+                                    default=inventory.DEFAULT_PATH))
+
     # Creation of the Auth keystone-dedicated authentication class
-    # Responsible for managing AAA related requests
-    keystone_auth = token_handler.Auth(conf_file.read_option(
-                                        'keystone_authtoken',
-                                        'keystone_host'),
-                                       conf_file.read_option(
-                                        'keystone_authtoken',
-                                        'keystone_public_port'),
-                                       conf_file.read_option(
-                                        'keystone_authtoken',
-                                        'admin_tenant'),
-                                       conf_file.read_option(
-                                        'keystone_authtoken',
-                                        'admin_user'),
-                                       conf_file.read_option(
-                                        'keystone_authtoken',
-                                        'admin_password'))
+    # Responsible for managing AAA related requests, the token it caches
+    # is shared by all the processes started below
+    keystone_auth = keystone_auth_from_conf(http)
 
     # Creation of the Zabbix Handler class
     # Responsible for the communication with Zabbix
@@ -80,37 +349,36 @@ def init_zcp(processes):
                                               conf_file.read_option(
                                                     'zcp_configs',
                                                     'zabbix_proxy_name'),
-                                              keystone_auth)
+                                              keystone_auth,
+                                              http=http,
+                                              bulk_chunk_size=conf_file.
+                                              read_option(
+                                                    'zcp_configs',
+                                                    'zabbix_bulk_chunk_size',
+                                                    default=200),
+                                              inventory=shared_inventory,
+                                              snapshot_max_age=conf_file.
+                                              read_option(
+                                                    'zcp_configs',
+                                                    'snapshot_max_age',
+                                                    default=86400),
+                                              limiter=backend_limiter(
+                                                    'zabbix'))
 
     # Creation of the Ceilometer Handler class
     # Responsible for the communication with OpenStack's Ceilometer,
     # polling for changes every N seconds
-    ceilometer_hdl = ceilometer_handler.CeilometerHandler(
-                        conf_file.read_option('ceilometer_configs',
-                                              'ceilometer_api_port'),
-                        conf_file.read_option('zcp_configs',
-                                              'polling_interval'),
-                        conf_file.read_option('zcp_configs',
-                                              'template_name'),
-                        conf_file.read_option('ceilometer_configs',
-                                              'ceilometer_api_host'),
-                        conf_file.read_option('zabbix_configs',
-                                              'zabbix_host'),
-                        conf_file.read_option('zabbix_configs',
-                                              'zabbix_port'),
-                        conf_file.read_option('zcp_configs',
-                                              'zabbix_proxy_name'),
-                        conf_file.read_option('nova_configs',
-                                              'nova_host'),
-                        conf_file.read_option('nova_configs',
-                                              'nova_port'),
-                        conf_file.read_option('keystone_authtoken',
-                                              'admin_tenant_id'),
-                        keystone_auth)
+    ceilometer_hdl = ceilometer_handler_from_conf(http, keystone_auth,
+                                                 shared_inventory)
 
     # First run of the Zabbix handler for retrieving the necessary information
     zabbix_hdl.first_run()
 
+    # Creation of the AMQP consumer shared by the Nova and Project Handlers
+    # Responsible for consuming nova and keystone exchanges over one
+    # connection, on a channel each
+    consumer = amqp_consumer_from_conf()
+
     # Creation of the Nova Handler class
     # Responsible for detecting the creation of new instances in OpenStack,
     # translated then to Hosts in Zabbix
@@ -120,7 +388,17 @@ def init_zcp(processes):
                 conf_file.read_option('os_rabbitmq', 'rabbit_pass'),
                 conf_file.read_option('os_rabbitmq', 'rabbit_port'),
                 zabbix_hdl,
-                ceilometer_hdl)
+                ceilometer_hdl,
+                batch_window=conf_file.read_option('zcp_configs',
+                                                   'event_batch_window',
+                                                   default=2),
+                batch_size=conf_file.read_option('zcp_configs',
+                                                 'event_batch_size',
+                                                 default=100),
+                consumer=consumer,
+                max_retries=conf_file.read_option('zcp_configs',
+                                                  'event_max_retries',
+                                                  default=3))
 
     # Creation of the Project Handler class
     # Responsible for detecting the creation of new tenants in OpenStack,
@@ -130,23 +408,23 @@ def init_zcp(processes):
                 conf_file.read_option('os_rabbitmq', 'rabbit_user'),
                 conf_file.read_option('os_rabbitmq', 'rabbit_pass'),
                 conf_file.read_option('os_rabbitmq', 'rabbit_port'),
-                zabbix_hdl)
+                zabbix_hdl,
+                consumer=consumer)
 
     # Create and append processes to process list
-    LOG.INFO('**************** Keystone listener started ****************')
-    p1 = multiprocessing.Process(target=project_hdl.keystone_amq)
+    # Keystone and Nova events are handled by one process, sharing the
+    # state of the Zabbix Handler
+    project_hdl.subscribe()
+    nova_hdl.subscribe()
+    LOG.INFO('************ Keystone and Nova listener started ************')
+    p1 = multiprocessing.Process(target=consumer.run)
     p1.daemon = True
     processes.append(p1)
 
-    LOG.INFO('**************** Nova listener started ****************')
-    p2 = multiprocessing.Process(target=nova_hdl.nova_amq)
+    p2 = multiprocessing.Process(target=ceilometer_hdl.interval_run)
     p2.daemon = True
     processes.append(p2)
 
-    p3 = multiprocessing.Process(target=ceilometer_hdl.interval_run)
-    p3.daemon = True
-    processes.append(p3)
-
     # start all the processes
     [ps.start() for ps in processes]
 
@@ -114,7 +114,7 @@ class ReadConfFile:
         value = None
         try:
             value = self.config.get(group, name, raw=raw)
-        except NoOptionError or NoSectionError:
+        except (NoOptionError, NoSectionError):
             if default is not None:
                 return default
             else:
@@ -122,3 +122,13 @@ class ReadConfFile:
         except Exception:
             raise
         return value
+
+    def read_sections(self, prefix=''):
+        """
+        :param prefix: only the sections whose name starts with prefix
+        :return: list of (section name, {option: value}), in the order of
+                 the conf file
+        """
+        return [(section, dict(self.config.items(section, raw=True)))
+                for section in self.config.sections()
+                if section.startswith(prefix)]
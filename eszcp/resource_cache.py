@@ -0,0 +1,266 @@
+"""
+Class for caching the resource topology of instances
+
+Keeps the ceilometer resources(nics, volumes) of every instance polled,
+
+evicting instances and resources which are gone
+"""
+
+from collections import OrderedDict
+from eszcp import log
+import threading
+import time
+
+LOG = log.logger(__name__)
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+
+class ResourceCache(object):
+    """
+    A LRU cache of {"instance_id": {"resource_id": METRICS, ...}, ...}
+
+    An instance is evicted when it is deleted, or when the cache holds more
+    than max_size instances(the least recently used one is evicted). A
+    resource is evicted when it is missing from miss_threshold consecutive
+    discoveries of its instance.
+
+    The resources of an instance are re-discovered only when its last
+    discovery is older than a TTL, or it was invalidated by an event.
+    """
+
+    def __init__(self, max_size=20000, miss_threshold=3):
+        """
+        :param max_size: max instances cached
+        :param miss_threshold: consecutive discoveries a resource may be
+                               missing from before it is evicted
+        """
+        self.max_size = int(max_size)
+        self.miss_threshold = int(miss_threshold)
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+        # consecutive discoveries missing a resource, {(instance, rsc): n}
+        self.missing = {}
+        # timestamp of the last discovery of instances, 0 means invalidated
+        self.discovered_at = {}
+        self.listeners = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_size=None, miss_threshold=None):
+        """
+        :param max_size: max instances cached
+        :param miss_threshold: consecutive discoveries a resource may be
+                               missing from before it is evicted
+        """
+        with self.lock:
+            if max_size is not None:
+                self.max_size = int(max_size)
+            if miss_threshold is not None:
+                self.miss_threshold = int(miss_threshold)
+            self._evict_lru()
+
+    def add_listener(self, listener):
+        """
+        Register a hook called on eviction, a hook already registered is
+        not added again
+
+        :param listener: function accepting (instance_id, resource_ids)
+        """
+        with self.lock:
+            if listener not in self.listeners:
+                self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        Unregister a hook called on eviction
+
+        :param listener: a function passed to add_listener
+        """
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def __contains__(self, instance_id):
+        with self.lock:
+            return instance_id in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def __getitem__(self, instance_id):
+        resources = self.get(instance_id)
+        if resources is None:
+            raise KeyError(instance_id)
+        return resources
+
+    def __setitem__(self, instance_id, resources):
+        with self.lock:
+            self.entries.pop(instance_id, None)
+            self.entries[instance_id] = dict(resources)
+            self._evict_lru()
+
+    def keys(self):
+        with self.lock:
+            return self.entries.keys()
+
+    def get(self, instance_id, default=None):
+        """
+        :param instance_id: nova instance uuid
+        :return: a copy of {"resource_id": METRICS} of the instance
+        """
+        with self.lock:
+            resources = self.entries.pop(instance_id, None)
+            if resources is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries[instance_id] = resources
+            return dict(resources)
+
+    def update_resources(self, instance_id, resources):
+        """
+        Merge the resources discovered for an instance
+
+        :param instance_id: nova instance uuid
+        :param resources: {"resource_id": METRICS} discovered
+        """
+        evicted = []
+        with self.lock:
+            cached = self.entries.pop(instance_id, {})
+            for resource_id in cached.keys():
+                key = (instance_id, resource_id)
+                if resource_id in resources:
+                    self.missing.pop(key, None)
+                    continue
+                self.missing[key] = self.missing.get(key, 0) + 1
+                if self.missing[key] >= self.miss_threshold:
+                    del cached[resource_id]
+                    del self.missing[key]
+                    evicted.append(resource_id)
+            for resource_id, metrics in resources.items():
+                cached.setdefault(resource_id, metrics)
+            self.entries[instance_id] = cached
+            self.discovered_at[instance_id] = time.time()
+            self.evictions += len(evicted)
+            self._evict_lru()
+        if evicted:
+            LOG.debug("Evict resources %s of instance %s"
+                      % (", ".join(evicted), instance_id))
+            self._notify(instance_id, evicted)
+
+    def expired(self, instance_id, ttl):
+        """
+        Whether the resources of an instance should be re-discovered
+
+        :param instance_id: nova instance uuid
+        :param ttl: max age(seconds) of the last discovery
+        """
+        with self.lock:
+            return time.time() - self.discovered_at.get(instance_id, 0) >= ttl
+
+    def invalidate(self, instance_id):
+        """
+        Force the re-discovery of an instance, e.g. a nic or a volume
+        was attached or detached
+
+        :param instance_id: nova instance uuid
+        """
+        with self.lock:
+            if instance_id in self.discovered_at:
+                self.discovered_at[instance_id] = 0
+
+    def evict(self, instance_id):
+        """
+        Evict an instance, e.g. it was deleted
+
+        :param instance_id: nova instance uuid
+        """
+        with self.lock:
+            resources = self.entries.pop(instance_id, None)
+            if resources is None:
+                return
+            self._forget_missing(instance_id, resources)
+            self.evictions += 1
+        self._notify(instance_id, resources.keys())
+
+    def retain(self, instance_ids):
+        """
+        Evict the instances not in instance_ids
+
+        :param instance_ids: the nova instance uuids still existing
+        """
+        instance_ids = set(instance_ids)
+        for instance_id in self.keys():
+            if instance_id not in instance_ids:
+                self.evict(instance_id)
+
+    def stats(self):
+        """
+        :return: the counters of the cache
+        """
+        with self.lock:
+            return {"size": len(self.entries),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
+
+    def snapshot(self):
+        """
+        :return: the entries and discovery timestamps, in LRU order, as a
+                 json serializable dict
+        """
+        with self.lock:
+            return {"entries": [[instance_id, resources]
+                                for instance_id, resources
+                                in self.entries.items()],
+                    "discovered_at": dict(self.discovered_at)}
+
+    def restore(self, snapshot, instance_ids=None):
+        """
+        Load a snapshot into the cache, e.g. on a warm restart
+
+        :param snapshot: a dict returned by snapshot()
+        :param instance_ids: the nova instance uuids still existing, the
+                             other instances of the snapshot are skipped
+        """
+        if instance_ids is not None:
+            instance_ids = set(instance_ids)
+        discovered_at = snapshot.get("discovered_at", {})
+        with self.lock:
+            for instance_id, resources in snapshot.get("entries", []):
+                if instance_ids is not None and \
+                        instance_id not in instance_ids:
+                    continue
+                self.entries.pop(instance_id, None)
+                self.entries[instance_id] = dict(resources)
+                self.discovered_at[instance_id] = \
+                    discovered_at.get(instance_id, 0)
+            self._evict_lru()
+
+    def _evict_lru(self):
+        while len(self.entries) > self.max_size:
+            instance_id, resources = self.entries.popitem(last=False)
+            self._forget_missing(instance_id, resources)
+            self.evictions += 1
+            self._notify(instance_id, resources.keys())
+
+    def _forget_missing(self, instance_id, resources):
+        self.discovered_at.pop(instance_id, None)
+        for resource_id in resources:
+            self.missing.pop((instance_id, resource_id), None)
+
+    def _notify(self, instance_id, resource_ids):
+        for listener in self.listeners:
+            try:
+                listener(instance_id, resource_ids)
+            except Exception, ex:
+                LOG.error("Eviction hook failed: %s" % ex)
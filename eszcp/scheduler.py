@@ -0,0 +1,208 @@
+"""
+Class for scheduling the polling of Ceilometer
+
+Gives every polled key(a nova instance, or a metric in groupby mode) its
+
+own due time, spread across the polling interval, kept in a deadline heap
+"""
+
+import hashlib
+import heapq
+import threading
+import time
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+
+def phase(key, interval):
+    """
+    A stable offset of a key within the interval, so the keys are spread
+    evenly and keep their slot across restarts
+
+    :param key: the key scheduled, str or tuple of str
+    :param interval: the polling interval(seconds)
+    :return: the offset(seconds) in [0, interval)
+    """
+    digest = hashlib.md5(repr(key)).hexdigest()
+    return int(digest[:8], 16) / float(0x100000000) * interval
+
+
+class DeadlineScheduler(object):
+    """
+    A deadline heap of keys polled every interval
+
+    A key is rescheduled an interval after its previous due time rather
+    than after it was polled, so the cadence doesn't drift with the time
+    polling takes. A key overdue by more than an interval skips the slots
+    it missed instead of being polled several times in a row.
+
+    Every key may have its own interval and priority. When more keys are
+    due than polled in a tick, the ones of the smallest priority value go
+    first, so the least important keys are shed under overload.
+    """
+
+    def __init__(self, interval):
+        """
+        :param interval: default seconds between two polls of a key
+        """
+        self.interval = float(interval)
+        # {key: (interval, priority)} of the keys not using the default
+        self.policies = {}
+        self.lock = threading.Lock()
+        self.heap = []
+        # the current due time of every key, heap entries of other due
+        # times are stale
+        self.due = {}
+        self.skipped = 0
+        # keys popped but not polled before the deadline of their tick
+        self.deferred = 0
+
+    def __len__(self):
+        return len(self.due)
+
+    def __contains__(self, key):
+        return key in self.due
+
+    def sync(self, keys, now=None):
+        """
+        Schedule the new keys and forget the ones gone, the keys whose
+        interval changed are moved to their slot of the new interval unless
+        they are due earlier
+
+        :param keys: all the keys to poll, or a dict of key and its
+                     (interval, priority)
+        :param now: current timestamp
+        """
+        now = time.time() if now is None else now
+        policies = keys if isinstance(keys, dict) else {}
+        keys = set(keys)
+        with self.lock:
+            for key in set(self.due) - keys:
+                del self.due[key]
+                self.policies.pop(key, None)
+            for key, (interval, priority) in policies.items():
+                previous = self.interval_of(key)
+                self.policies[key] = (float(interval), int(priority))
+                if key in self.due and previous != float(interval):
+                    self.schedule(key, min(self.due[key],
+                                           self.next_slot(key, now)))
+            for key in keys - set(self.due):
+                self.schedule(key, self.next_slot(key, now))
+            # Drop the stale entries once they make most of the heap
+            if len(self.heap) > 2 * len(self.due) + 64:
+                self.heap = [(due, key) for due, key in self.heap
+                             if self.due.get(key) == due]
+                heapq.heapify(self.heap)
+
+    def add(self, keys, due):
+        """
+        Schedule new keys at a given due time, keeping the other keys
+
+        :param keys: the keys to add, or a dict of key and its
+                     (interval, priority)
+        :param due: the first due time of the keys
+        """
+        policies = keys if isinstance(keys, dict) else {}
+        with self.lock:
+            for key, (interval, priority) in policies.items():
+                self.policies[key] = (float(interval), int(priority))
+            for key in keys:
+                self.schedule(key, due)
+
+    def reschedule(self, key, due):
+        """
+        :param key: a key scheduled
+        :param due: its new due time
+        """
+        with self.lock:
+            if key in self.due:
+                self.schedule(key, due)
+
+    def pop_due(self, now=None, limit=None):
+        """
+        Pop the keys due, most important and most overdue first, and
+        reschedule them
+
+        :param now: current timestamp
+        :param limit: max keys popped, None means all the keys due
+        :return: list of (key, lag), lag is seconds the key is overdue
+        """
+        now = time.time() if now is None else now
+        popped = []
+        with self.lock:
+            due_keys = []
+            while self.heap and self.heap[0][0] <= now:
+                due, key = heapq.heappop(self.heap)
+                if self.due.get(key) == due:
+                    due_keys.append((self.priority(key), due, key))
+            due_keys.sort()
+            if limit is not None:
+                # Shed the rest until the next tick
+                for _, due, key in due_keys[limit:]:
+                    heapq.heappush(self.heap, (due, key))
+                due_keys = due_keys[:limit]
+            for _, due, key in due_keys:
+                popped.append((key, now - due))
+                interval = self.interval_of(key)
+                missed = int((now - due) // interval)
+                self.skipped += missed
+                self.schedule(key, due + (missed + 1) * interval)
+        return popped
+
+    def defer(self, keys, now):
+        """
+        Put back keys popped but not polled in time, due at their original
+        due time again, so the next tick polls them first among the keys
+        of their priority
+
+        :param keys: list of (key, lag) popped by pop_due
+        :param now: the timestamp pop_due was called at
+        """
+        with self.lock:
+            for key, lag in keys:
+                if key not in self.due:
+                    continue
+                self.deferred += 1
+                # The slots missed were already skipped by pop_due
+                self.schedule(key, now - lag % self.interval_of(key))
+
+    def next_due(self):
+        """
+        :return: the earliest due time, None if nothing is scheduled
+        """
+        with self.lock:
+            while self.heap and self.due.get(self.heap[0][1]) != \
+                    self.heap[0][0]:
+                heapq.heappop(self.heap)
+            return self.heap[0][0] if self.heap else None
+
+    def overdue(self, now=None):
+        """
+        :param now: current timestamp
+        :return: a tuple of (keys overdue, max lag in seconds)
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            lags = [now - due for due in self.due.values() if due <= now]
+        return len(lags), max(lags) if lags else 0.0
+
+    def interval_of(self, key):
+        return self.policies.get(key, (self.interval, 0))[0]
+
+    def priority(self, key):
+        return self.policies.get(key, (self.interval, 0))[1]
+
+    def next_slot(self, key, now):
+        interval = self.interval_of(key)
+        slot = now - now % interval + phase(key, interval)
+        return slot if slot >= now else slot + interval
+
+    def schedule(self, key, due):
+        self.due[key] = due
+        heapq.heappush(self.heap, (due, key))
@@ -0,0 +1,225 @@
+"""
+Class for spooling the values Zabbix failed to receive
+
+Keeps the values in append-only segment files on the local disk, so they
+
+survive restarts of the proxy and are replayed once Zabbix is back
+"""
+
+from eszcp import log
+import json
+import os
+import re
+import threading
+
+LOG = log.logger(__name__)
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+DEFAULT_PATH = '/var/lib/eszcp/spool'
+SEGMENT_PATTERN = re.compile(r'^(\d{20})\.seg$')
+CURSOR_FILE = 'cursor'
+
+
+class Spool(object):
+    """
+    A write-ahead queue of {"host", "key", "value", "clock"} values
+
+    Every segment holds one json value per line. The cursor, i.e. the
+    segment and offset of the first value not replayed yet, is saved in its
+    own file, the segments before it are deleted. Once the spool exceeds
+    max_size, its oldest segments are dropped.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, segment_size=4194304,
+                 max_size=268435456, fsync=False):
+        """
+        :param path: the directory of the segment files
+        :param segment_size: bytes a segment holds before the next one is
+                             started
+        :param max_size: max bytes of all the segments
+        :param fsync: whether to sync every append to the disk
+        """
+        self.path = path
+        self.segment_size = int(segment_size)
+        self.max_size = int(max_size)
+        self.fsync = str(fsync).lower() in ('1', 'true', 'yes', 'on')
+        self.lock = threading.Lock()
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # {segment number: bytes}
+        self.sizes = {}
+        for name in os.listdir(path):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                self.sizes[int(match.group(1))] = \
+                    os.path.getsize(os.path.join(path, name))
+        self.cursor = self.load_cursor()
+        self.writer = None
+        self.writer_segment = None
+        self.dropped = 0
+
+    def __len__(self):
+        """
+        :return: bytes not replayed yet
+        """
+        with self.lock:
+            return self.backlog()
+
+    def append(self, values):
+        """
+        :param values: list of {"host", "key", "value", "clock"} dict
+        """
+        if not values:
+            return
+        data = ''.join(json.dumps(value) + '\n' for value in values)
+        with self.lock:
+            writer = self.open_writer()
+            writer.write(data)
+            writer.flush()
+            if self.fsync:
+                os.fsync(writer.fileno())
+            self.sizes[self.writer_segment] += len(data)
+            self.enforce_max_size()
+
+    def read(self, max_values):
+        """
+        Read the oldest values not replayed yet, without consuming them
+
+        :param max_values: max values to read
+        :return: a tuple of (cursor, values), commit the cursor once the
+                 values are replayed
+        """
+        with self.lock:
+            segment, offset = self.cursor
+            values = []
+            for number in sorted(self.sizes):
+                if number < segment or not self.sizes[number]:
+                    continue
+                if number > segment:
+                    segment, offset = number, 0
+                with open(self.segment_path(number), 'rb') as f:
+                    f.seek(offset)
+                    while len(values) < max_values:
+                        line = f.readline()
+                        # The end, or a line torn by a crash
+                        if not line.endswith('\n'):
+                            break
+                        offset += len(line)
+                        try:
+                            values.append(json.loads(line))
+                        except ValueError:
+                            LOG.warning("Skip a corrupted line of spool "
+                                        "segment %d" % number)
+                if len(values) >= max_values:
+                    break
+            return (segment, offset), values
+
+    def commit(self, cursor):
+        """
+        Consume the values read up to cursor, deleting the segments done
+
+        :param cursor: the cursor returned by read
+        """
+        with self.lock:
+            self.cursor = cursor
+            for number in sorted(self.sizes):
+                if number >= cursor[0]:
+                    break
+                self.remove_segment(number)
+            self.save_cursor()
+
+    def backlog(self):
+        segment, offset = self.cursor
+        return sum(size for number, size in self.sizes.items()
+                   if number >= segment) - offset
+
+    def open_writer(self):
+        if self.writer is not None and \
+                self.sizes[self.writer_segment] < self.segment_size:
+            return self.writer
+        last = max(self.sizes) if self.sizes else 0
+        if self.writer is None and self.sizes and \
+                self.sizes[last] < self.segment_size and \
+                self.ends_with_newline(last):
+            # Go on appending to the last segment of the previous run
+            number = last
+        else:
+            number = last + 1
+            self.sizes[number] = 0
+        self.close()
+        self.writer = open(self.segment_path(number), 'ab')
+        self.writer_segment = number
+        return self.writer
+
+    def enforce_max_size(self):
+        """
+        Drop the oldest segments while the spool is larger than max_size
+        """
+        while sum(self.sizes.values()) > self.max_size:
+            oldest = min(self.sizes)
+            if oldest == self.writer_segment:
+                if len(self.sizes) == 1 and self.sizes[oldest] > 0:
+                    # Start a new segment, so the full one can be dropped
+                    self.close()
+                    self.sizes[oldest + 1] = 0
+                    continue
+                break
+            with open(self.segment_path(oldest), 'rb') as f:
+                if self.cursor[0] == oldest:
+                    f.seek(self.cursor[1])
+                dropped = f.read().count('\n')
+            self.remove_segment(oldest)
+            if self.cursor[0] <= oldest:
+                self.cursor = (oldest + 1, 0)
+                self.save_cursor()
+            self.dropped += dropped
+            LOG.warning("Spool exceeds %d bytes, drop the oldest %d values"
+                        % (self.max_size, dropped))
+
+    def remove_segment(self, number):
+        if number == self.writer_segment:
+            self.close()
+        del self.sizes[number]
+        try:
+            os.remove(self.segment_path(number))
+        except OSError, ex:
+            LOG.error("Failed to remove spool segment %d: %s" % (number, ex))
+
+    def ends_with_newline(self, number):
+        if not self.sizes[number]:
+            return True
+        with open(self.segment_path(number), 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == '\n'
+
+    def load_cursor(self):
+        try:
+            with open(os.path.join(self.path, CURSOR_FILE)) as f:
+                segment, offset = f.read().split()
+            return int(segment), int(offset)
+        except (IOError, ValueError):
+            return (min(self.sizes) if self.sizes else 0), 0
+
+    def save_cursor(self):
+        # Replace the cursor file atomically, so a crash never leaves it
+        # half written
+        path = os.path.join(self.path, CURSOR_FILE)
+        with open(path + '.tmp', 'w') as f:
+            f.write("%d %d" % self.cursor)
+        os.rename(path + '.tmp', path)
+
+    def segment_path(self, number):
+        return os.path.join(self.path, "%020d.seg" % number)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = None
+        self.writer_segment = None
@@ -5,9 +5,11 @@ This class provides means to requests for authentication
 
 tokens to be used with OpenStack's Ceilometer, Nova and RabbitMQ
 """
+from eszcp import http_client
 from eszcp import log
-import json
-import urllib2
+from eszcp import utils
+import multiprocessing
+import time
 from urllib2 import HTTPError
 from urllib2 import URLError
 
@@ -21,38 +23,118 @@ __date__ = "03/01/2016"
 __email__ = "jun.wang@easystack.cn"
 __version__ = "1.0.0"
 
+# Max length of a token shared between processes, UUID tokens are 32 bytes.
+# Longer tokens(e.g. PKI) are only cached in the process requesting them.
+SHARED_TOKEN_SIZE = 8192
+
 
 class Auth:
     def __init__(self, auth_host, public_port, admin_tenant,
-                 admin_user, admin_password):
+                 admin_user, admin_password, refresh_margin=300,
+                 http=None):
+        """
+        The token is cached in shared memory, so the processes forked after
+        the Auth is created share one token instead of re-authenticating.
 
+        :param auth_host: keystone host
+        :param public_port: keystone public port
+        :param admin_tenant: admin tenant name
+        :param admin_user: admin user name
+        :param admin_password: admin user password
+        :param refresh_margin: seconds before the expiry to refresh the token
+        :param http: the shared http_client.HTTPClient
+        """
         self.auth_host = auth_host
         self.public_port = public_port
         self.admin_tenant = admin_tenant
         self.admin_user = admin_user
         self.admin_password = admin_password
+        self.refresh_margin = int(refresh_margin)
+        self.http = http or http_client.HTTPClient()
+        self.lock = multiprocessing.Lock()
+        self.shared_token = multiprocessing.RawArray('c', SHARED_TOKEN_SIZE)
+        self.shared_expires_at = multiprocessing.RawValue('d', 0)
+        self.local_token = None
+        self.local_expires_at = 0
 
     def getToken(self):
         """
-        Requests and returns an authentication token to be used with
+        Returns the cached authentication token, requests a new one to be
+        used with OpenStack's Ceilometer, Nova and RabbitMQ when the cached
+        token is about to expire
 
-        OpenStack's Ceilometer, Nova and RabbitMQ
         :return: The Keystone token assigned to these credentials
         """
-        auth_request = urllib2.Request("http://" + self.auth_host + ":" +
-                                       self.public_port + "/v2.0/tokens")
-        auth_request.add_header('Content-Type',
-                                'application/json;charset=utf8')
-        auth_request.add_header('Accept', 'application/json')
+        with self.lock:
+            token, expires_at = self._cached_token()
+            if token and expires_at - self.refresh_margin > time.time():
+                return token
+            token, expires_at = self.request_token()
+            self._cache_token(token, expires_at)
+            return token
+
+    def invalidate(self, token):
+        """
+        Drop a token refused by a service from the cache
+
+        :param token: the refused token
+        """
+        with self.lock:
+            if self._cached_token()[0] == token:
+                self._cache_token(None, 0)
+
+    def with_token(self, func):
+        """
+        Call func with the cached token. If the token is refused(401),
+        request a new token and retry once
+
+        :param func: function accepting the token as its only argument
+        :return: the return value of func
+        """
+        token = self.getToken()
+        try:
+            return func(token)
+        except HTTPError, ex:
+            if ex.code != 401:
+                raise
+            LOG.warning("Token refused, request a new token and retry")
+            self.invalidate(token)
+            return func(self.getToken())
+
+    def _cached_token(self):
+        if self.local_token:
+            return self.local_token, self.local_expires_at
+        return self.shared_token.value, self.shared_expires_at.value
+
+    def _cache_token(self, token, expires_at):
+        if token and len(token) >= SHARED_TOKEN_SIZE:
+            self.local_token = token
+            self.local_expires_at = expires_at
+            return
+        self.local_token = None
+        self.local_expires_at = 0
+        self.shared_token.value = token or ''
+        self.shared_expires_at.value = expires_at
+
+    def request_token(self):
+        """
+        Requests an authentication token to Keystone
+
+        :return: a tuple of (token, expires_at), expires_at is a timestamp
+        """
         auth_data = {"auth": {"tenantName": self.admin_tenant,
                               "passwordCredentials":
                               {"username": self.admin_user,
                                "password": self.admin_password}}}
-        auth_request.add_data(json.dumps(auth_data))
         try:
-            auth_response = urllib2.urlopen(auth_request)
-            response_data = json.loads(auth_response.read())
-            token = response_data['access']['token']['id']
+            response_data = self.http.post_json(
+                "http://" + self.auth_host + ":" +
+                self.public_port + "/v2.0/tokens",
+                auth_data,
+                headers={'Content-Type': 'application/json;charset=utf8'})
+            token = str(response_data['access']['token']['id'])
+            expires_at = utils.parse_isotime(
+                response_data['access']['token']['expires'])
         except HTTPError, ex:
             if ex.code == 401:
                 LOG.error("Unauthorized,Please the username and password")
@@ -65,6 +147,8 @@ class Auth:
             LOG.error(msg)
             raise
         except Exception, ex:
-            LOG.error(msg)
+            LOG.error(str(ex))
             raise
-        return token
+        LOG.debug("Got a new token expiring at %s"
+                  % utils.isotime(expires_at))
+        return token, expires_at
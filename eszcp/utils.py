@@ -16,7 +16,10 @@
 
 """Utilities and helper functions."""
 
+import _strptime  # noqa, time.strptime imports it lazily, not thread safe
+import calendar
 import re
+import time
 
 
 __authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
@@ -27,6 +30,11 @@ __date__ = "03/01/2016"
 
 __version__ = "1.0.0"
 
+# Nic resource of libvirt, instance-{instance_name}-{instance_id}-{tap_id}
+NIC_PATTERN = re.compile(r"^instance-[0-9a-f]+-"
+                         r"([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-"
+                         r"[0-9a-f]{4}-[0-9a-f]{12})-tap")
+
 AVALIABLE_STATUS = [
     'SHUTOFF',
     'ACTIVE'
@@ -69,3 +77,55 @@ def endswith_words(source):
     else:
         return False
     return match
+
+
+def nic_instance_id(resource_id):
+    """
+    Get the instance uuid out of a nic resource id
+    example:
+        'instance-0000000a-aa0d0c92-31a8-44a2-9b3f-0b5d0e8a9fc1-tap8d7c'
+        =>>> return 'aa0d0c92-31a8-44a2-9b3f-0b5d0e8a9fc1'
+    :param resource_id: ceilometer resource id
+    """
+    match = NIC_PATTERN.search(resource_id or '')
+    return match.group(1) if match else None
+
+
+def isotime(timestamp):
+    """
+    Format a unix timestamp as the UTC ISO 8601 time used by ceilometer
+    example:
+        timestamp = 1456833600.5 =>>> return '2016-03-01T12:00:00.500000'
+    :param timestamp: seconds since the epoch
+    """
+    # Round to microseconds first, so a fraction rounding up to a whole
+    # second carries into the seconds
+    seconds, micros = divmod(int(round(timestamp * 1000000)), 1000000)
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + \
+        '.%06d' % micros
+
+
+def parse_isotime(timestr):
+    """
+    Parse a UTC ISO 8601 time of keystone or ceilometer
+    example:
+        timestr = '2016-03-01T12:00:00Z' =>>> return 1456833600.0
+        timestr = '2016-03-01T12:00:00.500000' =>>> return 1456833600.5
+    :param timestr: str
+    """
+    timestr = timestr.rstrip('Z')
+    seconds, _, fraction = timestr.partition('.')
+    timestamp = calendar.timegm(time.strptime(seconds, '%Y-%m-%dT%H:%M:%S'))
+    return timestamp + (float('0.' + fraction) if fraction else 0.0)
+
+
+def chunks(items, size):
+    """
+    Split a list into lists of at most size items
+    example:
+        items = [1, 2, 3, 4, 5], size = 2 =>>> return [[1, 2], [3, 4], [5]]
+    :param items: list
+    :param size: int
+    """
+    size = max(int(size), 1)
+    return [items[i:i + size] for i in range(0, len(items), size)]
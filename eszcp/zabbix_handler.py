@@ -7,9 +7,11 @@ Provides a class responsible for the communication with Zabbix,
 including access to several API methods
 """
 
+from eszcp import http_client
+from eszcp import id_directory
+from eszcp import limiter as backend_limiter
 from eszcp import log
 from eszcp import utils
-import json
 import urllib2
 
 LOG = log.logger(__name__)
@@ -26,7 +28,9 @@ __version__ = "1.0.0"
 class ZabbixHandler:
     def __init__(self, keystone_admin_port, compute_port, admin_user,
                  zabbix_admin_pass, zabbix_host, keystone_host,
-                 template_name, zabbix_proxy_name, keystone_auth):
+                 template_name, zabbix_proxy_name, keystone_auth,
+                 http=None, bulk_chunk_size=200, inventory=None,
+                 snapshot_max_age=86400, limiter=None):
 
         self.keystone_admin_port = keystone_admin_port
         self.compute_port = compute_port
@@ -37,18 +41,107 @@ class ZabbixHandler:
         self.template_name = template_name
         self.zabbix_proxy_name = zabbix_proxy_name
         self.keystone_auth = keystone_auth
-        self.token = keystone_auth.getToken()
+        self.http = http or http_client.HTTPClient()
+        # Max objects created by one array-valued API call
+        self.bulk_chunk_size = int(bulk_chunk_size)
+        # Directories of zabbix ids, host(nova instance uuid) <-> hostid
+        # and host group(tenant name) <-> groupid
+        self.hosts = id_directory.IdDirectory()
+        self.groups = id_directory.IdDirectory()
+        # The inventory.Inventory shared by the processes, the directories
+        # are reloaded from it when its version changes
+        self.inventory = inventory
+        self.inventory_version = None
+        # Max age(seconds) of a snapshot a warm restart trusts
+        self.snapshot_max_age = int(snapshot_max_age)
+        # Limits the rate and in-flight requests of the zabbix api
+        self.limiter = limiter or backend_limiter.AdaptiveLimiter('zabbix')
 
     def first_run(self):
 
         self.api_auth = self.get_zabbix_auth()
-        self.proxy_id = self.get_proxy_id()
-        self.template_id = self.get_template_id()
+        snapshot = None
+        if self.inventory is not None:
+            snapshot = self.inventory.load_snapshot('zabbix',
+                                                    self.snapshot_max_age)
+        if snapshot:
+            self.proxy_id = snapshot['proxy_id']
+            self.template_id = snapshot['template_id']
+        else:
+            self.proxy_id = self.get_proxy_id()
+            self.template_id = self.get_template_id()
         tenants = self.get_tenants()
         self.group_list = []
         self.group_list = self.host_group_list(tenants)
-        self.check_host_groups()
-        self.check_instances()
+        self.save_tenants()
+        if not (snapshot and self.warm_start()):
+            self.check_host_groups()
+            self.check_instances()
+            # Saved only after a full reconciliation, a warm start keeps
+            # the timestamp of the last one, so it's redone once the
+            # snapshot is older than snapshot_max_age
+            if self.inventory is not None:
+                self.inventory.save_snapshot(
+                    'zabbix', {"proxy_id": self.proxy_id,
+                               "template_id": self.template_id})
+        LOG.info("Backend %(name)s: concurrency limit %(limit)d of "
+                 "%(max_limit)d, rate limit %(rate)s/s, %(requests)d "
+                 "requests, %(overloads)d overloads"
+                 % self.limiter.stats())
+
+    def warm_start(self):
+        """
+        Reconcile only the differences between the inventory saved by the
+        last run and keystone/nova, instead of fetching all the host groups
+        and hosts from zabbix
+
+        :return: False if the inventory saved is inconsistent with zabbix
+        """
+        self.sync_inventory()
+        if not len(self.hosts):
+            return False
+        missing = sorted(set(item[0] for item in self.group_list
+                             if item[0] not in self.groups))
+        created = self.create_host_groups(missing)
+        if len(created) < len(missing):
+            LOG.warning("Failed to create host groups, "
+                        "reconcile all of them")
+            return False
+        servers = self.get_servers()
+        hosts = self.missing_hosts(servers)
+        host_ids = self.create_hosts(hosts)
+        if len(host_ids) < len(hosts):
+            LOG.warning("Failed to create hosts, reconcile all of them")
+            return False
+        gone = self.gone_hosts(servers)
+        host_ids_gone = [host_id for _, host_id in gone if host_id]
+        if len(self.delete_hosts(host_ids_gone)) < len(host_ids_gone):
+            LOG.warning("Failed to delete hosts, reconcile all of them")
+            return False
+        if host_ids or gone:
+            self.inventory_version = self.inventory.update_hosts(
+                created=[(instance_id, instance_name, host_ids[instance_id])
+                         for instance_name, instance_id, _ in hosts],
+                deleted=[instance_id for instance_id, _ in gone])
+        LOG.info("Warm start, created %d host groups and %d hosts, deleted "
+                 "%d hosts" % (len(created), len(host_ids), len(gone)))
+        return True
+
+    def gone_hosts(self, servers):
+        """
+        :param servers: the response of nova servers/detail
+        :return: list of (instance_id, hostid) of the hosts whose instances
+                 are gone from nova
+        """
+        if servers.get('servers_links'):
+            # Only a page of the instances, the others are not gone
+            LOG.warning("Nova returned a page of the instances only, skip "
+                        "deleting the hosts of the instances gone")
+            return []
+        instance_ids = set(item['id'] for item in servers[u'servers'])
+        return [(instance_id, host_id)
+                for instance_id, host_id in self.hosts.items()
+                if instance_id not in instance_ids]
 
     def get_zabbix_auth(self):
         """
@@ -188,34 +281,61 @@ class ZabbixHandler:
 
     def check_host_groups(self):
         """
-        This method checks if some host group exists
+        This method checks if the host groups of all tenants exist, all
+        the groups are fetched in one call, the missing ones are created
+        in bulk
 
         """
-        for item in self.group_list:
-            tenant_name = item[0]
-            payload = {
-                "jsonrpc": "2.0",
-                "method": "hostgroup.get",
-                "params": {
-                    "output": "extend",
-                    "filter": {"name": tenant_name}
-                },
-                "auth": self.api_auth,
-                "id": 1
-            }
+        payload = {
+            "jsonrpc": "2.0",
+            "method": "hostgroup.get",
+            "params": {
+                "output": ["groupid", "name"]
+            },
+            "auth": self.api_auth,
+            "id": 1
+        }
+        response = self.contact_zabbix_server(payload)
+        self.groups.clear()
+        self.groups.update(dict((group['name'], group['groupid'])
+                                for group in response.get('result', [])))
+        missing = sorted(set(item[0] for item in self.group_list
+                             if item[0] not in self.groups))
+        self.create_host_groups(missing)
+        if self.inventory is not None:
+            self.inventory_version = self.inventory.replace_groups(
+                dict(self.groups.items()))
+
+    def create_host_groups(self, names):
+        """
+        Method used to create host groups in bulk, with array valued
+        hostgroup.create calls of at most bulk_chunk_size groups
+
+        :param names: the tenant names
+        :return: returns a dict of tenant name and group id
+        """
+        group_ids = {}
+        for chunk in utils.chunks(names, self.bulk_chunk_size):
+            LOG.info("Creating %d hostgroups in Zabbix Server" % len(chunk))
+            payload = {"jsonrpc": "2.0",
+                       "method": "hostgroup.create",
+                       "params": [{"name": name} for name in chunk],
+                       "auth": self.api_auth,
+                       "id": 2}
             response = self.contact_zabbix_server(payload)
-            if not response.get('result', []):
-                payload = {"jsonrpc": "2.0",
-                           "method": "hostgroup.create",
-                           "params": {"name": tenant_name},
-                           "auth": self.api_auth,
-                           "id": 2}
-                self.contact_zabbix_server(payload)
+            group_ids.update(zip(chunk, response.get('result', {}).get(
+                'groupids', [])))
+        self.groups.update(group_ids)
+        if group_ids and self.inventory is not None and \
+                self.inventory_version is not None:
+            self.inventory_version = self.inventory.update_groups(group_ids)
+        return group_ids
 
-    def check_instances(self):
+    def get_servers(self):
         """
-        Method used to verify existence of an instance / host
+        Method used to get all the nova instances
 
+        :return: the response of nova servers/detail
         """
         servers = None
         tenant_id = None
@@ -224,18 +344,14 @@ class ZabbixHandler:
             if tenant_name == 'admin':
                 tenant_id = item[1]
 
-        auth_request = urllib2.Request(
-            "http://" + self.keystone_host + ":" +
-            self.compute_port + "/v2/" + tenant_id +
-            "/servers/detail?all_tenants=1")
-
-        auth_request.add_header('Content-Type',
-                                'application/json;charset=utf8')
-        auth_request.add_header('Accept', 'application/json')
-        auth_request.add_header('X-Auth-Token', self.token)
+        def _servers_detail(token):
+            return self.http.get_json(
+                "http://" + self.keystone_host + ":" +
+                self.compute_port + "/v2/" + tenant_id +
+                "/servers/detail?all_tenants=1",
+                token=token)
         try:
-            auth_response = urllib2.urlopen(auth_request)
-            servers = json.loads(auth_response.read())
+            servers = self.keystone_auth.with_token(_servers_detail)
 
         except urllib2.HTTPError, e:
             if e.code == 401:
@@ -256,36 +372,65 @@ class ZabbixHandler:
                 LOG.error("Unknown Error")
                 raise
         except Exception, ex:
-            msg = hasattr(ex, 'message', None) or \
-                  hasattr(ex, 'msg', '')
+            msg = getattr(ex, 'message', None) or \
+                  getattr(ex, 'msg', '')
             LOG.error(msg)
             raise
+        return servers
+
+    def check_instances(self):
+        """
+        Method used to verify existence of an instance / host
 
+        """
+        servers = self.get_servers()
+
+        # Look the hosts of the instances up by name, bound to this proxy
+        # or not, a host of another proxy can't be created again
+        self.hosts.clear()
+        names = {}
+        instance_ids = [item['id'] for item in servers[u'servers']]
+        for chunk in utils.chunks(instance_ids, self.bulk_chunk_size):
+            payload = {
+                "jsonrpc": "2.0",
+                "method": "host.get",
+                "params": {
+                    "output": ["hostid", "host", "name", "proxy_hostid"],
+                    "filter": {"host": chunk}
+                    },
+                "auth": self.api_auth,
+                "id": 1
+            }
+            response = self.contact_zabbix_server(payload)
+            for host in response.get('result', []):
+                if str(host.get('proxy_hostid')) != str(self.proxy_id):
+                    LOG.warning("Host %s is not monitored by proxy %s, "
+                                "its values are rejected by zabbix"
+                                % (host['host'], self.zabbix_proxy_name))
+                self.hosts.add(host['host'], host['hostid'])
+                names[host['host']] = host.get('name', host['host'])
+        hosts = self.missing_hosts(servers)
+        self.create_hosts(hosts)
+        if self.inventory is not None:
+            names.update((host[1], host[0]) for host in hosts)
+            _, known = self.inventory.host_ids()
+            self.inventory_version = self.inventory.update_hosts(
+                created=[(instance_id, names[instance_id], host_id)
+                         for instance_id, host_id in self.hosts.items()
+                         if instance_id in names],
+                deleted=[instance_id for instance_id in known
+                         if instance_id not in self.hosts])
+
+    def missing_hosts(self, servers):
+        """
+        :param servers: the response of nova servers/detail
+        :return: list of (instance_name, instance_id, tenant_name) of the
+                 useable instances missing in zabbix
+        """
+        tenant_names = dict((row[1], row[0]) for row in self.group_list)
+        hosts = []
         for item in servers[u'servers']:
-            if utils.isUseable_instance(item['status']):
-                payload = {
-                    "jsonrpc": "2.0",
-                    "method": "host.get",
-                    "params": {
-                        "output": "extend",
-                        "filter": {"host": item['id']}
-                        },
-                    "auth": self.api_auth,
-                    "id": 1
-                }
-                response = self.contact_zabbix_server(payload)
-
-                if not response.get('result', []):
-                    for row in self.group_list:
-                        if row[1] == item['tenant_id']:
-                            instance_name = item['name']
-                            instance_id = item['id']
-                            tenant_name = row[0]
-                            self.create_host(
-                                         instance_name,
-                                         instance_id,
-                                         tenant_name)
-            else:
+            if not utils.isUseable_instance(item['status']):
                 msg = "Drop to check or create instance ," \
                       "the status of %(instance_name)s(%(instance_id)s) " \
                       "is in %(status)s" \
@@ -293,6 +438,12 @@ class ZabbixHandler:
                          "instance_id": item['id'],
                          "status": item['status']}
                 LOG.warning(msg)
+            elif item['id'] not in self.hosts and \
+                    item['tenant_id'] in tenant_names:
+                hosts.append((item['name'],
+                              item['id'],
+                              tenant_names[item['tenant_id']]))
+        return hosts
 
     def create_host(self, instance_name, instance_id, tenant_name):
 
@@ -302,64 +453,157 @@ class ZabbixHandler:
         :param instance_name: refers to the instance name
         :param instance_id:   refers to the instance id
         :param tenant_name:   refers to the tenant name
+        :return: returns the host id
         """
         group_id = self.find_group_id(tenant_name)
-
-        if not (instance_id in instance_name):
-            instance_name = instance_name + '-' + instance_id
-
         payload = {"jsonrpc": "2.0",
                    "method": "host.create",
-                   "params": {
-                       "host": instance_id,
-                       "name": instance_name,
-                       "proxy_hostid": self.proxy_id,
-                       "interfaces": [
-                           {
-                               "type": 1,
-                               "main": 1,
-                               "useip": 1,
-                               "ip": "127.0.0.1",
-                               "dns": "",
-                               "port": "10050"}
-                       ],
-                       "groups": [
-                           {
-                               "groupid": group_id
-                           }
-                       ],
-                       "templates": [
-                           {
-                               "templateid": self.template_id
-                           }
-                       ],
-
-                   },
+                   "params": self.host_params(instance_name,
+                                              instance_id,
+                                              group_id),
                    "auth": self.api_auth,
                    "id": 1}
-        self.contact_zabbix_server(payload)
+        response = self.contact_zabbix_server(payload)
+        host_ids = response.get('result', {}).get('hostids') or [None]
+        self.hosts.add(instance_id, host_ids[0])
+        return host_ids[0]
+
+    def create_hosts(self, hosts):
+        """
+        Method used to create hosts in Zabbix server in bulk, with array
+        valued host.create calls of at most bulk_chunk_size hosts
+
+        :param hosts: list of (instance_name, instance_id, tenant_name)
+        :return: returns a dict of instance id and host id
+        """
+        self.sync_inventory()
+        rows = []
+        for instance_name, instance_id, tenant_name in hosts:
+            group_id = self.groups.get_id(tenant_name) or \
+                self.find_group_id(tenant_name)
+            if not group_id:
+                LOG.error("Skip creating host %s, can't found host group "
+                          "%s" % (instance_id, tenant_name))
+                continue
+            rows.append((instance_id, self.host_params(instance_name,
+                                                       instance_id,
+                                                       group_id)))
+        host_ids = {}
+        for chunk in utils.chunks(rows, self.bulk_chunk_size):
+            LOG.info("Creating %d hosts in Zabbix Server" % len(chunk))
+            payload = {"jsonrpc": "2.0",
+                       "method": "host.create",
+                       "params": [params for _, params in chunk],
+                       "auth": self.api_auth,
+                       "id": 1}
+            response = self.contact_zabbix_server(payload)
+            if 'error' in response:
+                # Zabbix rolls back the whole call, e.g. one of the hosts
+                # exists already, so create the hosts one by one
+                LOG.warning("Failed to create %d hosts in bulk: %s, create "
+                            "them one by one"
+                            % (len(chunk), response['error']))
+                for instance_id, params in chunk:
+                    host_id = self.create_host_params(instance_id, params)
+                    if host_id:
+                        host_ids[instance_id] = host_id
+                continue
+            host_ids.update(zip([instance_id for instance_id, _ in chunk],
+                                response['result']['hostids']))
+        self.hosts.update(host_ids)
+        return host_ids
+
+    def create_host_params(self, instance_id, params):
+        """
+        Create a single host, falling back to the host of the same name if
+        it exists already
+
+        :param instance_id: refers to the instance id
+        :param params: the params of host.create
+        :return: returns the host id, None if failed
+        """
+        payload = {"jsonrpc": "2.0",
+                   "method": "host.create",
+                   "params": params,
+                   "auth": self.api_auth,
+                   "id": 1}
+        response = self.contact_zabbix_server(payload)
+        if 'error' not in response:
+            return response['result']['hostids'][0]
+        host_id = self.find_host_id(instance_id)
+        if host_id:
+            LOG.warning("Host %s exists already, hostid: %s"
+                        % (instance_id, host_id))
+        else:
+            LOG.error("Failed to create host %s: %s"
+                      % (instance_id, response['error']))
+        return host_id
+
+    def host_params(self, instance_name, instance_id, group_id):
+        """
+        Method used to define the parameters of a host
+
+        :param instance_name: refers to the instance name
+        :param instance_id:   refers to the instance id
+        :param group_id:   refers to the host group id
+        :return: returns the params of host.create
+        """
+        if not (instance_id in instance_name):
+            instance_name = instance_name + '-' + instance_id
+
+        return {"host": instance_id,
+                "name": instance_name,
+                "proxy_hostid": self.proxy_id,
+                "interfaces": [
+                    {
+                        "type": 1,
+                        "main": 1,
+                        "useip": 1,
+                        "ip": "127.0.0.1",
+                        "dns": "",
+                        "port": "10050"}
+                ],
+                "groups": [
+                    {
+                        "groupid": group_id
+                    }
+                ],
+                "templates": [
+                    {
+                        "templateid": self.template_id
+                    }
+                ],
+                }
 
     def find_group_id(self, tenant_name):
         """
-        Method used to find the the group id of an host in Zabbix server
+        Method used to find the the group id of an host in Zabbix server,
+        looked up in the local directory first, then in Zabbix on a miss
 
         :param tenant_name: refers to the tenant name
         :return: returns the group id that belongs to the host_group or tenant
         """
-        group_id = None
+        self.sync_inventory()
+        group_id = self.groups.get_id(tenant_name)
+        if group_id:
+            return group_id
         payload = {"jsonrpc": "2.0",
                    "method": "hostgroup.get",
                    "params": {
-                       "output": "extend"
+                       "output": ["groupid", "name"],
+                       "filter": {"name": [tenant_name]}
                    },
                    "auth": self.api_auth,
                    "id": 2
                    }
         response = self.contact_zabbix_server(payload)
-        group_list = response['result']
-        for line in group_list:
+        for line in response.get('result', []):
             if line['name'] == tenant_name:
                 group_id = line['groupid']
+                self.groups.add(tenant_name, group_id)
+                if self.inventory is not None:
+                    self.inventory_version = self.inventory.update_groups(
+                        {tenant_name: group_id})
         return group_id
 
     def get_template_id(self):
@@ -422,25 +666,30 @@ class ZabbixHandler:
 
     def find_host_id(self, host):
         """
-        Method used to find a host Id in Zabbix server
+        Method used to find a host Id in Zabbix server, looked up in the
+        local directory first, then in Zabbix on a miss
 
-        :param host:
+        :param host: refers to the host name, i.e. nova instance uuid
         :return: returns the host id
         """
-        host_id = None
+        self.sync_inventory()
+        host_id = self.hosts.get_id(host)
+        if host_id:
+            return host_id
         payload = {"jsonrpc": "2.0",
                    "method": "host.get",
                    "params": {
-                       "output": "extend"
+                       "output": ["hostid", "host"],
+                       "filter": {"host": [host]}
                    },
                    "auth": self.api_auth,
                    "id": 2
                    }
         response = self.contact_zabbix_server(payload)
-        hosts_list = response['result']
-        for line in hosts_list:
+        for line in response.get('result', []):
             if host == line['host']:
                 host_id = line['hostid']
+                self.hosts.add(host, host_id)
         return host_id
 
     def delete_host(self, host_id):
@@ -458,6 +707,33 @@ class ZabbixHandler:
                    "id": 1
                    }
         self.contact_zabbix_server(payload)
+        self.hosts.remove_id(host_id)
+
+    def delete_hosts(self, host_ids):
+        """
+        Method used to delete Hosts in Zabbix Server in bulk, with array
+        valued host.delete calls of at most bulk_chunk_size hosts
+
+        :param host_ids: refers to the host ids to delete
+        :return: returns the host ids deleted
+        """
+        deleted = []
+        for chunk in utils.chunks(host_ids, self.bulk_chunk_size):
+            LOG.info("Deleting %d hosts in Zabbix Server" % len(chunk))
+            payload = {"jsonrpc": "2.0",
+                       "method": "host.delete",
+                       "params": chunk,
+                       "auth": self.api_auth,
+                       "id": 1
+                       }
+            response = self.contact_zabbix_server(payload)
+            if 'error' in response:
+                LOG.error("Failed to delete hosts: %s" % response['error'])
+                continue
+            for host_id in chunk:
+                self.hosts.remove_id(host_id)
+            deleted.extend(chunk)
+        return deleted
 
     def get_tenants(self):
         """
@@ -466,17 +742,15 @@ class ZabbixHandler:
         :return: list of tenants
         """
         tenants = None
-        auth_request = urllib2.Request('http://' + self.keystone_host + ':' +
-                                       self.keystone_admin_port +
-                                       '/v2.0/tenants')
-        auth_request.add_header('Content-Type',
-                                'application/json;charset=utf8')
-        auth_request.add_header('Accept', 'application/json')
-        auth_request.add_header('X-Auth-Token', self.token)
+
+        def _tenants(token):
+            return self.http.get_json('http://' + self.keystone_host +
+                                      ':' + self.keystone_admin_port +
+                                      '/v2.0/tenants',
+                                      token=token)
 
         try:
-            auth_response = urllib2.urlopen(auth_request)
-            tenants = json.loads(auth_response.read())
+            tenants = self.keystone_auth.with_token(_tenants)
         except urllib2.HTTPError, e:
             if e.code == 401:
                 msg = "Error... \nToken refused! " \
@@ -494,8 +768,8 @@ class ZabbixHandler:
                 LOG.error("Unknown Error")
                 raise
         except Exception, ex:
-            msg = hasattr(ex, 'message', None) or \
-                  hasattr(ex, 'msg', '')
+            msg = getattr(ex, 'message', None) or \
+                  getattr(ex, 'msg', '')
             LOG.error(msg)
             raise
         return tenants
@@ -542,6 +816,17 @@ class ZabbixHandler:
                 group_id = self.find_group_id(tenant_name)
                 self.delete_host_group(group_id)
                 self.group_list.remove(item)
+        self.save_tenants()
+
+    def save_tenants(self):
+        """
+        Save the tenants of group_list in the shared inventory, the poller
+        matches the polling policies against their names
+        """
+        if self.inventory is not None:
+            self.inventory.replace_tenants(dict((tenant_id, tenant_name)
+                                                for tenant_name, tenant_id
+                                                in self.group_list))
 
     def delete_host_group(self, group_id):
         """
@@ -555,6 +840,10 @@ class ZabbixHandler:
                    "id": 1
                    }
         self.contact_zabbix_server(payload)
+        tenant_name = self.groups.remove_id(group_id)
+        if self.inventory is not None and tenant_name is not None:
+            self.inventory_version = self.inventory.remove_groups(
+                [tenant_name])
 
     def create_host_group(self, tenant_name):
         """
@@ -567,7 +856,29 @@ class ZabbixHandler:
                    "params": {"name": tenant_name},
                    "auth": self.api_auth,
                    "id": 2}
-        self.contact_zabbix_server(payload)
+        response = self.contact_zabbix_server(payload)
+        group_ids = response.get('result', {}).get('groupids') or [None]
+        self.groups.add(tenant_name, group_ids[0])
+        if self.inventory is not None and group_ids[0] is not None:
+            self.inventory_version = self.inventory.update_groups(
+                {tenant_name: group_ids[0]})
+        return group_ids[0]
+
+    def sync_inventory(self):
+        """
+        Reload the directories from the shared inventory if it changed since
+        they were loaded
+        """
+        if self.inventory is None or \
+                self.inventory.version() == self.inventory_version:
+            return
+        version, host_ids = self.inventory.host_ids()
+        _, group_ids = self.inventory.groups()
+        self.hosts.clear()
+        self.hosts.update(host_ids)
+        self.groups.clear()
+        self.groups.update(group_ids)
+        self.inventory_version = version
 
     def contact_zabbix_server(self, payload):
         """
@@ -576,12 +887,7 @@ class ZabbixHandler:
         :param payload: refers to the json message to send to Zabbix
         :return: returns the response from the Zabbix API
         """
-        data = json.dumps(payload)
-        req = urllib2.Request('http://' + self.zabbix_host +
-                              '/zabbix/api_jsonrpc.php',
-                              data,
-                              {'Content-Type': 'application/json'})
-        f = urllib2.urlopen(req)
-        response = json.loads(f.read())
-        f.close()
-        return response
+        with self.limiter.slot():
+            return self.http.post_json('http://' + self.zabbix_host +
+                                       '/zabbix/api_jsonrpc.php',
+                                       payload)
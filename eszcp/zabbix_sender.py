@@ -0,0 +1,350 @@
+"""
+Class for sending history data to the Zabbix trapper
+
+Values collected from Ceilometer are buffered and shipped to Zabbix as
+
+multi-host, multi-item "history data" requests using the ZBXD protocol
+"""
+
+from eszcp import circuit
+from eszcp import log
+import json
+import re
+import socket
+import struct
+import time
+
+LOG = log.logger(__name__)
+
+__authors__ = "Claudio Marques, David Palma, Luis Cordeiro, Branty"
+__copyright__ = "Copyright (c) 2014 OneSource Consultoria Informatica, Lda"
+__license__ = "Apache 2"
+__contact__ = ["www.onesource.pt", "www.openstack.cn"]
+__date__ = "03/01/2016"
+__email__ = "jun.wang@easystack.cn"
+__version__ = "1.0.0"
+
+ZBX_HEADER = 'ZBXD\1'
+
+"""
+ The Zabbix server answers a "history data" request with an info string
+ like the following:
+ "processed: 9; failed: 2; total: 11; seconds spent: 0.000180"
+"""
+INFO_PATTERN = re.compile(r'processed:\s*(\d+);\s*failed:\s*(\d+);'
+                          r'\s*total:\s*(\d+)')
+
+
+class DeliveryUnknown(socket.timeout):
+    """
+    A request was sent but its response timed out, Zabbix may have stored
+    the values or not
+    """
+
+
+def set_proxy_header(data):
+    """
+    Frame a json message with the ZBXD header
+
+    :param data: refers to the json message, normally is a dict
+    :return: the message ready to send to Zabbix server
+    """
+    body = json.dumps(data)
+    return ZBX_HEADER + struct.pack('<Q', len(body)) + body
+
+
+def parse_info(response):
+    """
+    Parse the "processed/failed/total" counters of a Zabbix reply
+
+    :param response: the json response of Zabbix server
+    :return: a tuple of (processed, failed, total), or None if the
+             response does not carry the counters
+    """
+    info = response.get('info') if isinstance(response, dict) else None
+    if not info:
+        return None
+    match = INFO_PATTERN.search(info)
+    if not match:
+        return None
+    return tuple(int(count) for count in match.groups())
+
+
+class ZabbixSender(object):
+
+    def __init__(self, zabbix_host, zabbix_port, zabbix_proxy_name,
+                 batch_size=250, flush_interval=5000, max_retries=3,
+                 timeout=10, breaker=None, spool=None,
+                 replay_batch_size=1000, replay_rate=2000):
+        """
+        :param zabbix_host: zabbix host
+        :param zabbix_port: zabbix trapper port
+        :param zabbix_proxy_name: zabbix proxy name
+        :param batch_size: max values shipped in one "history data" request,
+                           the buffer is flushed once it holds so many values
+        :param flush_interval: max age(milliseconds) of a buffered value
+        :param max_retries: times to resend the values which failed
+        :param timeout: max seconds to connect to zabbix, and to read the
+                        whole response of a request
+        :param breaker: the circuit.CircuitBreaker of the zabbix trapper
+        :param spool: the spool.Spool keeping the values zabbix failed to
+                      receive, None means they are dropped
+        :param replay_batch_size: max spooled values replayed in one
+                                  "history data" request
+        :param replay_rate: max spooled values replayed per second, 0 means
+                            unlimited
+        """
+        self.zabbix_host = zabbix_host
+        self.zabbix_port = int(zabbix_port)
+        self.zabbix_proxy_name = zabbix_proxy_name
+        self.batch_size = int(batch_size)
+        self.flush_interval = int(flush_interval)
+        self.max_retries = int(max_retries)
+        self.timeout = float(timeout)
+        self.breaker = breaker or circuit.CircuitBreaker(
+            'zabbix-trapper', is_failure=circuit.is_connection_error)
+        self.buffer = []
+        self.buffered_at = None
+        self.spool = spool
+        self.replay_batch_size = int(replay_batch_size)
+        self.replay_rate = float(replay_rate)
+        self.replay_allowance = 0.0
+        self.replayed_at = time.time()
+        # Consecutive replays zabbix answered but failed to process
+        self.replay_failures = 0
+        # Whether zabbix answered the last request
+        self.answered = False
+        # Values dropped since the start, neither received nor spooled
+        self.dropped = 0
+        # Values sent whose response timed out, neither resent nor spooled
+        self.unknown = 0
+
+    def add(self, host, key, value, clock=None):
+        """
+        Buffer a value, flushing the buffer when it is full or too old
+
+        :param host: zabbix host name, normally is nova instance uuid
+        :param key: zabbix item key
+        :param value: the actual measurement
+        :param clock: timestamp of the measurement, default is now
+        """
+        if not self.buffer:
+            self.buffered_at = time.time()
+        self.buffer.append({"host": host,
+                            "key": key,
+                            "value": value,
+                            "clock": int(clock or time.time())})
+        elapsed = (time.time() - self.buffered_at) * 1000
+        if len(self.buffer) >= self.batch_size or \
+                elapsed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Ship all the buffered values to Zabbix, the values failed finally
+        are spooled if there is a spool
+
+        :return: the values which Zabbix failed to process finally
+        """
+        values, self.buffer = self.buffer, []
+        self.buffered_at = None
+        pending = [values[i:i + self.batch_size]
+                   for i in range(0, len(values), self.batch_size)]
+        attempt = 0
+        while pending and attempt <= self.max_retries:
+            failed_chunks = []
+            for i, chunk in enumerate(pending):
+                try:
+                    if not self.send(chunk):
+                        failed_chunks.append(chunk)
+                except circuit.CircuitOpen, ex:
+                    # Zabbix is known to be down, don't wait for timeouts
+                    LOG.warning("Skip sending values to Zabbix: %s" % ex)
+                    failed_chunks.extend(pending[i:])
+                    attempt = self.max_retries
+                    break
+            pending = failed_chunks
+            attempt += 1
+        dropped = [value for chunk in pending for value in chunk]
+        if dropped and self.spool is not None:
+            try:
+                self.spool.append(dropped)
+                LOG.warning("Spool %d values failed after %d retries"
+                            % (len(dropped), self.max_retries))
+                return dropped
+            except (IOError, OSError), ex:
+                LOG.error("Failed to spool values: %s" % ex)
+        if dropped:
+            self.dropped += len(dropped)
+            LOG.error("Drop %d values after %d retries"
+                      % (len(dropped), self.max_retries))
+        return dropped
+
+    def replay(self, deadline=None):
+        """
+        Replay the spooled values in requests of replay_batch_size values,
+        at most replay_rate values per second on average. Stops at the
+        first failure, the values not replayed are kept for the next call.
+
+        :param deadline: timestamp to stop replaying at, None means no
+                         deadline
+        :return: the number of values replayed
+        """
+        if self.spool is None:
+            return 0
+        now = time.time()
+        if self.replay_rate > 0:
+            self.replay_allowance = min(
+                self.replay_allowance +
+                (now - self.replayed_at) * self.replay_rate,
+                max(self.replay_rate, self.replay_batch_size))
+        self.replayed_at = now
+        replayed = 0
+        while self.replay_rate <= 0 or self.replay_allowance >= 1:
+            if deadline is not None and time.time() >= deadline:
+                break
+            limit = self.replay_batch_size
+            if self.replay_rate > 0:
+                limit = min(limit, int(self.replay_allowance))
+            cursor, values = self.spool.read(limit)
+            if not values:
+                break
+            try:
+                sent = self.send(values)
+            except circuit.CircuitOpen:
+                break
+            if not sent:
+                if not self.answered:
+                    break
+                # Zabbix is up but keeps failing these values, e.g. their
+                # hosts are gone, don't let them block the spool
+                self.replay_failures += 1
+                if self.replay_failures <= self.max_retries:
+                    break
+                LOG.error("Drop %d spooled values Zabbix failed to process"
+                          % len(values))
+            self.replay_failures = 0
+            self.spool.commit(cursor)
+            replayed += len(values)
+            self.replay_allowance -= len(values)
+        if replayed:
+            LOG.info("Replayed %d spooled values, %d bytes left"
+                     % (replayed, len(self.spool)))
+        return replayed
+
+    def send(self, values):
+        """
+        Send a chunk of values in one "history data" request
+
+        Zabbix doesn't tell which values of a chunk failed, so a chunk is
+        reported as failed only when the request itself failed or none of
+        its values was processed. A partially processed chunk is never
+        resent, otherwise the processed values would be stored twice, nor
+        is a chunk whose response timed out once it was sent.
+
+        :param values: list of {"host", "key", "value", "clock"} dict
+        :return: False if the chunk should be retried
+        :raise circuit.CircuitOpen: when zabbix failed repeatedly
+        """
+        data = {"request": "history data",
+                "host": self.zabbix_proxy_name,
+                "data": values,
+                "clock": int(time.time())}
+        self.answered = False
+        try:
+            with self.breaker.guard():
+                response = self.request(data)
+            self.answered = True
+        except DeliveryUnknown, ex:
+            self.unknown += len(values)
+            LOG.warning("%d values possibly delivered, not resent, Zabbix "
+                        "didn't answer in time: %s" % (len(values), ex))
+            return True
+        except (socket.error, ValueError), ex:
+            LOG.error("Failed to send %d values to Zabbix: %s"
+                      % (len(values), ex))
+            return False
+        counters = parse_info(response)
+        if counters is None:
+            LOG.error("Got unexpected response from Zabbix: %s" % response)
+            return False
+        processed, failed, total = counters
+        if failed and not processed:
+            LOG.warning("Zabbix failed to process all of %d values" % total)
+            return False
+        if failed:
+            LOG.warning("Zabbix processed %d values, failed %d of %d"
+                        % (processed, failed, total))
+        return True
+
+    def request(self, data):
+        """
+        Send a request to Zabbix and read its response
+
+        :param data: refers to the json message, normally is a dict
+        :return: the json response of Zabbix server
+        """
+        return self.connect(set_proxy_header(data))
+
+    def connect(self, payload):
+        """
+        Method used to send information to Zabbix
+        :param payload: a message framed with the ZBXD header
+        :rtype : returns the response received by the Zabbix server
+        """
+        return json.loads(self.connect_raw(payload))
+
+    def connect_raw(self, payload):
+        """
+        :param payload: a message framed with the ZBXD header
+        :rtype : returns the raw json response of the Zabbix server
+        """
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # A hung zabbix server must not block the caller forever
+        s.settimeout(self.timeout)
+        try:
+            s.connect((self.zabbix_host, self.zabbix_port))
+            s.sendall(payload)
+            deadline = time.time() + self.timeout
+            try:
+                # read its response, the first five bytes are the header
+                # again
+                response_header = self._recv(s, 5, deadline)
+                if not response_header == ZBX_HEADER:
+                    raise ValueError('Got invalid response')
+
+                # read the data header to get the length of the response
+                response_len = struct.unpack('<Q',
+                                             self._recv(s, 8, deadline))[0]
+
+                # read the whole rest of the response now that we know the
+                # length
+                response_raw = self._recv(s, response_len, deadline)
+            except socket.timeout, ex:
+                raise DeliveryUnknown(str(ex))
+        finally:
+            s.close()
+        LOG.debug(response_raw)
+        return response_raw
+
+    def _recv(self, s, length, deadline=None):
+        """
+        :param s: the socket connected to zabbix
+        :param length: bytes to read
+        :param deadline: timestamp the whole response must be read before,
+                         so a server trickling bytes can't stall the reader
+        """
+        chunks = []
+        while length > 0:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout('Timed out reading the response '
+                                         'of Zabbix server')
+                s.settimeout(remaining)
+            chunk = s.recv(length)
+            if not chunk:
+                raise ValueError('Connection closed by Zabbix server')
+            chunks.append(chunk)
+            length -= len(chunk)
+        return ''.join(chunks)
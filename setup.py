@@ -8,7 +8,9 @@ setup(
     author="Branty",
     author_email="jun.wang@easystack.cn",
     packages=['eszcp'],
-    scripts=['bin/eszcp-polling'],
+    scripts=['bin/eszcp-polling', 'bin/eszcp-backfill'],
+    # eszcp-backfill averages the raw samples with numpy when installed
+    extras_require={'backfill': ['numpy']},
     url="www.easystack.cn",
     description="A Timer task for polling ceilometer metrics into zabbix"
 )
@@ -0,0 +1,93 @@
+import mock
+import pytest
+
+from eszcp import amqp_consumer
+
+
+def delivery(tag, redelivered=False):
+    return mock.Mock(delivery_tag=tag, redelivered=redelivered)
+
+
+def consumer(holding=None, callback=None, **kwargs):
+    amqp = amqp_consumer.Consumer('rabbit', 'guest', 'guest', 5672,
+                                  durable=True, **kwargs)
+    amqp.subscribe('nova', 'zcp-nova', ['compute.#'],
+                   callback or mock.Mock(), holding=holding)
+    amqp.connection = mock.Mock()
+    subscription = amqp.subscriptions['zcp-nova']
+    subscription["channel"] = mock.Mock()
+    return amqp, subscription
+
+
+def test_messages_acked_in_batches():
+    amqp, subscription = consumer(ack_batch_size=3)
+    channel = subscription["channel"]
+    for tag in (1, 2):
+        amqp.on_message(subscription, channel, delivery(tag), None, '{}')
+    assert not channel.basic_ack.called
+    amqp.on_message(subscription, channel, delivery(3), None, '{}')
+    channel.basic_ack.assert_called_once_with(delivery_tag=3, multiple=True)
+    assert subscription["unacked"] == 0
+
+
+def test_ack_timer_acks_a_partial_batch():
+    amqp, subscription = consumer(ack_batch_size=50, ack_interval=1)
+    channel = subscription["channel"]
+    amqp.on_message(subscription, channel, delivery(1), None, '{}')
+    deadline, on_ack_timer = amqp.connection.add_timeout.call_args[0]
+    assert deadline == 1
+    on_ack_timer()
+    channel.basic_ack.assert_called_once_with(delivery_tag=1, multiple=True)
+
+
+def test_ack_held_while_side_effects_pending():
+    pending = [True]
+    amqp, subscription = consumer(holding=lambda: pending[0],
+                                  ack_batch_size=1)
+    channel = subscription["channel"]
+    amqp.on_message(subscription, channel, delivery(1), None, '{}')
+    amqp.ack('zcp-nova')
+    assert not channel.basic_ack.called
+    pending[0] = False
+    amqp.ack('zcp-nova')
+    channel.basic_ack.assert_called_once_with(delivery_tag=1, multiple=True)
+
+
+def test_message_failed_twice_is_rejected():
+    amqp, subscription = consumer(callback=mock.Mock(
+        side_effect=ValueError('bad message')))
+    channel = subscription["channel"]
+    with pytest.raises(ValueError):
+        amqp.on_message(subscription, channel, delivery(1), None, '{}')
+    amqp.on_message(subscription, channel, delivery(2, redelivered=True),
+                    None, '{}')
+    channel.basic_reject.assert_called_once_with(delivery_tag=2,
+                                                 requeue=False)
+    assert subscription["last_tag"] is None
+
+
+def test_queues_share_one_connection_with_a_channel_each():
+    amqp = amqp_consumer.Consumer('rabbit', 'guest', 'guest', 5672)
+    hooks = []
+    nova, keystone = mock.Mock(), mock.Mock()
+    amqp.subscribe('nova', 'zcp-nova', ['compute.#'], nova,
+                   on_connect=lambda: hooks.append('nova'))
+    amqp.subscribe('keystone', 'zcp-keystone', ['identity.#'], keystone,
+                   on_connect=lambda: hooks.append('keystone'))
+    with mock.patch('pika.BlockingConnection') as connect:
+        connection = connect.return_value
+        connection.channel.side_effect = lambda: mock.Mock()
+        amqp.connect()
+    assert connect.call_count == 1
+    assert connection.channel.call_count == 2
+    assert sorted(hooks) == ['keystone', 'nova']
+    channels = {}
+    for queue, subscription in amqp.subscriptions.items():
+        channel = subscription["channel"]
+        channel.queue_declare.assert_called_once_with(queue=queue,
+                                                      exclusive=True)
+        channels[queue] = channel
+    # Every queue delivers to its own callback
+    on_message = channels['zcp-keystone'].basic_consume.call_args[0][0]
+    on_message(channels['zcp-keystone'], delivery(1), None, '{}')
+    assert keystone.called and not nova.called
@@ -0,0 +1,130 @@
+import random
+import socket
+
+import mock
+import pytest
+
+from eszcp import backfill
+from eszcp import inventory
+from eszcp import policy
+from eszcp import utils
+from eszcp import zabbix_sender
+
+
+def test_rollup_numpy_and_pure_python_agree():
+    pytest.importorskip('numpy')
+    rand = random.Random(42)
+    timestamps = [1000 + rand.uniform(-100, 3600) for _ in range(500)]
+    volumes = [rand.uniform(0, 100) for _ in timestamps]
+    vectorized = backfill.rollup(timestamps, volumes, 1000, 300)
+    with mock.patch.object(backfill, 'numpy', None):
+        pure = backfill.rollup(timestamps, volumes, 1000, 300)
+    assert [start for start, _ in vectorized] == \
+        [start for start, _ in pure]
+    assert [average for _, average in vectorized] == \
+        pytest.approx([average for _, average in pure])
+    assert pure[0][0] == 1000
+
+
+def test_rollup_skips_samples_before_start():
+    with mock.patch.object(backfill, 'numpy', None):
+        assert backfill.rollup([900, 1000, 1100, 1700], [5, 1, 3, 4],
+                               1000, 300) == [(1000, 2.0), (1600, 4.0)]
+        assert backfill.rollup([], [], 1000, 300) == []
+
+
+def ceilometer(instances=None, samples=None):
+    """
+    :param samples: list of {"timestamp", "counter_volume", "message_id"}
+                    served newest first by ceilometer_get
+    """
+    handler = mock.Mock()
+    handler.zabbix_sender = zabbix_sender.ZabbixSender('zabbix', 10051,
+                                                       'ZCP01')
+    handler.inventory = inventory.Inventory()
+    handler.policies = policy.PolicySet(default_interval=300)
+    handler.tenant_names = {}
+    handler.active_instances.return_value = instances or []
+    handler.send_data_zabbix.side_effect = \
+        lambda volume, instance_id, metric, clock: \
+        handler.zabbix_sender.add(instance_id, metric, volume, clock)
+    handler.samples_path.side_effect = lambda metric, queries, limit: \
+        (queries, limit)
+
+    def get(path):
+        queries, limit = path
+        matched = samples
+        for field, op, value in queries:
+            if field != 'timestamp':
+                continue
+            compare = {'ge': lambda a, b: a >= b, 'lt': lambda a, b: a < b,
+                       'le': lambda a, b: a <= b}[op]
+            matched = [sample for sample in matched
+                       if compare(utils.parse_isotime(sample['timestamp']),
+                                  utils.parse_isotime(value))]
+        matched = sorted(matched, key=lambda sample: sample['timestamp'],
+                         reverse=True)
+        return matched[:limit]
+    handler.ceilometer_get.side_effect = get
+    return handler
+
+
+def test_samples_pages_through_shared_timestamps():
+    samples = [{"timestamp": utils.isotime(1000 + i // 3),
+                "counter_volume": float(i), "message_id": 'm%d' % i}
+               for i in range(10)]
+    job = backfill.Backfill(ceilometer(samples=samples), 1000, 2000,
+                            page_size=4)
+    timestamps, volumes = job.samples('vm-1', 'cpu_util', 1000, 2000)
+    assert sorted(volumes) == [float(i) for i in range(10)]
+    assert sorted(timestamps) == [1000 + i // 3 for i in range(10)]
+
+
+def test_samples_terminates_on_pages_of_one_timestamp():
+    samples = [{"timestamp": utils.isotime(1000 + i // 3),
+                "counter_volume": float(i), "message_id": 'm%d' % i}
+               for i in range(9)]
+    job = backfill.Backfill(ceilometer(samples=samples), 1000, 2000,
+                            page_size=2)
+    timestamps, _ = job.samples('vm-1', 'cpu_util', 1000, 2000)
+    # Two samples of every timestamp, the third one is skipped
+    assert sorted(timestamps) == [1000, 1000, 1001, 1001, 1002, 1002]
+
+
+def test_checkpoint_not_advanced_past_values_dropped():
+    handler = ceilometer()
+    sender = handler.zabbix_sender
+    sender.batch_size = 1
+    sender.max_retries = 0
+    job = backfill.Backfill(handler, 0, 600, batch_size=1)
+    with mock.patch.object(sender, 'request',
+                           side_effect=socket.error('refused')):
+        # Dropped by an automatic flush, before the checkpoint flush
+        sender.add('vm-1', 'cpu_util', '1.0', 300)
+    job.done[('vm-1', 'cpu_util')] = 300
+    with pytest.raises(RuntimeError):
+        job.save_checkpoint()
+    assert handler.inventory.load_snapshot(job.name) is None
+
+
+def test_backfill_resumes_from_checkpoint():
+    instances = [{"id": 'vm-1', "tenant_id": 't'}]
+    handler = ceilometer(instances)
+    job = backfill.Backfill(handler, 0, 1200, metrics=['cpu_util'],
+                            window=300)
+    job.done[('vm-1', 'cpu_util')] = 600
+    job.save_checkpoint()
+
+    resumed = backfill.Backfill(handler, 0, 1200, metrics=['cpu_util'],
+                                window=300)
+    with mock.patch.object(resumed, 'rollup_task',
+                           side_effect=lambda task: (task, [(task[3], 1.0)])
+                           ) as rollup_task, \
+            mock.patch.object(handler.zabbix_sender, 'request',
+                              return_value={"info": "processed: 2; "
+                                                    "failed: 0; total: 2"}):
+        assert resumed.run() == 2
+    assert [call[0][0][2] for call in rollup_task.call_args_list] == \
+        [600, 900]
+    assert handler.inventory.load_snapshot(resumed.name)["done"] == \
+        [['vm-1', 'cpu_util', 1200]]
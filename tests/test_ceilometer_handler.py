@@ -0,0 +1,289 @@
+import json
+import threading
+import time
+
+import mock
+
+from eszcp import ceilometer_handler
+from eszcp import inventory
+from eszcp import utils
+
+
+def handler(tmpdir, **kwargs):
+    return ceilometer_handler.CeilometerHandler(
+        8777, 300, 'Template', 'ceilometer', 'zabbix', 10051, 'ZCP01',
+        'nova', 8774, 'admin', mock.Mock(),
+        inventory=inventory.Inventory(str(tmpdir.join('inventory.db'))),
+        **kwargs)
+
+
+def test_polling_window_closes_ingest_lag_before_now(tmpdir):
+    poller = handler(tmpdir, ingest_lag=60)
+    with mock.patch('time.time', return_value=10000.0):
+        end = poller.window_end()
+    assert end == 9940.0
+    assert poller.polling_window('tenant', 'cpu_util', end) == [
+        ('timestamp', 'ge', utils.isotime(9640.0)),
+        ('timestamp', 'lt', utils.isotime(9940.0))]
+
+
+def test_next_window_starts_at_the_end_of_the_last_one(tmpdir):
+    poller = handler(tmpdir, ingest_lag=60)
+    with mock.patch('time.time', return_value=10000.0), \
+            mock.patch.object(poller, 'ceilometer_get',
+                              return_value=[{"avg": 1.0}]):
+        poller._grouped_statistics(('cpu_util', 'tenant'))
+    assert poller.high_water[('tenant', 'cpu_util')] == 9940.0
+    # A sample stored late, stamped 9950, is in the next window
+    window = poller.polling_window('tenant', 'cpu_util', 10040.0, 300)
+    assert window[0] == ('timestamp', 'ge', utils.isotime(9940.0))
+
+
+def test_eviction_prunes_high_water_of_instance_and_nics(tmpdir):
+    poller = handler(tmpdir)
+    cache = ceilometer_handler.METRIC_CACEHES
+    cache.update_resources('vm-1', {'instance-vm-1-tap0': []})
+    poller.high_water[('vm-1', 'cpu_util')] = 1.0
+    poller.high_water[('instance-vm-1-tap0',
+                       'network.incoming.bytes.rate')] = 1.0
+    poller.high_water[('vm-2', 'cpu_util')] = 1.0
+    cache.retain(['vm-2'])
+    assert poller.high_water == {('vm-2', 'cpu_util'): 1.0}
+
+
+def test_resource_eviction_keeps_high_water_of_instance(tmpdir):
+    poller = handler(tmpdir, resource_miss_threshold=1)
+    cache = ceilometer_handler.METRIC_CACEHES
+    cache.update_resources('vm-1', {'instance-vm-1-tap0': []})
+    poller.high_water[('vm-1', 'cpu_util')] = 1.0
+    poller.high_water[('instance-vm-1-tap0',
+                       'network.incoming.bytes.rate')] = 1.0
+    cache.update_resources('vm-1', {})
+    assert poller.high_water == {('vm-1', 'cpu_util'): 1.0}
+    cache.evict('vm-1')
+
+
+def test_hosts_created_in_a_refresh_tick_are_scheduled(tmpdir):
+    poller = handler(tmpdir, first_poll_delay=60)
+    poller.created_hosts = set(['vm-1'])
+    instance = {"id": 'vm-1', "status": 'ACTIVE', "tenant_id": 't'}
+    with mock.patch.object(poller, 'sync_inventory'), \
+            mock.patch.object(poller, 'refresh_instances') as refresh, \
+            mock.patch.object(poller, 'instance_detail',
+                              return_value=instance), \
+            mock.patch.object(poller.zabbix_sender, 'flush'), \
+            mock.patch.object(poller.zabbix_sender, 'replay'), \
+            mock.patch('time.time', return_value=10000.0):
+        poller.run()
+    assert refresh.called
+    assert poller.created_hosts == set()
+    assert [key[0] for key in poller.scheduler.due] == ['vm-1']
+    assert poller.scheduler.next_due() == 10060.0
+
+
+def test_map_keeps_the_order_of_the_items(tmpdir):
+    poller = handler(tmpdir, polling_workers=4)
+    threads = set()
+
+    def square(item):
+        threads.add(threading.current_thread().name)
+        time.sleep(0.01 * (5 - item))
+        return item * item
+    assert list(poller.map(square, range(5))) == [0, 1, 4, 9, 16]
+    assert threading.current_thread().name not in threads
+    poller.close()
+
+
+def test_a_failed_instance_does_not_stop_the_others(tmpdir):
+    poller = handler(tmpdir, polling_workers=2)
+    poller.instances = {'vm-1': {"id": 'vm-1'}, 'vm-2': {"id": 'vm-2'}}
+
+    def poll_instance(instance, metrics, interval):
+        if instance['id'] == 'vm-1':
+            raise IOError('refused')
+        return [('vm-2', 'cpu_util', 1.0)]
+    with mock.patch.object(poller, 'poll_instance',
+                           side_effect=poll_instance), \
+            mock.patch.object(poller, 'send_data_zabbix') as send:
+        keys = [(instance_id, poller.policies.default.name)
+                for instance_id in ['vm-1', 'vm-2']]
+        assert poller.poll_due(keys) == []
+    send.assert_called_once_with(1.0, 'vm-2', 'cpu_util')
+    poller.close()
+
+
+def test_grouped_statistics_are_split_per_instance(tmpdir):
+    poller = handler(tmpdir, polling_mode='groupby')
+    vm = 'aa0d0c92-31a8-44a2-9b3f-0b5d0e8a9fc1'
+    nics = ['instance-0000000a-%s-tap%d' % (vm, i) for i in range(2)]
+    statistics = {
+        'cpu_util': [{"groupby": {"resource_id": vm}, "avg": 10.0},
+                     {"groupby": {"resource_id": 'gone'}, "avg": 1.0}],
+        'network.incoming.bytes.rate': [
+            {"groupby": {"resource_id": nic}, "avg": 2.0} for nic in nics]}
+
+    def ceilometer_get(path):
+        for metric, groups in statistics.items():
+            if '/v2/meters/%s/' % metric in path:
+                assert 'groupby=resource_id' in path
+                return groups
+        return []
+    tasks = [('cpu_util', None), ('network.incoming.bytes.rate', None)]
+    with mock.patch.object(poller, 'ceilometer_get',
+                           side_effect=ceilometer_get):
+        values = poller.polling_grouped_metrics([{"id": vm}], tasks=tasks)
+    # The nics of an instance are summed, unknown resources dropped
+    assert sorted(values) == [(vm, 'cpu_util', 10.0),
+                              (vm, 'network.incoming.bytes.rate', 4.0)]
+
+
+def test_grouped_tasks_per_tenant(tmpdir):
+    poller = handler(tmpdir, polling_mode='groupby',
+                     groupby_per_tenant=True)
+    tasks = poller.grouped_tasks([{"id": 'a', "tenant_id": 't2'},
+                                  {"id": 'b', "tenant_id": 't1'},
+                                  {"id": 'c', "tenant_id": 't1'}])
+    assert ('cpu_util', 't1') in tasks and ('cpu_util', 't2') in tasks
+    assert len(tasks) == 2 * len(ceilometer_handler.NETWORK_METRICS +
+                                 ceilometer_handler.INSTANCE_METRICS)
+
+
+def test_proxy_config_is_joined_by_hostid_and_skipped_if_unchanged(tmpdir):
+    poller = handler(tmpdir)
+    config = {
+        "hosts": {"fields": ['hostid', 'host', 'name'],
+                  "data": [['1', 'vm-1', 'one'], ['2', 'vm-2', 'two']]},
+        "items": {"fields": ['itemid', 'hostid', 'key_'],
+                  "data": [['11', '2', 'cpu_util'], ['12', '1', 'disk'],
+                           ['13', '2', 'memory']]}}
+    with mock.patch.object(poller.zabbix_sender, 'connect_raw',
+                           return_value=json.dumps(config)):
+        hosts = poller.get_hosts_ID()
+        assert hosts == {
+            'vm-1': {"hostid": '1', "host": 'vm-1', "name": 'one',
+                     "items": ['disk']},
+            'vm-2': {"hostid": '2', "host": 'vm-2', "name": 'two',
+                     "items": ['cpu_util', 'memory']}}
+        poller.host_list = hosts
+        with mock.patch('json.loads') as loads:
+            assert poller.get_hosts_ID() is hosts
+        assert not loads.called
+
+
+def test_hosts_changed_are_applied_as_deltas(tmpdir):
+    poller = handler(tmpdir)
+    cache = ceilometer_handler.METRIC_CACEHES
+    poller.hosts_changed(created=[('vm-1', 'one', '1'), ('vm-2', 'two', '2')])
+    poller.sync_inventory()
+    assert sorted(poller.host_list) == ['vm-1', 'vm-2']
+    cache.update_resources('vm-1', {'vm-1': []})
+    poller.instances = {'vm-1': {"id": 'vm-1'}}
+    version = poller.inventory_version
+
+    poller.hosts_changed(created=[('vm-3', 'three', '3')], deleted=['vm-1'])
+    poller.sync_inventory()
+    assert poller.inventory_version > version
+    assert sorted(poller.host_list) == ['vm-2', 'vm-3']
+    assert poller.host_list['vm-3']['hostid'] == '3'
+    assert poller.created_hosts == set(['vm-3'])
+    assert 'vm-1' not in cache
+    assert poller.instances == {}
+
+    # Nothing is reloaded while the inventory is unchanged
+    with mock.patch.object(poller.inventory, 'hosts') as hosts:
+        poller.sync_inventory()
+    assert not hosts.called
+
+
+def test_eviction_hook_is_registered_once_per_handler(tmpdir):
+    cache = ceilometer_handler.METRIC_CACEHES
+    listeners = len(cache.listeners)
+    poller = handler(tmpdir)
+    assert len(cache.listeners) == listeners + 1
+    poller.__init__(8777, 300, 'Template', 'ceilometer', 'zabbix', 10051,
+                    'ZCP01', 'nova', 8774, 'admin', mock.Mock())
+    assert len(cache.listeners) == listeners + 1
+    poller.close()
+    assert len(cache.listeners) == listeners
+
+
+def test_topology_change_forces_rediscovery(tmpdir):
+    poller = handler(tmpdir, resource_discovery_ttl=3600)
+    cache = ceilometer_handler.METRIC_CACEHES
+    poller.hosts_changed(created=[('vm-1', 'one', '1')])
+    poller.sync_inventory()
+    cache.update_resources('vm-1', {'vm-1': []})
+    cache.update_resources('vm-2', {'vm-2': []})
+    assert not cache.expired('vm-1', 3600)
+    poller.topology_changed('vm-1')
+    # vm-2 is created in zabbix after its nic was attached
+    poller.topology_changed('vm-2')
+    poller.hosts_changed(created=[('vm-2', 'two', '2')])
+    poller.sync_inventory()
+    assert cache.expired('vm-1', 3600)
+    assert cache.expired('vm-2', 3600)
+    cache.evict('vm-1')
+    cache.evict('vm-2')
+    poller.close()
+
+
+def test_idle_wait_wakes_up_for_hosts_created(tmpdir):
+    poller = handler(tmpdir, first_poll_delay=5, scheduler_tick=1)
+    poller.sync_inventory()
+    clock = [10000.0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+        if clock[0] == 10003.0:
+            poller.host_created('vm-1', 'one', '1')
+    with mock.patch('time.time', side_effect=lambda: clock[0]), \
+            mock.patch('time.sleep', side_effect=sleep) as sleeps:
+        assert poller.scheduler.next_due() is None
+        poller.wait()
+    # Not the whole polling interval
+    assert clock[0] == 10003.0
+    assert max(call[0][0] for call in sleeps.call_args_list) == 1
+    instance = {"id": 'vm-1', "status": 'ACTIVE', "tenant_id": 't'}
+    with mock.patch.object(poller, 'refresh_instances'), \
+            mock.patch.object(poller, 'instance_detail',
+                              return_value=instance), \
+            mock.patch.object(poller.zabbix_sender, 'flush'), \
+            mock.patch.object(poller.zabbix_sender, 'replay'), \
+            mock.patch('time.time', return_value=clock[0]):
+        poller.run()
+    assert poller.scheduler.next_due() == 10003.0 + 5
+    poller.close()
+
+
+def test_keys_left_at_the_cycle_deadline_are_deferred(tmpdir):
+    poller = handler(tmpdir, cycle_budget=10)
+    instances = [{"id": 'vm-%d' % i, "status": 'ACTIVE', "tenant_id": 't'}
+                 for i in range(3)]
+    poller.instances = dict((instance['id'], instance)
+                            for instance in instances)
+    poller.instances_refreshed_at = 10000.0
+    poller.scheduler.add(poller.polling_keys(instances), 9990.0)
+    clock = [10000.0]
+    polled = []
+
+    def poll_instance(instance, metrics, interval):
+        polled.append(instance['id'])
+        # The first poll takes the whole budget of the tick
+        clock[0] += 10
+        return []
+    with mock.patch.object(poller, 'poll_instance',
+                           side_effect=poll_instance), \
+            mock.patch.object(poller.zabbix_sender, 'flush'), \
+            mock.patch.object(poller.zabbix_sender, 'replay') as replay, \
+            mock.patch('time.time', side_effect=lambda: clock[0]):
+        poller.run()
+    assert len(polled) == 1
+    replay.assert_called_once_with(10010.0)
+    assert poller.cycle_deadline is None
+    # The others are polled first by the next tick, at their due time
+    assert poller.scheduler.deferred == 2
+    due = sorted((due, key[0]) for key, due in poller.scheduler.due.items())
+    assert due[:2] == [(9990.0, instance_id)
+                       for instance_id in sorted(set(poller.instances) -
+                                                 set(polled))]
+    assert due[2] == (10290.0, polled[0])
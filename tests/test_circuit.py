@@ -0,0 +1,82 @@
+import socket
+import urllib2
+
+import mock
+import pytest
+
+from eszcp import circuit
+
+
+def fail(breaker, ex=None):
+    with pytest.raises(Exception):
+        with breaker.guard():
+            raise ex or socket.error('refused')
+
+
+def test_opens_after_consecutive_failures():
+    breaker = circuit.CircuitBreaker('nova', failure_threshold=2)
+    fail(breaker)
+    with breaker.guard():
+        pass
+    fail(breaker)
+    assert breaker.state == circuit.CLOSED
+    fail(breaker)
+    assert breaker.state == circuit.OPEN
+    with pytest.raises(circuit.CircuitOpen):
+        with breaker.guard():
+            pass
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_half_open_probe_closes_on_success():
+    breaker = circuit.CircuitBreaker('nova', failure_threshold=1,
+                                     reset_timeout=30)
+    with mock.patch('time.time', return_value=1000.0):
+        fail(breaker)
+    with mock.patch('time.time', return_value=1030.0):
+        with breaker.guard():
+            assert breaker.state == circuit.HALF_OPEN
+            # A single probe passes
+            with pytest.raises(circuit.CircuitOpen):
+                breaker.acquire()
+    assert breaker.state == circuit.CLOSED
+    assert breaker.failures == 0
+
+
+def test_failed_probe_doubles_the_timeout():
+    breaker = circuit.CircuitBreaker('nova', failure_threshold=1,
+                                     reset_timeout=30,
+                                     max_reset_timeout=100)
+    with mock.patch('time.time', return_value=1000.0):
+        fail(breaker)
+    with mock.patch('time.time', return_value=1030.0):
+        fail(breaker)
+    assert breaker.state == circuit.OPEN
+    assert breaker.retry_at == 1090.0
+    with mock.patch('time.time', return_value=1090.0):
+        fail(breaker)
+    # Capped by max_reset_timeout
+    assert breaker.retry_at == 1190.0
+    assert breaker.opened == 3
+
+
+def test_other_errors_release_the_probe():
+    breaker = circuit.CircuitBreaker('ceilometer:cpu_util',
+                                     failure_threshold=1,
+                                     is_failure=circuit.is_not_found)
+    fail(breaker, urllib2.HTTPError('url', 404, '', {}, None))
+    assert breaker.state == circuit.OPEN
+    breaker.retry_at = 0
+    fail(breaker, urllib2.HTTPError('url', 401, '', {}, None))
+    assert breaker.state == circuit.HALF_OPEN
+    assert not breaker.probing
+    with breaker.guard():
+        pass
+    assert breaker.state == circuit.CLOSED
+
+
+def test_breakers_created_once_and_report_open_ones():
+    breakers = circuit.CircuitBreakers(failure_threshold=1)
+    assert breakers.get('nova') is breakers.get('nova')
+    fail(breakers.get('zabbix'))
+    assert [stats["name"] for stats in breakers.stats()] == ['zabbix']
@@ -0,0 +1,73 @@
+import httplib
+import urllib2
+
+import mock
+import pytest
+
+from eszcp import http_client
+
+
+def response(body='{}'):
+    resp = mock.Mock(status=200, will_close=False)
+    resp.read.return_value = body
+    resp.getheader.return_value = ''
+    return resp
+
+
+def stale_connection():
+    # An idle connection the server closed, detected only once the
+    # request was written
+    conn = mock.Mock()
+    conn.getresponse.side_effect = httplib.BadStatusLine("''")
+    return conn
+
+
+def client_with(idle, fresh):
+    client = http_client.HTTPClient()
+    client.pools[('http', 'api', 80)] = [idle]
+    return client, mock.patch.object(client, '_connect', return_value=fresh)
+
+
+@pytest.fixture(autouse=True)
+def alive():
+    with mock.patch.object(http_client.HTTPClient, '_dropped',
+                           return_value=False):
+        yield
+
+
+def test_idempotent_request_is_retried_over_new_connection():
+    fresh = mock.Mock()
+    fresh.getresponse.return_value = response('{"ok": 1}')
+    client, connect = client_with(stale_connection(), fresh)
+    with connect:
+        assert client.get_json('http://api:80/v2') == {"ok": 1}
+    assert fresh.request.called
+
+
+def test_post_written_is_never_retried():
+    fresh = mock.Mock()
+    client, connect = client_with(stale_connection(), fresh)
+    with connect:
+        with pytest.raises(urllib2.URLError):
+            client.post_json('http://api:80/api_jsonrpc.php', {})
+    assert not fresh.request.called
+
+
+def test_post_not_written_is_retried():
+    idle = mock.Mock()
+    idle.request.side_effect = httplib.CannotSendRequest()
+    fresh = mock.Mock()
+    fresh.getresponse.return_value = response()
+    client, connect = client_with(idle, fresh)
+    with connect:
+        assert client.post_json('http://api:80/api_jsonrpc.php', {}) == {}
+    assert fresh.request.called
+
+
+def test_acquire_skips_dropped_connections():
+    dropped, fresh = mock.Mock(), mock.Mock()
+    client, connect = client_with(dropped, fresh)
+    with connect, mock.patch.object(client, '_dropped',
+                                    return_value=True):
+        assert client._acquire(('http', 'api', 80)) == (fresh, False)
+    assert dropped.close.called
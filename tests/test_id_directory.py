@@ -0,0 +1,30 @@
+from eszcp import id_directory
+
+
+def test_names_and_ids_are_indexed_both_ways():
+    directory = id_directory.IdDirectory({'demo': '1'})
+    directory.add('admin', '2')
+    assert directory.get_id('admin') == '2'
+    assert directory.get_name('1') == 'demo'
+    assert 'demo' in directory and len(directory) == 2
+    assert directory.get_id('gone') is None
+
+
+def test_add_replaces_the_old_id_and_name():
+    directory = id_directory.IdDirectory({'demo': '1', 'admin': '2'})
+    # demo is re-created with a new id, and id 2 reused for it
+    directory.add('demo', '2')
+    assert directory.get_id('demo') == '2'
+    assert directory.get_name('1') is None
+    assert 'admin' not in directory
+    assert sorted(directory.items()) == [('demo', '2')]
+
+
+def test_remove_by_name_or_id():
+    directory = id_directory.IdDirectory({'demo': '1', 'admin': '2'})
+    assert directory.remove_name('demo') == '1'
+    assert directory.get_name('1') is None
+    assert directory.remove_id('2') == 'admin'
+    assert directory.get_id('admin') is None
+    assert directory.remove_id('3') is None
+    assert len(directory) == 0
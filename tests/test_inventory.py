@@ -0,0 +1,50 @@
+from eszcp import inventory
+
+
+def test_every_update_bumps_the_version():
+    store = inventory.Inventory()
+    assert store.version() == 0
+    version = store.update_hosts(created=[('vm-1', 'a', '1')])
+    assert version == 1
+    assert store.update_groups({'demo': '30'}) == 2
+    assert store.host_ids() == (2, {'vm-1': '1'})
+    assert store.groups() == (2, {'demo': '30'})
+
+
+def test_update_hosts_keeps_known_items():
+    store = inventory.Inventory()
+    store.replace_hosts({'vm-1': {"hostid": '1', "name": 'a',
+                                  "items": [{"key": 'cpu_util'}]}})
+    store.update_hosts(created=[('vm-1', 'b', '1')],
+                       deleted=['vm-2'])
+    _, hosts = store.hosts()
+    assert hosts['vm-1']['name'] == 'b'
+    assert hosts['vm-1']['items'] == [{"key": 'cpu_util'}]
+
+
+def test_invalidate_marks_the_version():
+    store = inventory.Inventory()
+    store.update_hosts(created=[('vm-1', 'a', '1')])
+    version = store.invalidate(['vm-1'])
+    assert store.hosts()[1]['vm-1']['invalidated'] == version
+
+
+def test_invalidation_before_insert_is_picked_up():
+    store = inventory.Inventory()
+    store.invalidate(['vm-1'])
+    version = store.update_hosts(created=[('vm-1', 'a', '1')])
+    assert store.hosts()[1]['vm-1']['invalidated'] == version
+    # Consumed by the insert
+    store.update_hosts(deleted=['vm-1'])
+    store.update_hosts(created=[('vm-1', 'a', '1')])
+    assert store.hosts()[1]['vm-1']['invalidated'] == 0
+
+
+def test_snapshot_expires(tmpdir):
+    store = inventory.Inventory(str(tmpdir.join('inventory.db')))
+    store.save_snapshot('poller', {"high_water": []})
+    assert store.load_snapshot('poller') == {"high_water": []}
+    assert store.load_snapshot('poller', max_age=-1) is None
+    assert store.load_snapshot('zabbix') is None
+    # Snapshots don't bump the version
+    assert store.version() == 0
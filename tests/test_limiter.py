@@ -0,0 +1,94 @@
+import socket
+import urllib2
+
+import mock
+import pytest
+
+from eszcp import limiter
+
+
+class Clock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    fake = Clock()
+    with mock.patch('time.time', fake.time), \
+            mock.patch('time.sleep', fake.sleep):
+        yield fake
+
+
+def test_is_overload():
+    assert limiter.is_overload(urllib2.HTTPError('url', 503, '', {}, None))
+    assert not limiter.is_overload(urllib2.HTTPError('url', 404, '', {},
+                                                     None))
+    assert limiter.is_overload(socket.timeout())
+    assert not limiter.is_overload(ValueError())
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(clock):
+    bucket = limiter.TokenBucket(rate=10, burst=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.1)
+    clock.sleep(1)
+    # Refilled up to the burst only
+    assert bucket.tokens <= 2
+    assert [bucket.acquire() for _ in range(2)] == [0, 0]
+
+
+def test_unlimited_token_bucket_never_waits(clock):
+    bucket = limiter.TokenBucket(rate=0)
+    assert all(bucket.acquire() == 0 for _ in range(100))
+    assert clock.now == 1000.0
+
+
+def test_limit_grows_additively(clock):
+    limit = limiter.AdaptiveLimiter('nova', max_limit=8)
+    limit.limit = 2.0
+    for _ in range(4):
+        limit.acquire()
+        limit.release(0.1)
+    assert 3.0 <= limit.limit < 4.0
+    for _ in range(100):
+        limit.acquire()
+        limit.release(0.1)
+    assert limit.limit == 8
+
+
+def test_limit_backs_off_once_per_latency_target(clock):
+    limit = limiter.AdaptiveLimiter('nova', max_limit=8, latency_target=2)
+    limit.acquire()
+    limit.release(5.0)
+    assert limit.limit == 4
+    # Requests in flight when it slowed down don't back off again
+    limit.acquire()
+    limit.release(0.1, overloaded=True)
+    assert limit.limit == 4
+    clock.sleep(2)
+    limit.acquire()
+    limit.release(0.1, overloaded=True)
+    assert limit.limit == 2
+    assert limit.stats()["overloads"] == 2
+
+
+def test_slot_tells_overloads(clock):
+    limit = limiter.AdaptiveLimiter('nova', max_limit=4, min_limit=2)
+    with pytest.raises(urllib2.HTTPError):
+        with limit.slot():
+            raise urllib2.HTTPError('url', 503, '', {}, None)
+    assert limit.limit == 2
+    assert limit.inflight == 0
+    with pytest.raises(KeyError):
+        with limit.slot():
+            raise KeyError('not an overload')
+    assert limit.limit == 2.5
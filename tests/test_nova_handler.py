@@ -0,0 +1,66 @@
+import json
+
+import mock
+
+from eszcp import nova_handler
+
+
+def events(**kwargs):
+    nova = nova_handler.NovaEvents('rabbit', 'guest', 'guest', 5672,
+                                   mock.Mock(), mock.Mock(),
+                                   consumer=mock.Mock(), **kwargs)
+    nova.consumer.add_timeout.return_value = 'timer'
+    return nova
+
+
+def test_flush_reports_only_hosts_applied():
+    nova = events()
+    nova.pending_creates = [('a', 'vm-1', 'demo'), ('b', 'vm-2', 'demo')]
+    nova.pending_deletes = ['vm-3', 'vm-4', 'vm-5']
+    nova.zabbix_handler.create_hosts.return_value = {'vm-1': '1'}
+    nova.zabbix_handler.find_host_id.side_effect = \
+        {'vm-3': '3', 'vm-4': '4', 'vm-5': None}.get
+    nova.zabbix_handler.delete_hosts.return_value = ['3']
+    nova.flush_events()
+    nova.ceilometer_handler.hosts_changed.assert_called_once_with(
+        [('vm-1', 'a', '1')], ['vm-3'])
+    # The failed events are retried, vm-5 doesn't exist in zabbix
+    assert nova.pending_creates == [('b', 'vm-2', 'demo')]
+    assert nova.pending_deletes == ['vm-4']
+    assert nova.flush_timer == 'timer'
+
+
+def test_failed_events_hold_back_the_ack():
+    nova = events()
+    nova.pending_creates = [('a', 'vm-1', 'demo')]
+    nova.zabbix_handler.create_hosts.side_effect = IOError('refused')
+
+    def ack(queue):
+        assert nova.has_pending_events()
+    nova.consumer.ack.side_effect = ack
+    nova.flush_events()
+    assert nova.consumer.ack.called
+    assert not nova.ceilometer_handler.hosts_changed.called
+
+
+def test_event_dropped_after_max_retries():
+    nova = events(max_retries=2)
+    nova.pending_deletes = ['vm-1']
+    nova.zabbix_handler.find_host_id.return_value = '1'
+    nova.zabbix_handler.delete_hosts.return_value = []
+    for _ in range(2):
+        nova.flush_events()
+        assert nova.pending_deletes == ['vm-1']
+    nova.flush_events()
+    assert nova.pending_deletes == []
+    assert nova.retries == {}
+
+
+def test_topology_event_invalidates_the_instance():
+    nova = events()
+    body = json.dumps({"_context_project_name": 'demo',
+                       "event_type": 'compute.instance.interface_attach.end',
+                       "payload": {"instance_id": 'vm-1'}})
+    nova.nova_callback(None, None, None, body)
+    nova.ceilometer_handler.topology_changed.assert_called_once_with('vm-1')
+    assert not nova.has_pending_events()
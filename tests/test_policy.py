@@ -0,0 +1,47 @@
+from eszcp import policy
+
+
+def policies():
+    return policy.PolicySet.from_sections([
+        ('DEFAULT', {'interval': '1'}),
+        ('policy:gold', {'interval': '60', 'tenants': 'gold-*',
+                         'priority': '1'}),
+        ('policy:disk', {'interval': '600', 'metrics': 'disk.*, volume.*'}),
+        ('policy:quiet', {'metrics': 'network.*', 'enabled': 'false'})],
+        default_interval=300)
+
+
+def test_sections_are_parsed_in_order():
+    rules = policies()
+    assert [rule.name for rule in rules.policies] == ['gold', 'disk',
+                                                      'quiet']
+    assert rules.policies[1].metrics == ['disk.*', 'volume.*']
+    assert rules.policies[2].interval == 300
+    assert not rules.policies[2].enabled
+    assert rules.default.interval == 300
+
+
+def test_first_matching_policy_applies():
+    rules = policies()
+    # gold matches every metric of its tenants, ahead of disk
+    assert rules.lookup('disk.read.bytes.rate', 't1', 'gold-a').name == \
+        'gold'
+    assert rules.lookup('disk.read.bytes.rate', 't2', 'demo').name == 'disk'
+    # A policy of some tenants doesn't apply to all the tenants at once
+    assert rules.lookup('cpu_util').name == policy.DEFAULT_POLICY
+
+
+def test_lookup_is_cached():
+    rules = policies()
+    first = rules.lookup('cpu_util', 't1', 'demo')
+    rules.policies.insert(0, policy.Policy('new', 10))
+    assert rules.lookup('cpu_util', 't1', 'demo') is first
+    assert rules.lookup('cpu_util', 't2', 'demo').name == 'new'
+
+
+def test_disabled_metrics_are_not_grouped():
+    rules = policies()
+    groups = rules.metric_groups(['cpu_util', 'disk.write.bytes.rate',
+                                  'network.incoming.bytes.rate'])
+    assert dict((rule.name, metrics) for rule, metrics in groups.items()) \
+        == {'default': ['cpu_util'], 'disk': ['disk.write.bytes.rate']}
@@ -0,0 +1,71 @@
+from eszcp import resource_cache
+
+
+def cache_with_listener(**kwargs):
+    cache = resource_cache.ResourceCache(**kwargs)
+    evicted = []
+    cache.add_listener(lambda instance_id, resource_ids:
+                       evicted.append((instance_id, sorted(resource_ids))))
+    return cache, evicted
+
+
+def test_least_recently_used_instance_is_evicted():
+    cache, evicted = cache_with_listener(max_size=2)
+    cache['a'] = {'nic-a': []}
+    cache['b'] = {'nic-b': []}
+    # Reading a makes b the least recently used
+    assert cache.get('a') == {'nic-a': []}
+    cache['c'] = {}
+    assert sorted(cache.keys()) == ['a', 'c']
+    assert evicted == [('b', ['nic-b'])]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_configure_shrinks_the_cache():
+    cache, evicted = cache_with_listener(max_size=3)
+    for instance_id in 'abc':
+        cache[instance_id] = {}
+    cache.configure(max_size=1)
+    assert cache.keys() == ['c']
+    assert [instance_id for instance_id, _ in evicted] == ['a', 'b']
+
+
+def test_resource_evicted_after_miss_threshold():
+    cache, evicted = cache_with_listener(miss_threshold=2)
+    cache.update_resources('a', {'nic-1': [], 'nic-2': []})
+    cache.update_resources('a', {'nic-1': []})
+    assert sorted(cache['a']) == ['nic-1', 'nic-2']
+    cache.update_resources('a', {'nic-1': []})
+    assert cache['a'] == {'nic-1': []}
+    assert evicted == [('a', ['nic-2'])]
+
+
+def test_retain_evicts_gone_instances():
+    cache, evicted = cache_with_listener()
+    cache.update_resources('a', {'nic-a': []})
+    cache.update_resources('b', {})
+    cache.retain(['b'])
+    assert 'a' not in cache and 'b' in cache
+    assert evicted == [('a', ['nic-a'])]
+    assert cache.expired('a', 3600)
+
+
+def test_snapshot_restore_skips_gone_instances():
+    cache, _ = cache_with_listener()
+    cache.update_resources('a', {'nic-a': []})
+    cache.update_resources('b', {})
+    restored = resource_cache.ResourceCache()
+    restored.restore(cache.snapshot(), instance_ids=['a'])
+    assert restored.keys() == ['a']
+    assert not restored.expired('a', 3600)
+
+
+def test_listener_is_registered_once_and_removed():
+    cache, evicted = cache_with_listener()
+    hook = evicted.append
+    cache.add_listener(hook)
+    cache.add_listener(evicted.append)
+    assert len(cache.listeners) == 2
+    cache.remove_listener(evicted.append)
+    cache.remove_listener(hook)
+    assert len(cache.listeners) == 1
@@ -0,0 +1,59 @@
+from eszcp import scheduler
+
+
+def test_keys_spread_across_the_interval():
+    sched = scheduler.DeadlineScheduler(300)
+    keys = ['vm-%d' % i for i in range(100)]
+    sched.sync(keys, now=0)
+    dues = sorted(sched.due.values())
+    assert all(0 <= due < 300 for due in dues)
+    assert dues[-1] - dues[0] > 200
+    assert sched.pop_due(now=-1) == []
+
+
+def test_pop_due_reschedules_and_skips_missed_slots():
+    sched = scheduler.DeadlineScheduler(100)
+    sched.add(['a'], due=10)
+    assert sched.pop_due(now=20) == [('a', 10)]
+    assert sched.due['a'] == 110
+    # Overdue by more than two intervals, polled once
+    assert sched.pop_due(now=350) == [('a', 240)]
+    assert sched.skipped == 2
+    assert sched.due['a'] == 410
+
+
+def test_pop_due_sheds_least_important_keys():
+    sched = scheduler.DeadlineScheduler(100)
+    sched.add({'low': (100, 9), 'high': (100, 0)}, due=10)
+    sched.add(['default'], due=5)
+    popped = sched.pop_due(now=20, limit=2)
+    assert [key for key, _ in popped] == ['default', 'high']
+    assert sched.pop_due(now=21) == [('low', 11)]
+
+
+def test_defer_puts_keys_back_at_their_due_time():
+    sched = scheduler.DeadlineScheduler(100)
+    sched.add(['a', 'b'], due=10)
+    popped = sched.pop_due(now=30)
+    sched.defer([key for key in popped if key[0] == 'b'], 30)
+    assert sched.deferred == 1
+    assert sched.due == {'a': 110, 'b': 10}
+    assert sched.pop_due(now=31) == [('b', 21)]
+
+
+def test_sync_forgets_gone_keys():
+    sched = scheduler.DeadlineScheduler(100)
+    sched.sync({'a': (100, 0), 'b': (50, 1)}, now=0)
+    sched.sync(['a'], now=0)
+    assert 'b' not in sched and 'b' not in sched.policies
+    assert len(sched) == 1
+
+
+def test_sync_reschedules_keys_whose_interval_changed():
+    sched = scheduler.DeadlineScheduler(3600)
+    sched.sync({'a': (3600, 0)}, now=0)
+    sched.schedule('a', 3000)
+    sched.sync({'a': (60, 0)}, now=0)
+    assert sched.due['a'] < 60
+    assert sched.pop_due(now=60)[0][0] == 'a'
+    assert sched.due['a'] < 120
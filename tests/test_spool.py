@@ -0,0 +1,68 @@
+import os
+
+from eszcp import spool
+
+
+def values(count, start=0):
+    return [{"host": "vm-%d" % i, "key": "cpu_util", "value": "1.0",
+             "clock": i} for i in range(start, start + count)]
+
+
+def segments(path):
+    return sorted(name for name in os.listdir(str(path))
+                  if name.endswith('.seg'))
+
+
+def test_segments_rotate_at_segment_size(tmpdir):
+    store = spool.Spool(str(tmpdir), segment_size=100)
+    for i in range(3):
+        store.append(values(1, i))
+    # A value takes 64 bytes, a segment is full after two of them
+    assert len(segments(tmpdir)) == 2
+    cursor, read = store.read(10)
+    assert read == values(3)
+
+
+def test_read_does_not_consume_until_commit(tmpdir):
+    store = spool.Spool(str(tmpdir), segment_size=100)
+    store.append(values(3))
+    cursor, read = store.read(2)
+    assert read == values(2)
+    assert store.read(2)[1] == values(2)
+    store.commit(cursor)
+    assert store.read(10)[1] == values(1, 2)
+
+
+def test_commit_deletes_segments_done_and_survives_restart(tmpdir):
+    store = spool.Spool(str(tmpdir), segment_size=100)
+    for i in range(4):
+        store.append(values(1, i))
+    cursor, _ = store.read(3)
+    store.commit(cursor)
+    assert len(segments(tmpdir)) == 1
+    store.close()
+    reopened = spool.Spool(str(tmpdir), segment_size=100)
+    assert reopened.read(10)[1] == values(1, 3)
+    assert len(reopened) == len(store)
+
+
+def test_torn_line_is_not_read(tmpdir):
+    store = spool.Spool(str(tmpdir))
+    store.append(values(1))
+    store.close()
+    with open(os.path.join(str(tmpdir), segments(tmpdir)[0]), 'ab') as f:
+        f.write('{"host": "vm-')
+    reopened = spool.Spool(str(tmpdir))
+    assert reopened.read(10)[1] == values(1)
+    # Appended to a new segment, not after the torn line
+    reopened.append(values(1, 1))
+    assert reopened.read(10)[1] == values(2)
+
+
+def test_oldest_segments_dropped_over_max_size(tmpdir):
+    store = spool.Spool(str(tmpdir), segment_size=100, max_size=200)
+    for i in range(4):
+        store.append(values(1, i))
+    assert store.dropped == 2
+    assert store.read(10)[1] == values(2, 2)
+    assert len(store) <= 200
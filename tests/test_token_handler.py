@@ -0,0 +1,68 @@
+import urllib2
+
+import mock
+import pytest
+
+from eszcp import token_handler
+from eszcp import utils
+
+
+def keystone(*tokens):
+    """
+    :param tokens: list of (token, expires_at) answered in turn
+    """
+    auth = token_handler.Auth('keystone', '5000', 'admin', 'admin', 'secret',
+                              refresh_margin=300, http=mock.Mock())
+    auth.http.post_json.side_effect = [
+        {"access": {"token": {"id": token,
+                              "expires": utils.isotime(expires_at)}}}
+        for token, expires_at in tokens]
+    return auth
+
+
+def refused():
+    return urllib2.HTTPError('url', 401, 'Unauthorized', {}, None)
+
+
+def test_token_cached_until_the_refresh_margin():
+    auth = keystone(('t1', 10000), ('t2', 20000))
+    with mock.patch('time.time', return_value=9000.0):
+        assert auth.getToken() == 't1'
+        assert auth.getToken() == 't1'
+    assert auth.http.post_json.call_count == 1
+    with mock.patch('time.time', return_value=9700.0):
+        assert auth.getToken() == 't2'
+
+
+def test_long_token_cached_in_the_process():
+    token = 'x' * token_handler.SHARED_TOKEN_SIZE
+    auth = keystone((token, 10000))
+    with mock.patch('time.time', return_value=9000.0):
+        assert auth.getToken() == token
+        assert auth.getToken() == token
+    assert auth.shared_token.value == ''
+
+
+def test_with_token_retries_once_on_401():
+    auth = keystone(('t1', 10000), ('t2', 10000))
+    func = mock.Mock(side_effect=[refused(), 'ok'])
+    with mock.patch('time.time', return_value=9000.0):
+        assert auth.with_token(func) == 'ok'
+    assert [call[0][0] for call in func.call_args_list] == ['t1', 't2']
+
+
+def test_with_token_gives_up_after_the_retry():
+    auth = keystone(('t1', 10000), ('t2', 10000))
+    func = mock.Mock(side_effect=[refused(), refused()])
+    with mock.patch('time.time', return_value=9000.0):
+        with pytest.raises(urllib2.HTTPError):
+            auth.with_token(func)
+    assert func.call_count == 2
+
+
+def test_invalidate_keeps_a_newer_token():
+    auth = keystone(('t1', 10000))
+    with mock.patch('time.time', return_value=9000.0):
+        auth.getToken()
+        auth.invalidate('t0')
+        assert auth.getToken() == 't1'
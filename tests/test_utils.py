@@ -0,0 +1,25 @@
+from eszcp import utils
+
+
+def test_isotime():
+    assert utils.isotime(1456833600.5) == '2016-03-01T12:00:00.500000'
+    assert utils.isotime(1456833600) == '2016-03-01T12:00:00.000000'
+
+
+def test_isotime_carries_rounded_fraction_into_seconds():
+    assert utils.isotime(1456833600.9999997) == '2016-03-01T12:00:01.000000'
+    assert utils.isotime(1456833659.9999999) == '2016-03-01T12:01:00.000000'
+
+
+def test_parse_isotime_round_trip():
+    assert utils.parse_isotime('2016-03-01T12:00:00Z') == 1456833600.0
+    assert utils.parse_isotime(utils.isotime(1456833600.25)) == 1456833600.25
+
+
+def test_nic_instance_id():
+    assert utils.nic_instance_id(
+        'instance-0000000a-aa0d0c92-31a8-44a2-9b3f-0b5d0e8a9fc1-tap8d7c') \
+        == 'aa0d0c92-31a8-44a2-9b3f-0b5d0e8a9fc1'
+    assert utils.nic_instance_id('aa0d0c92-31a8-44a2-9b3f-0b5d0e8a9fc1') \
+        is None
+    assert utils.nic_instance_id(None) is None
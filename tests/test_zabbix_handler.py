@@ -0,0 +1,128 @@
+import mock
+
+from eszcp import inventory
+from eszcp import zabbix_handler
+
+
+def handler(api, **kwargs):
+    """
+    :param api: function answering a zabbix api payload
+    """
+    zabbix = zabbix_handler.ZabbixHandler(
+        '35357', '8774', 'Admin', 'zabbix', 'zabbix', 'keystone',
+        'Template', 'ZCP01', mock.Mock(), **kwargs)
+    zabbix.api_auth = 'auth'
+    zabbix.proxy_id = '10'
+    zabbix.template_id = '20'
+    zabbix.group_list = [['demo', 'tenant-1']]
+    zabbix.groups.add('demo', '30')
+    zabbix.contact_zabbix_server = mock.Mock(side_effect=api)
+    return zabbix
+
+
+def calls(zabbix, method):
+    return [call[0][0]['params'] for call in
+            zabbix.contact_zabbix_server.call_args_list
+            if call[0][0]['method'] == method]
+
+
+def test_create_hosts_falls_back_to_one_by_one():
+    def api(payload):
+        params = payload['params']
+        if payload['method'] == 'host.get':
+            return {"result": [{"hostid": "2", "host": "vm-2"}]}
+        if isinstance(params, list):
+            return {"error": {"data": "Host vm-2 already exists"}}
+        if params['host'] == 'vm-2':
+            return {"error": {"data": "Host vm-2 already exists"}}
+        return {"result": {"hostids": ["1"]}}
+    zabbix = handler(api)
+    host_ids = zabbix.create_hosts([('a', 'vm-1', 'demo'),
+                                    ('b', 'vm-2', 'demo')])
+    assert host_ids == {'vm-1': '1', 'vm-2': '2'}
+    assert len(calls(zabbix, 'host.create')) == 3
+
+
+def test_create_hosts_skips_hosts_without_group():
+    def api(payload):
+        if payload['method'] == 'hostgroup.get':
+            return {"result": []}
+        return {"result": {"hostids": ["1"]}}
+    zabbix = handler(api)
+    host_ids = zabbix.create_hosts([('a', 'vm-1', 'demo'),
+                                    ('b', 'vm-2', 'gone')])
+    assert host_ids == {'vm-1': '1'}
+    created = calls(zabbix, 'host.create')
+    assert [host['host'] for host in created[0]] == ['vm-1']
+
+
+def test_check_instances_finds_hosts_of_other_proxies():
+    def api(payload):
+        if payload['method'] == 'host.get':
+            return {"result": [{"hostid": "2", "host": "vm-2",
+                                "name": "b-vm-2", "proxy_hostid": "11"}]}
+        return {"result": {"hostids": ["1"]}}
+    zabbix = handler(api)
+    zabbix.get_servers = mock.Mock(return_value={"servers": [
+        {"id": "vm-1", "name": "a", "status": "ACTIVE",
+         "tenant_id": "tenant-1"},
+        {"id": "vm-2", "name": "b", "status": "ACTIVE",
+         "tenant_id": "tenant-1"}]})
+    zabbix.check_instances()
+    assert calls(zabbix, 'host.get')[0]['filter'] == \
+        {"host": ["vm-1", "vm-2"]}
+    assert [host['host'] for host in calls(zabbix, 'host.create')[0]] == \
+        ['vm-1']
+    assert dict(zabbix.hosts.items()) == {'vm-1': '1', 'vm-2': '2'}
+
+
+def warm_handler(tmpdir, api):
+    store = inventory.Inventory(str(tmpdir.join('inventory.db')))
+    store.update_hosts(created=[('vm-1', 'a', '1'), ('vm-2', 'b', '2')])
+    store.update_groups({'demo': '30'})
+    store.save_snapshot('zabbix', {"proxy_id": '10', "template_id": '20'})
+    zabbix = handler(api, inventory=store)
+    zabbix.get_zabbix_auth = mock.Mock(return_value='auth')
+    zabbix.get_tenants = mock.Mock(return_value={"tenants": [
+        {"name": 'demo', "id": 'tenant-1'}]})
+    zabbix.get_servers = mock.Mock(return_value={"servers": [
+        {"id": "vm-1", "name": "a", "status": "ACTIVE",
+         "tenant_id": "tenant-1"}]})
+    return zabbix, store
+
+
+def test_warm_start_deletes_hosts_of_gone_instances(tmpdir):
+    zabbix, store = warm_handler(
+        tmpdir, lambda payload: {"result": {"hostids": payload['params']}})
+    zabbix.first_run()
+    assert calls(zabbix, 'host.delete') == [['2']]
+    assert store.host_ids()[1] == {'vm-1': '1'}
+    assert not calls(zabbix, 'host.get')
+
+
+def test_warm_start_keeps_the_snapshot_timestamp(tmpdir):
+    zabbix, store = warm_handler(
+        tmpdir, lambda payload: {"result": {"hostids": payload['params']}})
+    saved_at = store.query("SELECT saved_at FROM snapshots")
+    zabbix.first_run()
+    assert store.query("SELECT saved_at FROM snapshots") == saved_at
+
+
+def test_group_writes_keep_the_directories_loaded(tmpdir):
+    def api(payload):
+        if payload['method'] == 'hostgroup.get':
+            return {"result": [{"groupid": "31", "name": "admin"}]}
+        if payload['method'] == 'hostgroup.create':
+            return {"result": {"groupids": ["32"]}}
+        return {"result": {}}
+    zabbix = handler(api, inventory=inventory.Inventory(
+        str(tmpdir.join('inventory.db'))))
+    assert zabbix.find_group_id('admin') == '31'
+    assert zabbix.create_host_group('other') == '32'
+    zabbix.delete_host_group('31')
+    assert zabbix.inventory_version == zabbix.inventory.version()
+    assert zabbix.inventory.groups()[1] == {'other': '32'}
+    # The groups written by the handler itself are not reloaded
+    with mock.patch.object(zabbix.inventory, 'groups') as groups:
+        assert zabbix.find_group_id('other') == '32'
+    assert not groups.called
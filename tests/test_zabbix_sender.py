@@ -0,0 +1,171 @@
+import json
+import socket
+import struct
+import threading
+import time
+
+import mock
+
+from eszcp import spool
+from eszcp import zabbix_sender
+
+
+def info(processed, failed):
+    return {"response": "success",
+            "info": "processed: %d; failed: %d; total: %d; "
+                    "seconds spent: 0.000180"
+                    % (processed, failed, processed + failed)}
+
+
+def test_set_proxy_header_frames_json():
+    message = zabbix_sender.set_proxy_header({"request": "history data"})
+    body = json.dumps({"request": "history data"})
+    assert message[:5] == 'ZBXD\1'
+    assert struct.unpack('<Q', message[5:13])[0] == len(body)
+    assert message[13:] == body
+
+
+def test_parse_info():
+    assert zabbix_sender.parse_info(info(9, 2)) == (9, 2, 11)
+    assert zabbix_sender.parse_info({"info": "garbage"}) is None
+    assert zabbix_sender.parse_info({}) is None
+    assert zabbix_sender.parse_info(None) is None
+
+
+def test_add_flushes_full_batches():
+    sender = zabbix_sender.ZabbixSender('zabbix', 10051, 'ZCP01',
+                                        batch_size=2, flush_interval=60000)
+    with mock.patch.object(sender, 'request',
+                           return_value=info(2, 0)) as request:
+        sender.add('host', 'cpu_util', '1.0', clock=1)
+        assert not request.called
+        sender.add('host', 'cpu_util', '2.0', clock=2)
+    assert request.call_count == 1
+    data = request.call_args[0][0]
+    assert data["host"] == 'ZCP01'
+    assert [value["clock"] for value in data["data"]] == [1, 2]
+    assert sender.buffer == []
+
+
+def test_flush_retries_failed_chunks_only():
+    sender = zabbix_sender.ZabbixSender('zabbix', 10051, 'ZCP01',
+                                        batch_size=1, max_retries=1)
+    sender.buffer = [{"host": "a"}, {"host": "b"}]
+    responses = {"a": [info(1, 0)], "b": [info(0, 1), info(1, 0)]}
+
+    def request(data):
+        return responses[data["data"][0]["host"]].pop(0)
+    with mock.patch.object(sender, 'request', side_effect=request):
+        assert sender.flush() == []
+    assert responses == {"a": [], "b": []}
+
+
+def test_flush_never_resends_partially_processed_chunk():
+    sender = zabbix_sender.ZabbixSender('zabbix', 10051, 'ZCP01',
+                                        max_retries=3)
+    sender.buffer = [{"host": "a"}, {"host": "b"}]
+    with mock.patch.object(sender, 'request',
+                           return_value=info(1, 1)) as request:
+        assert sender.flush() == []
+    assert request.call_count == 1
+
+
+def test_flush_drops_values_after_retries():
+    sender = zabbix_sender.ZabbixSender('zabbix', 10051, 'ZCP01',
+                                        max_retries=2)
+    sender.buffer = [{"host": "a"}]
+    with mock.patch.object(sender, 'request',
+                           side_effect=socket.error('refused')) as request:
+        assert sender.flush() == [{"host": "a"}]
+    assert request.call_count == 3
+    assert sender.dropped == 1
+
+
+def serve_once(response):
+    """
+    Accept one connection, read a ZBXD request and answer it
+
+    :return: (port, thread, the requests received)
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    received = []
+
+    def serve():
+        conn, _ = server.accept()
+        header = conn.recv(13)
+        length = struct.unpack('<Q', header[5:13])[0]
+        body = ''
+        while len(body) < length:
+            body += conn.recv(length - len(body))
+        received.append(json.loads(body))
+        conn.sendall(response)
+        conn.close()
+        server.close()
+    thread = threading.Thread(target=serve)
+    thread.start()
+    return server.getsockname()[1], thread, received
+
+
+def test_connect_reads_framed_response():
+    port, thread, received = serve_once(
+        zabbix_sender.set_proxy_header(info(1, 0)))
+    sender = zabbix_sender.ZabbixSender('127.0.0.1', port, 'ZCP01',
+                                        timeout=5)
+    response = sender.request({"request": "history data", "data": []})
+    thread.join()
+    assert response == info(1, 0)
+    assert received == [{"request": "history data", "data": []}]
+
+
+def test_connect_rejects_invalid_header():
+    port, thread, _ = serve_once('HTTP/1.1 400 Bad Request\r\n\r\n')
+    sender = zabbix_sender.ZabbixSender('127.0.0.1', port, 'ZCP01',
+                                        timeout=5)
+    try:
+        sender.request({"request": "history data", "data": []})
+        assert False, "ValueError expected"
+    except ValueError:
+        pass
+    thread.join()
+
+
+def test_timed_out_response_is_neither_resent_nor_spooled():
+    store = mock.Mock()
+    sender = zabbix_sender.ZabbixSender('zabbix', 10051, 'ZCP01',
+                                        max_retries=3, spool=store)
+    sender.buffer = [{"host": "a"}]
+    timeout = zabbix_sender.DeliveryUnknown('timed out')
+    with mock.patch.object(sender, 'request',
+                           side_effect=timeout) as request:
+        assert sender.flush() == []
+    assert request.call_count == 1
+    assert not store.append.called
+    assert sender.unknown == 1
+
+
+def test_connect_times_out_after_sending():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    sender = zabbix_sender.ZabbixSender('127.0.0.1',
+                                        server.getsockname()[1], 'ZCP01',
+                                        timeout=0.2)
+    try:
+        sender.request({"request": "history data", "data": []})
+        assert False, "DeliveryUnknown expected"
+    except zabbix_sender.DeliveryUnknown:
+        pass
+    finally:
+        server.close()
+
+
+def test_replay_stops_at_the_deadline(tmpdir):
+    sender = zabbix_sender.ZabbixSender(
+        'zabbix', 10051, 'ZCP01', spool=spool.Spool(str(tmpdir)),
+        replay_batch_size=1, replay_rate=0)
+    sender.spool.append([{"host": "a"}, {"host": "b"}])
+    with mock.patch.object(sender, 'request', return_value=info(1, 0)):
+        assert sender.replay(deadline=time.time() - 1) == 0
+        assert sender.replay() == 2